@@ -5,30 +5,34 @@ import time
 import streamlit as st
 import pandas as pd
 
-# For retrieval embeddings and FAISS index
-from sentence_transformers import SentenceTransformer
-import faiss
-
 # Import your own modules
-from data_acquisition import download_and_save_topic_to_db
-from db import get_session
-from models import Topic, Document
-from cache_utils import cached_fetch_topic, normalize_topic
-from generation import load_generator, generate_response
+from db import session_scope
+from models import Topic
+from data_access import find_topic, get_documents_by_ids
+from ingest_jobs import ACTIVE, get_job_queue, submit_fetch
+from generation import BACKENDS, DECODING_PRESETS, stream_response, timed_stream
+from model_registry import REGISTRY, get_embedding_model, get_generator, get_tokenizer, get_batching_generator, generate_batched, batching_stats
+from embedding_store import DEFAULT_EMBEDDING_MODEL, documents_without_embeddings, update_embeddings
+from index_store import GLOBAL_INDEX, GLOBAL_PASSAGE_INDEX, topic_index_name, open_index, update_index, update_topic_index
+from context_builder import build_context
+from passages import PASSAGE_FANOUT, aggregate_passages, update_missing_passages
+from lexical_index import open_lexical_index, update_lexical_index, update_topic_lexical_index, reciprocal_rank_fusion
+from metadata_index import open_metadata, update_metadata
+import metrics
+from metrics import span, trace
+from reranker import RERANK_CANDIDATES, rerank
+from result_cache import cached_search, cached_keyword_search, cached_query_embedding, cached_answer, lookup_answer, store_answer, cache_stats
 
 # ----------------- Helper Functions -----------------
 
 def get_all_topics():
-    """Fetch all topics from the PostgreSQL database."""
-    session = get_session()
+    """Fetch the id, name and document count of all topics from the PostgreSQL database."""
     try:
-        topics = session.query(Topic).all()
+        with session_scope() as session:
+            return session.query(Topic.id, Topic.name, Topic.document_count).order_by(Topic.name).all()
     except Exception as e:
         st.error(f"Error retrieving topics: {e}")
-        topics = []
-    finally:
-        session.close()
-    return topics
+        return []
 
 def display_topics_summary():
     """Display a summary table of topics and their document counts."""
@@ -56,25 +60,38 @@ def acquisition_tab():
         if not topics:
             st.error("Please enter at least one valid topic.")
         else:
-            errors = []
+            # Fetching runs in background workers, so it continues if this tab is closed.
+            fetch_interval = 0 if force_refresh else 3600
             for topic in topics:
-                try:
-                    with st.spinner(f"Fetching documents for '{topic}' ..."):
-                        # Use caching with incremental fetching. If force_refresh is checked, bypass cache.
-                        fetch_interval = 0 if force_refresh else 3600
-                        data, from_cache = cached_fetch_topic(topic, total_requested=int(num_docs), fetch_interval=fetch_interval)
-                        if from_cache:
-                            st.info(f"Using cached data for topic '{topic}'.")
-                        else:
-                            st.success(f"Fetched fresh data for topic '{topic}'.")
-                except Exception as e:
-                    errors.append(f"Error fetching topic '{topic}': {e}")
-            if errors:
-                for err in errors:
-                    st.error(err)
-            display_topics_summary()
-    else:
-        display_topics_summary()
+                job_id, created = submit_fetch(topic, total_requested=int(num_docs), fetch_interval=fetch_interval)
+                if job_id is None:
+                    st.info(f"Using cached data for topic '{topic}'.")
+                elif created:
+                    st.success(f"Queued job {job_id} for topic '{topic}'.")
+                else:
+                    st.info(f"Topic '{topic}' is already being fetched (job {job_id}).")
+    display_jobs()
+    display_topics_summary()
+
+@st.fragment(run_every=2)
+def display_jobs():
+    """Show recent ingest jobs with their progress; refreshes itself while the tab is open."""
+    jobs = get_job_queue()
+    recent = jobs.list(limit=10)
+    if not recent:
+        return
+    st.subheader("Ingest Jobs")
+    for job in recent:
+        cols = st.columns([4, 2, 1])
+        stage = f" ({job['stage']})" if job['stage'] else ""
+        cols[0].write(f"#{job['id']} {job['topic']}: {job['status']}{stage}")
+        if job['error']:
+            cols[0].caption(job['error'])
+        cols[1].progress(min(1.0, job['embedded'] / max(1, job['total'])),
+                         text=f"{job['stored']} stored, {job['embedded']} embedded of {job['total']}")
+        if job['status'] in ACTIVE and not job['cancel_requested']:
+            if cols[2].button("Cancel", key=f"cancel-job-{job['id']}"):
+                jobs.cancel(job['id'])
 
 # ----------------- Main App Tab (Retrieval and Generation) -----------------
 
@@ -88,69 +105,243 @@ def main_app_tab():
     # Model selection and generation parameters
     model_option = st.selectbox("Select generative model", options=["t5-small", "t5-base", "t5-large"], index=0)
     max_length = st.slider("Max generated length", min_value=50, max_value=500, value=150, step=10)
-    num_beams = st.slider("Number of beams", min_value=1, max_value=10, value=4, step=1)
+    stream = st.checkbox("Stream the answer", value=True,
+                         help="Shows tokens as they are generated. Beam search cannot stream, so this decodes greedily.")
+    # Streaming always decodes greedily, so the beam settings only apply without it.
+    num_beams = st.slider("Number of beams", min_value=1, max_value=10, value=4, step=1, disabled=stream,
+                          help="Uncheck streaming to use beam search.")
+    preset = st.selectbox("Decoding preset (overrides beams)", options=["custom"] + list(DECODING_PRESETS), index=0,
+                          disabled=stream, help="Uncheck streaming to use beam search.")
+    if preset != "custom":
+        num_beams = DECODING_PRESETS[preset]['num_beams']
+    backend = st.selectbox("Inference backend", options=list(BACKENDS), index=0,
+                           help="int8 quantizes the Linear layers; onnx needs optimum[onnxruntime].")
     top_k = st.slider("Number of documents to retrieve", min_value=1, max_value=10, value=3, step=1)
+    unit = st.radio("Retrieve by", options=["passage", "document"], index=0, horizontal=True,
+                    help="Passages give finer matches; documents are ranked by their best passage.")
+    search_mode = st.radio("Search mode", options=["hybrid", "dense", "keyword"], index=0, horizontal=True,
+                           help="Keyword search uses BM25 only and never loads the embedding model; "
+                                "hybrid fuses the dense and keyword rankings.")
+    use_rerank = st.checkbox("Re-rank with a cross-encoder", value=False,
+                             help="Scores the first-stage candidates with a cross-encoder and keeps the best ones.")
+    rerank_candidates = top_k
+    if use_rerank:
+        rerank_candidates = st.slider("Candidates to re-rank", min_value=top_k, max_value=50,
+                                      value=max(top_k, RERANK_CANDIDATES), step=1)
     
-    if query and topic_for_context:
-        # Load documents from the database for the given topic
-        session = get_session()
-        topic_id = session.query(Topic.id).filter(Topic.name.ilike(f"%{topic_for_context.strip().lower()}%")).scalar()
-        if topic_id is None:
-            st.warning("No documents found for the given topic. Please fetch documents for this topic using the Data Acquisition tab.")
-            session.close()
-            return
-
-        docs = session.query(Document).filter(Document.topic_id == topic_id).all()
-        session.close()
-        
-        if not docs:
-            st.warning("No documents found for the given topic. Please fetch documents for this topic using the Data Acquisition tab.")
-            return
+    search_all = st.checkbox("Search across all topics", value=False,
+                             help="Searches the global index; narrow it down with the filters below.")
+    filters = {}
+    if search_all:
+        with st.expander("Filters"):
+            topic_ids = {t.name: t.id for t in get_all_topics()}
+            selected_topics = st.multiselect("Topics", options=sorted(topic_ids))
+            author = st.text_input("Author name contains")
+            date_range = st.date_input("Fetched between", value=())
+            filters = {
+                'topic_ids': [topic_ids[name] for name in selected_topics],
+                'author': author.strip() or None,
+                'date_from': date_range[0] if len(date_range) > 0 else None,
+                'date_to': date_range[1] if len(date_range) > 1 else None,
+            }
+    
+    if query and (search_all or topic_for_context):
+        # Every stage below is timed into the metrics and this request's trace.
+        with trace("query") as request:
+            with session_scope() as session:
+                topic = None
+                doc_filter = passage_filter = None
+                if search_all:
+                    index_name = GLOBAL_PASSAGE_INDEX if unit == "passage" else GLOBAL_INDEX
+                    lexical_name = GLOBAL_INDEX
+                    # Filters are evaluated on in-memory metadata arrays and the resulting id
+                    # sets are applied inside the searches, so no documents are read up front.
+                    metadata = open_metadata()
+                    if metadata is None:
+                        update_metadata(session)
+                        metadata = open_metadata()
+                    doc_filter = metadata.select(**filters)
+                    if doc_filter is not None:
+                        passage_filter = metadata.passage_ids_for(doc_filter)
+                        st.write(f"{len(doc_filter)} documents match the filters.")
+                else:
+                    # Documents are not loaded up front; only the hits are read after the search.
+                    topic = find_topic(session, topic_for_context)
+                    if topic is None or not topic.document_count:
+                        st.warning("No documents found for the given topic. Please fetch documents for this topic using the Data Acquisition tab.")
+                        return
 
-        # Prepare document texts for retrieval.
-        doc_texts = [doc.text for doc in docs]
-        st.write(f"Loaded {len(doc_texts)} documents for topic '{topic_for_context}'.")
-        
-        # Build embeddings with a SentenceTransformer model.
-        embed_model = SentenceTransformer('all-MiniLM-L6-v2')
-        embeddings = embed_model.encode(doc_texts, convert_to_numpy=True)
-        dim = embeddings.shape[1]
-        
-        # Build a FAISS index from the embeddings.
-        index = faiss.IndexFlatL2(dim)
-        index.add(embeddings)
+                    st.write(f"Searching {topic.document_count} documents for topic '{topic.name}'.")
+                    index_name = topic_index_name(topic.id, level=unit)
+                    lexical_name = topic_index_name(topic.id)
         
-        # Embed the user's query.
-        query_embedding = embed_model.encode([query], convert_to_numpy=True)
-        distances, indices = index.search(query_embedding, top_k)
-        
-        # Retrieve the most similar documents.
-        retrieved_docs = [docs[i] for i in indices[0] if i < len(docs)]
+                retrieval_start = time.perf_counter()
+                # Hybrid search fuses deeper candidate lists than it returns; re-ranking needs
+                # rerank_candidates documents out of the first stage.
+                first_stage_k = rerank_candidates if use_rerank else top_k
+                candidates = first_stage_k * 2 if search_mode == "hybrid" else first_stage_k
+                dense_ids, keyword_ids, passages_by_doc = [], [], {}
+                embed_model = None
+                if search_mode != "keyword":
+                    embed_model = get_embedding_model(DEFAULT_EMBEDDING_MODEL)
+                    if topic is not None:
+                        # Embeddings and the topic index are maintained at ingest time; only
+                        # documents stored before that are found (by anti-join) and encoded here.
+                        with span("index_maintenance"):
+                            encoded_ids = update_embeddings(session, documents_without_embeddings(session, topic.id),
+                                                            model=embed_model)
+                            encoded_passages = update_missing_passages(session, topic.id, model=embed_model)
+                            if encoded_passages:
+                                update_metadata(session)
+                            if encoded_ids or encoded_passages or open_index(index_name) is None:
+                                update_topic_index(session, topic.name, refresh_ids=encoded_ids)
+                    elif open_index(index_name) is None:
+                        update_index(session, index_name, level=unit)
+            
+                    # Search the memory-mapped index; repeated queries are served from the cache.
+                    if unit == "passage":
+                        # Search several passages per document, then rank documents by their best passage.
+                        ids, distances, _ = cached_search(query, index_name, candidates * PASSAGE_FANOUT, embed_model,
+                                                          DEFAULT_EMBEDDING_MODEL, ids=passage_filter)
+                        ranked = aggregate_passages(session, ids, distances, top_k=candidates)
+                        dense_ids = [doc_id for doc_id, _, _ in ranked]
+                        passages_by_doc = {doc_id: passages for doc_id, _, passages in ranked}
+                    else:
+                        # The index returns Document ids directly.
+                        dense_ids, _, _ = cached_search(query, index_name, candidates, embed_model, DEFAULT_EMBEDDING_MODEL,
+                                                        ids=doc_filter)
+                if search_mode != "dense":
+                    # BM25 over titles, abstracts and authors catches exact names the dense model misses.
+                    if open_lexical_index(lexical_name) is None:
+                        if topic is not None:
+                            update_topic_lexical_index(session, topic.name)
+                        else:
+                            update_lexical_index(session, GLOBAL_INDEX)
+                    keyword_ids, _, _ = cached_keyword_search(query, lexical_name, candidates, ids=doc_filter)
         
-        st.subheader("Retrieved Documents")
-        for doc in retrieved_docs:
-            # Display a hyperlink with the document title that points to the PDF link.
-            st.markdown(f"[{doc.title}]({doc.pdf_link})", unsafe_allow_html=True)
+                if search_mode == "hybrid":
+                    ranked_ids, _ = reciprocal_rank_fusion([dense_ids, keyword_ids], top_k=first_stage_k)
+                else:
+                    ranked_ids = (dense_ids or keyword_ids)[:first_stage_k]
+                # Only the hits are read, in one IN query; abstracts are loaded only for
+                # documents that have no matched passages to stand in for them.
+                docs = get_documents_by_ids(session, ranked_ids,
+                                            with_text=any(i not in passages_by_doc for i in ranked_ids))
+            docs_by_id = {doc.id: doc for doc in docs}
+            ranked_ids = [i for i in ranked_ids if i in docs_by_id]
+            latency = [f"retrieval {(time.perf_counter() - retrieval_start) * 1000:.0f} ms"]
         
-        # Combine the retrieved document texts to form context.
-        context = " ".join([doc.text for doc in retrieved_docs])
-        st.subheader("Context Used for Generation")
-        st.write(context[:500] + " ...")  # Display first 500 characters
+            if use_rerank:
+                # Documents found through their passages are judged on those passages.
+                texts = [(i, " ".join(p.text for p in passages_by_doc[i]) if i in passages_by_doc else docs_by_id[i].text)
+                         for i in ranked_ids]
+                ranked_ids, rerank_stats = rerank(query, texts, top_k=top_k)
+                latency.append(f"re-rank {rerank_stats['rerank_ms']:.0f} ms ({rerank_stats['scored']} scored, "
+                               f"{rerank_stats['cached']} cached, {rerank_stats['skipped']} over budget)")
+            retrieved_docs = [docs_by_id[i] for i in ranked_ids]
+            # Documents found through their passages contribute only those passages to the context.
+            context_units = [p for doc in retrieved_docs for p in passages_by_doc.get(doc.id, [doc])]
         
-        # Load the generative model.
-        with st.spinner("Loading generative model..."):
-            gen_model, tokenizer = load_generator(model_name=model_option)
+            st.subheader("Retrieved Documents")
+            for doc in retrieved_docs:
+                # Display a hyperlink with the document title that points to the PDF link.
+                st.markdown(f"[{doc.title}]({doc.pdf_link})", unsafe_allow_html=True)
         
-        # Generate an answer based on the query and context.
-        with st.spinner("Generating answer..."):
-            answer = generate_response(query, context, gen_model, tokenizer, max_length=max_length, num_beams=num_beams)
+            # Pack the sentences most similar to the query into the generator's input budget.
+            context_start = time.perf_counter()
+            with span("context_build"):
+                # The vector the dense search used (cached, also when the search itself was a cache hit).
+                query_embedding = None
+                if embed_model is not None:
+                    query_embedding = cached_query_embedding(query, embed_model, DEFAULT_EMBEDDING_MODEL)
+                context, context_tokens = build_context(query, context_units, get_tokenizer(model_option), embed_model,
+                                                        query_embedding=query_embedding)
+            latency.append(f"context {(time.perf_counter() - context_start) * 1000:.0f} ms")
+            st.subheader("Context Used for Generation")
+            st.write(context[:500] + " ...")  # Display first 500 characters
+            st.caption(f"{context_tokens} context tokens from {len(context_units)} passages or documents.")
+            st.caption("Latency: " + ", ".join(latency))
         
-        st.subheader("Generated Answer")
-        st.write(answer)
+            doc_ids = [doc.id for doc in retrieved_docs]
+            st.subheader("Generated Answer")
+            if stream:
+                # Streaming decodes greedily, so the cache key records a single beam.
+                params = dict(max_length=max_length, num_beams=1, backend=backend, unit=unit, search_mode=search_mode)
+                answer = lookup_answer(query, doc_ids, model_option, **params)
+                if answer is not None:
+                    st.write(answer)
+                    st.caption("Answer served from cache.")
+                else:
+                    with st.spinner("Loading generative model..."):
+                        model, tokenizer = get_generator(model_option, backend=backend)
+                    timings = {}
+                    answer = st.write_stream(timed_stream(
+                        stream_response(query, context, model, tokenizer, max_length=max_length), timings))
+                    store_answer(answer, query, doc_ids, model_option, **params)
+                    if timings['ttft_s'] is not None:
+                        st.caption(f"Time to first token: {timings['ttft_s']:.2f} s, total: {timings['total_s']:.2f} s")
+            else:
+                def generate():
+                    # Get the generative model; it is only loaded from disk once per process.
+                    with st.spinner("Loading generative model..."):
+                        get_batching_generator(model_name=model_option, backend=backend)
+                    # Concurrent sessions are batched into shared generate calls.
+                    with st.spinner("Generating answer..."):
+                        return generate_batched(query, context, model_name=model_option, backend=backend,
+                                                max_length=max_length, num_beams=num_beams)
+
+                # Generate an answer based on the query and context, unless an identical request was answered before.
+                start = time.perf_counter()
+                answer, from_cache = cached_answer(query, doc_ids, model_option, generate,
+                                                   max_length=max_length, num_beams=num_beams, backend=backend,
+                                                   unit=unit, search_mode=search_mode)
+                st.write(answer)
+                if from_cache:
+                    st.caption("Answer served from cache.")
+                else:
+                    st.caption(f"Total latency: {time.perf_counter() - start:.2f} s")
+        with st.expander("Request trace"):
+            if request['spans']:
+                st.dataframe(pd.DataFrame(request['spans']))
+            st.caption(f"Total {request['total_ms']:.0f} ms, "
+                       f"{request['counters'].get('db_statements_total', 0)} database statements.")
+            if request['profile']:
+                st.caption(f"Profile saved to {request['profile']}")
     else:
         st.info("Please enter a research query and a topic for context.")
 
 
+def display_model_stats():
+    """Show the models held by the shared registry with their load time and size."""
+    stats = REGISTRY.stats()
+    if stats:
+        with st.sidebar.expander("Loaded models"):
+            st.dataframe(pd.DataFrame(stats))
+            st.caption(f"Resident: {REGISTRY.resident_bytes() / 2**20:.0f} MB, evictions: {REGISTRY.evictions}")
+    batchers = batching_stats()
+    if batchers:
+        with st.sidebar.expander("Generation batching"):
+            st.dataframe(pd.DataFrame(batchers))
+
+def display_cache_stats():
+    """Show hit rates of the answer, retrieval and query embedding caches."""
+    with st.sidebar.expander("Result caches"):
+        st.dataframe(pd.DataFrame(cache_stats()).T)
+
+def display_metrics():
+    """Show per-stage latency percentiles and offer the metrics for download."""
+    with st.sidebar.expander("Metrics"):
+        histograms = metrics.REGISTRY.snapshot()['histograms']
+        stages = [h for h in histograms if h['name'] == "stage_seconds"]
+        if stages:
+            st.dataframe(pd.DataFrame([
+                {'stage': h['labels']['stage'], 'count': h['count'],
+                 **{p: h[p] * 1000 for p in ('p50', 'p95', 'p99')}} for h in stages
+            ]))
+            st.caption("Latency percentiles in milliseconds.")
+        st.download_button("Prometheus text", metrics.to_prometheus(), file_name="metrics.prom")
+        st.download_button("JSON", metrics.to_json(indent=2), file_name="metrics.json")
+
 # ----------------- Main Function -----------------
 
 def main():
@@ -162,6 +353,10 @@ def main():
     
     with tab2:
         main_app_tab()
+    
+    display_model_stats()
+    display_cache_stats()
+    display_metrics()
 
 if __name__ == "__main__":
     main()
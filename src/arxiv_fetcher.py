@@ -0,0 +1,213 @@
+# src/arxiv_fetcher.py
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import feedparser
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import incr, observe
+
+# Point this at a local stub server (see arxiv_stub_server.py) to ingest offline.
+ARXIV_API_URL = os.environ.get("ARXIV_API_URL", "http://export.arxiv.org/api/query")
+# arXiv asks clients to wait about 3 seconds between requests.
+ARXIV_MIN_INTERVAL = float(os.environ.get("ARXIV_MIN_INTERVAL", "3.0"))
+CHECKPOINT_DIR = os.environ.get(
+    "ARXIV_CHECKPOINT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'checkpoints')
+)
+
+# Status codes worth retrying: rate limiting and transient server errors.
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class RateLimiter:
+    """
+    Global, thread-safe limiter that spaces request start times at least
+    min_interval seconds apart, however many threads are fetching.
+    """
+
+    def __init__(self, min_interval=ARXIV_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_allowed = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_allowed)
+            self._next_allowed = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+def make_session(pool_size=8):
+    """Create a requests session whose connections are pooled and reused."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def checkpoint_path(topic, checkpoint_dir=CHECKPOINT_DIR):
+    """Path of the resume checkpoint for a topic."""
+    slug = "".join(c if c.isalnum() else "_" for c in topic.strip().lower())
+    return os.path.join(checkpoint_dir, f"{slug}.json")
+
+def load_checkpoint(topic, end, checkpoint_dir=CHECKPOINT_DIR):
+    """
+    Return (next_offset, stored_ids) of an interrupted fetch of the topic, or None.
+    A checkpoint only applies to a fetch with the same end offset.
+    """
+    path = checkpoint_path(topic, checkpoint_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    if state.get('end') != end:
+        return None
+    return state['next_offset'], state.get('stored_ids', [])
+
+def save_checkpoint(topic, next_offset, end, checkpoint_dir=CHECKPOINT_DIR, stored_ids=()):
+    """
+    Record that every page of the topic before next_offset has been processed,
+    along with the ids the consumer stored for those pages.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = checkpoint_path(topic, checkpoint_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'topic': topic, 'next_offset': next_offset, 'end': end, 'stored_ids': list(stored_ids)}, f)
+    os.replace(tmp_path, path)
+
+def clear_checkpoint(topic, checkpoint_dir=CHECKPOINT_DIR):
+    path = checkpoint_path(topic, checkpoint_dir)
+    if os.path.exists(path):
+        os.remove(path)
+
+class ArxivFetcher:
+    """
+    Concurrent arXiv API client.
+
+    Pages of one or more topics are fetched by a bounded thread pool over a
+    pooled HTTP session. A global rate limiter keeps the client polite, failed
+    requests are retried with exponential backoff, and each topic's progress
+    is checkpointed so an interrupted ingest resumes where it stopped.
+    """
+
+    def __init__(self, base_url=ARXIV_API_URL, page_size=100, max_workers=4,
+                 min_interval=ARXIV_MIN_INTERVAL, max_retries=4, backoff=1.0,
+                 timeout=30, checkpoint_dir=CHECKPOINT_DIR):
+        self.base_url = base_url
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.checkpoint_dir = checkpoint_dir
+        self.rate_limiter = RateLimiter(min_interval)
+        self.session = make_session(pool_size=max_workers)
+
+    def fetch_page(self, search_query, start, max_results):
+        """Fetch and parse one page of results, retrying transient failures."""
+        params = {'search_query': f"all:{search_query}", 'start': start, 'max_results': max_results}
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait()
+            sent_at = time.perf_counter()
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+                observe("arxiv_fetch_seconds", time.perf_counter() - sent_at)
+                incr("arxiv_requests_total", status=str(response.status_code))
+                if response.status_code == 200:
+                    return feedparser.parse(response.text).entries
+                if response.status_code not in RETRY_STATUS:
+                    raise Exception(f"Error querying arXiv API: {response.status_code}")
+                error = Exception(f"Error querying arXiv API: {response.status_code}")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                observe("arxiv_fetch_seconds", time.perf_counter() - sent_at)
+                incr("arxiv_requests_total", status=type(e).__name__)
+                error = e
+            if attempt < self.max_retries:
+                # Exponential backoff with jitter so retries from several threads spread out.
+                time.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+        raise error
+
+    def iter_pages(self, topics, total_results=50, start=0, checkpoint=True, page_size=None, stored=None):
+        """
+        Fetch total_results entries for each topic, concurrently across pages and topics.
+
+        Yields (topic, offset, entries) in offset order for each topic.
+        With checkpoint=True, a page counts as processed once the consumer asks
+        for the next one, and only then is the topic's checkpoint advanced past
+        it; topics whose checkpoint shows an interrupted fetch resume from there.
+
+        stored, if given, is a { topic: [ids] } dict the consumer extends with
+        the ids it stored for each page. It is saved with every checkpoint,
+        and filled with the ids of the already processed pages on resume, so
+        it always covers the whole range from start.
+        """
+        page_size = page_size or self.page_size
+        end = start + total_results
+        next_offset = {}
+        for topic in topics:
+            state = load_checkpoint(topic, end, self.checkpoint_dir) if checkpoint else None
+            next_offset[topic] = state[0] if state is not None else start
+            if stored is not None:
+                stored[topic] = list(state[1]) if state is not None else []
+
+        ready = {topic: {} for topic in topics}
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = {}
+            for topic in topics:
+                for offset in range(next_offset[topic], end, page_size):
+                    size = min(page_size, end - offset)
+                    future = executor.submit(self.fetch_page, topic, offset, size)
+                    futures[future] = (topic, offset)
+
+            for future in as_completed(futures):
+                topic, offset = futures[future]
+                ready[topic][offset] = future.result()
+                # Hand out this topic's pages in order, as far as they are contiguous.
+                while next_offset[topic] in ready[topic]:
+                    offset = next_offset[topic]
+                    entries = ready[topic].pop(offset)
+                    yield topic, offset, entries
+                    next_offset[topic] = min(offset + page_size, end)
+                    if not checkpoint:
+                        continue
+                    if next_offset[topic] >= end:
+                        clear_checkpoint(topic, self.checkpoint_dir)
+                    else:
+                        save_checkpoint(topic, next_offset[topic], end, self.checkpoint_dir,
+                                        stored_ids=stored[topic] if stored is not None else ())
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def fetch_topics(self, topics, total_results=50, start=0, page_size=None):
+        """
+        Fetch several topics concurrently. Returns { topic: [entries] }.
+        Nothing is persisted per page here, so no checkpoint is kept.
+        """
+        results = {topic: [] for topic in topics}
+        for topic, _, entries in self.iter_pages(topics, total_results, start=start,
+                                                 checkpoint=False, page_size=page_size):
+            results[topic].extend(entries)
+        return results
+
+    def fetch_topic(self, topic, total_results=50, start=0, page_size=None):
+        """Fetch one topic. Returns its entries in result order."""
+        return self.fetch_topics([topic], total_results, start=start, page_size=page_size)[topic]
+
+_DEFAULT_FETCHER = None
+_DEFAULT_LOCK = threading.Lock()
+
+def get_fetcher():
+    """Shared fetcher, so every caller reuses one connection pool and rate limiter."""
+    global _DEFAULT_FETCHER
+    with _DEFAULT_LOCK:
+        if _DEFAULT_FETCHER is None:
+            _DEFAULT_FETCHER = ArxivFetcher()
+        return _DEFAULT_FETCHER
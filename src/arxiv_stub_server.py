@@ -0,0 +1,116 @@
+# src/arxiv_stub_server.py
+"""
+Local stand-in for the arXiv API that replays the feeds saved in data/raw/.
+
+Run it and point the fetcher at it:
+    python arxiv_stub_server.py --port 8099
+    ARXIV_API_URL=http://localhost:8099/api/query ARXIV_MIN_INTERVAL=0 python data_acquisition.py
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'raw')
+
+def load_corpora(data_dir=DEFAULT_DATA_DIR):
+    """
+    Load the saved feeds. Returns { topic: [documents] } where the topic is
+    taken from the file name, e.g. arxiv_deep_learning_documents.json -> "deep learning".
+    """
+    corpora = {}
+    for path in sorted(glob.glob(os.path.join(data_dir, "arxiv_*_documents.json"))):
+        name = os.path.basename(path)[len("arxiv_"):-len("_documents.json")]
+        with open(path, 'r', encoding='utf-8') as f:
+            corpora[name.replace("_", " ")] = json.load(f)
+    return corpora
+
+def select_documents(corpora, search_query):
+    """Documents for a search_query like 'all:deep learning'."""
+    topic = search_query.split(":", 1)[-1].strip().lower()
+    if topic in corpora:
+        return corpora[topic]
+    # Unknown topics fall back to a keyword filter over the combined corpus.
+    pool = corpora.get("combined", [doc for docs in corpora.values() for doc in docs])
+    return [doc for doc in pool if topic in doc['text'].lower()]
+
+def render_feed(documents):
+    """Render documents as a minimal Atom feed in the shape the arXiv API returns."""
+    entries = []
+    for doc in documents:
+        abs_link = doc['pdf_link'].replace("/pdf/", "/abs/")
+        if abs_link.endswith(".pdf"):
+            abs_link = abs_link[:-len(".pdf")]
+        # Saved texts are "title. summary"; strip the title back off.
+        summary = doc['text'][len(doc['title']) + 2:] if doc['text'].startswith(doc['title']) else doc['text']
+        authors = "".join(f"<author><name>{escape(a)}</name></author>" for a in doc['authors'])
+        entries.append(
+            f"<entry><id>{escape(abs_link)}</id><title>{escape(doc['title'])}</title>"
+            f"<summary>{escape(summary)}</summary>{authors}</entry>"
+        )
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<feed xmlns="http://www.w3.org/2005/Atom">' + "".join(entries) + '</feed>')
+
+def make_handler(corpora, fail_rate=0.0):
+    """Build a request handler class serving the given corpora, failing fail_rate of requests with 503."""
+    lock = threading.Lock()
+    stats = {'requests': 0, 'failures': 0}
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/api/query":
+                self.send_error(404)
+                return
+            with lock:
+                stats['requests'] += 1
+                fail = random.random() < fail_rate
+                if fail:
+                    stats['failures'] += 1
+            if fail:
+                self.send_error(503)
+                return
+
+            params = parse_qs(url.query)
+            start = int(params.get('start', ['0'])[0])
+            max_results = int(params.get('max_results', ['10'])[0])
+            documents = select_documents(corpora, params.get('search_query', [''])[0])
+            body = render_feed(documents[start:start + max_results]).encode('utf-8')
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/atom+xml; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    StubHandler.stats = stats
+    return StubHandler
+
+def start_stub_server(port=0, data_dir=DEFAULT_DATA_DIR, fail_rate=0.0):
+    """
+    Start the stub server on a background thread.
+    Returns (server, base_url); call server.shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(load_corpora(data_dir), fail_rate))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/query"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay data/raw arXiv feeds over HTTP.")
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="Fraction of requests answered with 503.")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(load_corpora(args.data_dir), args.fail_rate))
+    print(f"Serving stub arXiv API on http://127.0.0.1:{args.port}/api/query")
+    server.serve_forever()
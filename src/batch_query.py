@@ -0,0 +1,247 @@
+# src/batch_query.py
+"""
+Answer a file of questions without the Streamlit app.
+
+Queries are read from JSONL or CSV with a "query" field and optional "id",
+"topic" (omit for the global index) and "model" fields. All queries of a
+chunk are encoded in one call and searched with one query matrix per
+index; generation is batched per model and spread over worker processes.
+Results are appended to a JSONL file as they complete, and a re-run skips
+the ids already in it, so an interrupted job resumes where it stopped.
+Resuming relies on stable ids: rows without an "id" get one derived from
+their query, topic and model, which survives edits to the rest of the file.
+    python batch_query.py questions.jsonl answers.jsonl --workers 4 --batch-size 8
+"""
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from db import session_scope
+from data_access import find_topic, get_documents_by_ids
+from embedding_store import DEFAULT_EMBEDDING_MODEL, encode_texts
+from index_store import GLOBAL_INDEX, GLOBAL_PASSAGE_INDEX, topic_index_name, open_index, search_index
+from passages import PASSAGE_FANOUT, aggregate_passages
+from context_builder import build_context
+from generation import configure_threads, generate_batch
+from metrics import write_metrics
+from model_registry import get_embedding_model, get_generator, get_tokenizer
+
+def read_queries(path, default_model="t5-small"):
+    """
+    Load queries from a .jsonl or .csv file. Missing ids are "q-" plus a
+    digest of the query, topic and model, so they stay the same when other
+    rows are added or removed. Ids are the resume key of the output file, so
+    a repeated explicit id is rejected; a repeated question without an id is
+    asked once.
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    queries, seen = [], {}
+    for n, row in enumerate(rows):
+        if not row.get('query'):
+            continue
+        query = {
+            'query': row['query'],
+            'topic': row.get('topic') or None,
+            'model': row.get('model') or default_model,
+        }
+        if row.get('id') not in (None, ''):
+            query_id = str(row['id'])
+        else:
+            digest = hashlib.sha1(json.dumps(query, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+            query_id = f"q-{digest}"
+            if query_id in seen:
+                continue
+        if query_id in seen:
+            raise ValueError(f"Duplicate query id '{query_id}' in {path} (rows {seen[query_id]} and {n})")
+        seen[query_id] = n
+        queries.append({'id': query_id, **query})
+    return queries
+
+def completed_ids(output_path):
+    """
+    Ids already answered in the output file. Queries that failed (e.g. a
+    missing index) are retried, and a truncated last line is ignored.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'answer' in record:
+                done.add(str(record['id']))
+    return done
+
+def retrieve(session, queries, embed_model, top_k=3, unit="passage"):
+    """
+    Retrieve context units for a list of queries.
+    The queries are encoded in one call, and each index (topic or global) is
+    searched once with the matrix of all its queries.
+
+    Returns one (document_ids, context_units, query_embedding) tuple per
+    query, or an error string where the query's index is missing.
+    """
+    embeddings = encode_texts(embed_model, [q['query'] for q in queries])
+    groups = {}
+    for row, q in enumerate(queries):
+        if q['topic'] is None:
+            name = GLOBAL_PASSAGE_INDEX if unit == "passage" else GLOBAL_INDEX
+        else:
+            topic = find_topic(session, q['topic'])
+            name = topic_index_name(topic.id, level=unit) if topic is not None else None
+        groups.setdefault(name, []).append(row)
+
+    k = top_k * PASSAGE_FANOUT if unit == "passage" else top_k
+    hits = [None] * len(queries)
+    for name, rows in groups.items():
+        index = open_index(name) if name is not None else None
+        if index is None:
+            for row in rows:
+                topic = queries[row]['topic']
+                hits[row] = f"No index for topic '{topic}'" if topic else "The global index has not been built"
+            continue
+        distances, ids = search_index(index, embeddings[rows], k)
+        for i, row in enumerate(rows):
+            keep = ids[i] != -1
+            hits[row] = (ids[i][keep], distances[i][keep])
+
+    ranked, passages_by_query = [], []
+    for hit in hits:
+        if isinstance(hit, str):
+            ranked.append(hit)
+            passages_by_query.append({})
+        elif unit == "passage":
+            scored = aggregate_passages(session, hit[0], hit[1], top_k=top_k)
+            ranked.append([doc_id for doc_id, _, _ in scored])
+            passages_by_query.append({doc_id: passages for doc_id, _, passages in scored})
+        else:
+            ranked.append([int(i) for i in hit[0]])
+            passages_by_query.append({})
+
+    # One query for the documents of the whole chunk.
+    docs_by_id = {doc.id: doc for doc in get_documents_by_ids(
+        session, sorted({i for doc_ids in ranked if not isinstance(doc_ids, str) for i in doc_ids}),
+        with_text=unit == "document")}
+    results = []
+    for doc_ids, passages, embedding in zip(ranked, passages_by_query, embeddings):
+        if isinstance(doc_ids, str):
+            results.append(doc_ids)
+            continue
+        doc_ids = [i for i in doc_ids if i in docs_by_id]
+        units = [p for i in doc_ids for p in passages.get(i, [docs_by_id[i]])]
+        results.append((doc_ids, units, embedding))
+    return results
+
+def _init_worker(threads):
+    configure_threads(threads)
+
+def generate_items(model_name, backend, items, max_length, num_beams):
+    """Generate answers for a list of (id, query, context); runs in a worker process."""
+    model, tokenizer = get_generator(model_name, backend=backend)
+    answers = generate_batch([item[1] for item in items], [item[2] for item in items], model, tokenizer,
+                             max_length=max_length, num_beams=num_beams)
+    return [(item[0], answer) for item, answer in zip(items, answers)]
+
+def run(input_path, output_path, top_k=3, unit="passage", model_name="t5-small", backend="fp32",
+        max_length=150, num_beams=4, batch_size=8, chunk_size=256, workers=1):
+    """Answer every query of input_path not yet in output_path. Returns the number answered."""
+    queries = read_queries(input_path, default_model=model_name)
+    done = completed_ids(output_path)
+    queries = [q for q in queries if q['id'] not in done]
+    print(f"{len(done)} queries already answered, {len(queries)} to go.")
+    if not queries:
+        return 0
+
+    pool = None
+    if workers > 1:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(threads,))
+    embed_model = get_embedding_model(DEFAULT_EMBEDDING_MODEL)
+    start, answered = time.perf_counter(), 0
+    # Format: { query id: output record without the answer }
+    records = {}
+    pending = set()
+
+    def write(results, out):
+        nonlocal answered
+        for query_id, answer in results:
+            record = records.pop(query_id)
+            record['answer'] = answer
+            out.write(json.dumps(record) + "\n")
+            answered += 1
+        out.flush()
+
+    try:
+        with session_scope() as session, open(output_path, 'a', encoding='utf-8') as out:
+            for offset in range(0, len(queries), chunk_size):
+                chunk = queries[offset:offset + chunk_size]
+                batches = {}
+                for q, hit in zip(chunk, retrieve(session, chunk, embed_model, top_k=top_k, unit=unit)):
+                    record = {'id': q['id'], 'query': q['query'], 'topic': q['topic'], 'model': q['model']}
+                    if isinstance(hit, str):
+                        record['error'] = hit
+                        out.write(json.dumps(record) + "\n")
+                        continue
+                    doc_ids, units, embedding = hit
+                    context, tokens = build_context(q['query'], units, get_tokenizer(q['model']), embed_model,
+                                                    query_embedding=embedding)
+                    record.update(document_ids=doc_ids, context_tokens=tokens)
+                    records[q['id']] = record
+                    batches.setdefault(q['model'], []).append((q['id'], q['query'], context))
+
+                # Generation is batched per model.
+                for name, items in batches.items():
+                    for i in range(0, len(items), batch_size):
+                        args = (name, backend, items[i:i + batch_size], max_length, num_beams)
+                        if pool is None:
+                            write(generate_items(*args), out)
+                        else:
+                            pending.add(pool.submit(generate_items, *args))
+                    # Keep retrieval at most a couple of batches ahead of the workers.
+                    while len(pending) > 2 * workers:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            write(future.result(), out)
+                print(f"{min(offset + chunk_size, len(queries))}/{len(queries)} queries retrieved, "
+                      f"{answered} answered ({answered / (time.perf_counter() - start):.1f}/s)")
+            for future in wait(pending).done:
+                write(future.result(), out)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return answered
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL or CSV file of queries.")
+    parser.add_argument('input', help="Queries (.jsonl or .csv) with a 'query' field.")
+    parser.add_argument('output', help="JSONL file the answers are appended to; also the resume checkpoint.")
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--unit', choices=["passage", "document"], default="passage")
+    parser.add_argument('--model', default="t5-small", help="Generator for queries without a 'model' field.")
+    parser.add_argument('--backend', default="fp32")
+    parser.add_argument('--max-length', type=int, default=150)
+    parser.add_argument('--num-beams', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=8, help="Queries per generate call.")
+    parser.add_argument('--chunk-size', type=int, default=256, help="Queries encoded and searched together.")
+    parser.add_argument('--workers', type=int, default=1, help="Generation processes (1 = in-process).")
+    parser.add_argument('--metrics', help="Write stage timings and counters here (.prom for Prometheus text, else JSON).")
+    args = parser.parse_args()
+
+    run(args.input, args.output, top_k=args.top_k, unit=args.unit, model_name=args.model, backend=args.backend,
+        max_length=args.max_length, num_beams=args.num_beams, batch_size=args.batch_size,
+        chunk_size=args.chunk_size, workers=args.workers)
+    if args.metrics:
+        write_metrics(args.metrics)
@@ -0,0 +1,130 @@
+# src/bench_generation.py
+"""
+Benchmark T5 generation on CPU across model sizes, inference backends and
+decoding presets: load time, latency, output tokens/sec and resident memory,
+plus how often each backend's answers agree with fp32.
+
+Each (model, backend) runs in its own process so RSS figures do not bleed
+into each other:
+    python bench_generation.py --models t5-small t5-base --backends fp32 int8 --questions 20
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from generation import BACKENDS, DECODING_PRESETS, configure_threads, generate_response, load_generator
+
+DEFAULT_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'raw',
+                            'arxiv_combined_documents.json')
+
+def rss_mb():
+    """Current resident set size of this process in MB (Linux), or peak RSS elsewhere."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def make_questions(n, data_path=DEFAULT_DATA):
+    """(query, context) pairs built from the saved corpus."""
+    with open(data_path, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    return [(f"What does the paper '{doc['title']}' propose?", doc['text']) for doc in corpus[:n]]
+
+def run_config(model_name, backend, presets, questions, max_length, threads):
+    """Measure one (model, backend) pair in the current process."""
+    configure_threads(threads or None)
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    model, tokenizer = load_generator(model_name, backend=backend)
+    load_seconds = time.perf_counter() - start
+    rss_loaded = rss_mb()
+
+    results = []
+    for preset in presets:
+        latencies, tokens, answers = [], 0, []
+        for query, context in questions:
+            start = time.perf_counter()
+            answer = generate_response(query, context, model, tokenizer, max_length=max_length, preset=preset)
+            latencies.append(time.perf_counter() - start)
+            tokens += len(tokenizer.encode(answer))
+            answers.append(answer)
+        latencies = np.array(latencies) * 1000
+        results.append({
+            'model': model_name,
+            'backend': backend,
+            'preset': preset,
+            'load_s': load_seconds,
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'tokens_per_s': tokens / (latencies.sum() / 1000),
+            'model_rss_mb': rss_loaded - rss_before,
+            'peak_rss_mb': rss_mb(),
+            'answers': answers,
+        })
+    return results
+
+def token_f1(a, b):
+    """Token-overlap F1 between two answers."""
+    a_tokens, b_tokens = a.lower().split(), b.lower().split()
+    common = sum(min(a_tokens.count(t), b_tokens.count(t)) for t in set(a_tokens))
+    if not a_tokens or not b_tokens or not common:
+        return float(a_tokens == b_tokens)
+    precision, recall = common / len(a_tokens), common / len(b_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+def add_agreement(rows):
+    """Compare every row's answers with the fp32 answers for the same model and preset."""
+    reference = {(r['model'], r['preset']): r['answers'] for r in rows if r['backend'] == 'fp32'}
+    for row in rows:
+        ref = reference.get((row['model'], row['preset']))
+        if ref is None:
+            continue
+        row['exact_match'] = float(np.mean([a == b for a, b in zip(row['answers'], ref)]))
+        row['token_f1'] = float(np.mean([token_f1(a, b) for a, b in zip(row['answers'], ref)]))
+    return rows
+
+def benchmark(models, backends, presets, n_questions, max_length, threads, data_path=DEFAULT_DATA):
+    questions = make_questions(n_questions, data_path)
+    ctx = multiprocessing.get_context("spawn")
+    rows = []
+    for model_name in models:
+        for backend in backends:
+            with ctx.Pool(1) as pool:
+                try:
+                    rows.extend(pool.apply(run_config, (model_name, backend, presets, questions, max_length, threads)))
+                except Exception as e:
+                    print(f"Skipping {model_name}/{backend}: {e}")
+    return add_agreement(rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CPU generation backends.")
+    parser.add_argument('--models', nargs='+', default=["t5-small", "t5-base", "t5-large"])
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--presets', nargs='+', default=list(DECODING_PRESETS), choices=list(DECODING_PRESETS))
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--max-length', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=0, help="Intra-op threads (0 = torch default).")
+    parser.add_argument('--data', default=DEFAULT_DATA)
+    parser.add_argument('--output', help="Optional JSON file for the results (answers included).")
+    args = parser.parse_args()
+
+    rows = benchmark(args.models, args.backends, args.presets, args.questions,
+                     args.max_length, args.threads, args.data)
+    print(f"{'model':<10}{'backend':<9}{'preset':<11}{'load s':>8}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'tok/s':>8}{'RSS MB':>9}{'EM':>6}{'F1':>6}")
+    for r in rows:
+        print(f"{r['model']:<10}{r['backend']:<9}{r['preset']:<11}{r['load_s']:>8.1f}{r['p50_ms']:>9.0f}"
+              f"{r['p95_ms']:>9.0f}{r['tokens_per_s']:>8.1f}{r['model_rss_mb']:>9.0f}"
+              f"{r.get('exact_match', float('nan')):>6.2f}{r.get('token_f1', float('nan')):>6.2f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
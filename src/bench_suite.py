@@ -0,0 +1,300 @@
+# src/bench_suite.py
+"""
+Offline end-to-end benchmark suite.
+
+Each stage runs in its own process against a throwaway SQLite database
+(or --db-url, whose tables are dropped!) and index directory, with the
+Hugging Face hub in offline mode, so no network is needed once the models
+are in the local cache:
+    ingest   rows/sec of bulk_add_documents on the saved corpus scaled up to --docs
+    embed    docs/sec of retrieval.create_embeddings
+    index    build time, search latency and recall of each index type over
+             synthetic vectors at each --docs size
+    query    end-to-end latency (retrieval, context, generation) over a
+             freshly ingested and indexed topic
+Every stage reports the peak RSS of its process.
+
+Results are saved as JSON under data/benchmarks/ and can be compared with an
+earlier run:
+    python bench_suite.py --docs 100000 1000000 --stages ingest index
+    python bench_suite.py --compare ../data/benchmarks/20261001-120000.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+DEFAULT_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'raw',
+                            'arxiv_combined_documents.json')
+RESULTS_DIR = os.environ.get(
+    "BENCH_RESULTS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'benchmarks')
+)
+STAGES = ('ingest', 'embed', 'index', 'query')
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is in KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if platform.system() == "Darwin" else peak / 1024.0
+
+def percentiles(latencies_s):
+    latencies = np.array(latencies_s) * 1000
+    return {f"p{q}_ms": float(np.percentile(latencies, q)) for q in (50, 95, 99)}
+
+def fresh_engine(db_url):
+    from sqlalchemy import create_engine
+    from models import Base
+
+    engine = create_engine(db_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+def bench_ingest(db_url, docs, data_path, batch_size=5000):
+    """Ingest throughput of bulk_add_documents, one transaction per batch."""
+    from sqlalchemy.orm import sessionmaker
+    from bench_ingest import make_documents
+    from data_access import bulk_add_documents
+
+    engine = fresh_engine(db_url)
+    session = sessionmaker(bind=engine)()
+    elapsed = 0.0
+    for offset in range(0, docs, batch_size):
+        batch = make_documents(min(batch_size, docs - offset), data_path, start=offset)
+        start = time.perf_counter()
+        bulk_add_documents(session, "benchmark", batch)
+        elapsed += time.perf_counter() - start
+    session.close()
+    engine.dispose()
+    return {'docs': docs, 'seconds': elapsed, 'docs_per_s': docs / elapsed}
+
+def bench_embed(docs, data_path):
+    """Embedding throughput of retrieval.create_embeddings, excluding the model load."""
+    from bench_ingest import make_documents
+    from model_registry import get_embedding_model
+    from retrieval import create_embeddings
+
+    documents = make_documents(docs, data_path)
+    start = time.perf_counter()
+    get_embedding_model()
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    create_embeddings(documents)
+    elapsed = time.perf_counter() - start
+    return {'docs': docs, 'load_s': load_seconds, 'seconds': elapsed, 'docs_per_s': docs / elapsed}
+
+def bench_index(docs, dim, queries, top_k, index_types):
+    """Build and search each index type over synthetic vectors standing in for docs documents."""
+    from retrieval import run_index_benchmark, synthetic_embeddings
+
+    corpus = synthetic_embeddings(docs + queries, dim)
+    # Small corpora cannot train the default number of IVF clusters.
+    nlist = min(1024, max(1, docs // 39))
+    rows = run_index_benchmark(corpus[:-queries], corpus[-queries:], top_k=top_k, index_types=index_types,
+                               nprobes=(8,), ef_searches=(64,), nlist=nlist)
+    return {'docs': docs, 'dim': dim, 'indexes': rows}
+
+def bench_query(db_url, docs, data_path, queries, top_k, unit, model_name, max_length):
+    """
+    Ingest and index one topic the way data_acquisition does, then answer
+    queries one at a time, timing retrieval, context building and generation.
+    """
+    from sqlalchemy.orm import sessionmaker
+    from bench_ingest import make_documents
+    from batch_query import retrieve
+    from context_builder import build_context
+    from data_access import bulk_add_documents
+    from embedding_store import update_topic_embeddings
+    from generation import generate_response
+    from index_store import update_topic_index
+    from lexical_index import update_topic_lexical_index
+    from metrics import REGISTRY, trace
+    from model_registry import get_embedding_model, get_generator
+    from passages import update_topic_passages
+
+    engine = fresh_engine(db_url)
+    session = sessionmaker(bind=engine)()
+    corpus = make_documents(docs, data_path)
+    start = time.perf_counter()
+    bulk_add_documents(session, "benchmark", corpus)
+    encoded_ids = update_topic_embeddings(session, "benchmark")
+    update_topic_passages(session, "benchmark")
+    update_topic_index(session, "benchmark", refresh_ids=encoded_ids)
+    update_topic_lexical_index(session, "benchmark")
+    ingest_seconds = time.perf_counter() - start
+
+    embed_model = get_embedding_model()
+    model, tokenizer = get_generator(model_name)
+    questions = [f"What does the paper '{doc['title']}' propose?" for doc in corpus[:queries]]
+    REGISTRY.reset()
+    timings = {'retrieval': [], 'context': [], 'generation': [], 'total': []}
+    for question in questions:
+        with trace("bench_query") as request:
+            start = time.perf_counter()
+            hit = retrieve(session, [{'query': question, 'topic': "benchmark"}], embed_model,
+                           top_k=top_k, unit=unit)[0]
+            retrieved = time.perf_counter()
+            _, units, embedding = hit
+            context, _ = build_context(question, units, tokenizer, embed_model, query_embedding=embedding)
+            built = time.perf_counter()
+            generate_response(question, context, model, tokenizer, max_length=max_length, num_beams=1)
+            timings['retrieval'].append(retrieved - start)
+            timings['context'].append(built - retrieved)
+            timings['generation'].append(time.perf_counter() - built)
+        timings['total'].append(request['total_ms'] / 1000)
+    session.close()
+    engine.dispose()
+    stages = {h['labels']['stage']: {'count': h['count'], 'p50_ms': h['p50'] * 1000, 'p95_ms': h['p95'] * 1000}
+              for h in REGISTRY.snapshot()['histograms'] if h['name'] == "stage_seconds"}
+    return {
+        'docs': docs,
+        'queries': len(questions),
+        'ingest_and_index_s': ingest_seconds,
+        **{name: percentiles(values) for name, values in timings.items()},
+        'stages': stages,
+    }
+
+def run_stage(name, kwargs, work_dir):
+    """Run one stage in this (fresh) process with its own database and index directory."""
+    os.environ['INDEX_DIR'] = os.path.join(work_dir, 'indexes')
+    if 'db_url' in kwargs:
+        os.environ['DATABASE_URL'] = kwargs['db_url']
+    os.environ['CACHE_BACKEND'] = "memory"
+    start = time.perf_counter()
+    result = STAGE_FUNCTIONS[name](**kwargs)
+    result.update(stage=name, wall_s=time.perf_counter() - start, peak_rss_mb=peak_rss_mb())
+    return result
+
+STAGE_FUNCTIONS = {'ingest': bench_ingest, 'embed': bench_embed, 'index': bench_index, 'query': bench_query}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run(args):
+    """Run the selected stages, each in a spawned process. Returns the result document."""
+    # Models must come from the local cache; nothing is downloaded.
+    os.environ.setdefault('HF_HUB_OFFLINE', "1")
+    os.environ.setdefault('TRANSFORMERS_OFFLINE', "1")
+    plan = []
+    for docs in args.docs:
+        if 'ingest' in args.stages:
+            plan.append(('ingest', {'docs': docs, 'data_path': args.data}))
+        if 'index' in args.stages:
+            plan.append(('index', {'docs': docs, 'dim': args.dim, 'queries': args.queries, 'top_k': args.top_k,
+                                   'index_types': args.types}))
+    if 'embed' in args.stages:
+        plan.append(('embed', {'docs': args.embed_docs, 'data_path': args.data}))
+    if 'query' in args.stages:
+        plan.append(('query', {'docs': args.query_docs, 'data_path': args.data, 'queries': args.queries,
+                               'top_k': args.top_k, 'unit': args.unit, 'model_name': args.model,
+                               'max_length': args.max_length}))
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for name, kwargs in plan:
+        with tempfile.TemporaryDirectory() as work_dir:
+            if name in ('ingest', 'query'):
+                kwargs['db_url'] = args.db_url or f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+            print(f"Running {name} ({', '.join(f'{k}={v}' for k, v in kwargs.items() if k != 'data_path')}) ...")
+            with ctx.Pool(1) as pool:
+                results.append(pool.apply(run_stage, (name, kwargs, work_dir)))
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'args': {k: v for k, v in vars(args).items() if k not in ('compare', 'output')},
+        'results': results,
+    }
+
+def flatten(result):
+    """The numeric metrics of a stage result, keyed like 'index.hnsw.p50_ms' or 'total.p95_ms'."""
+    metrics = {}
+    for key, value in result.items():
+        if key == 'indexes':
+            for row in value:
+                for metric in ('build_s', 'p50_ms', 'p99_ms', 'recall_at_k', 'memory_bytes'):
+                    metrics[f"{row['index_type']}.{metric}"] = row[metric]
+        elif isinstance(value, dict):
+            for sub, number in value.items():
+                if isinstance(number, (int, float)):
+                    metrics[f"{key}.{sub}"] = number
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[key] = value
+    return metrics
+
+def stage_key(result):
+    return (result['stage'], result.get('docs'))
+
+def compare(current, baseline):
+    """Print every metric of the current run next to the baseline and the relative change."""
+    previous = {stage_key(r): flatten(r) for r in baseline['results']}
+    print(f"Compared with {baseline.get('created_at')} (commit {baseline.get('commit')})")
+    print(f"{'stage':<18}{'metric':<32}{'baseline':>14}{'current':>14}{'change':>9}")
+    for result in current['results']:
+        before = previous.get(stage_key(result))
+        if before is None:
+            continue
+        label = f"{result['stage']}@{result.get('docs')}"
+        for metric, value in flatten(result).items():
+            if metric not in before or metric == 'docs':
+                continue
+            change = (value - before[metric]) / before[metric] * 100 if before[metric] else float('nan')
+            print(f"{label:<18}{metric:<32}{before[metric]:>14.3f}{value:>14.3f}{change:>8.1f}%")
+
+def print_summary(run_result):
+    for result in run_result['results']:
+        headline = {
+            'ingest': lambda r: f"{r['docs_per_s']:,.0f} docs/s",
+            'embed': lambda r: f"{r['docs_per_s']:,.1f} docs/s",
+            'index': lambda r: ", ".join(f"{row['index_type']} build {row['build_s']:.1f}s "
+                                         f"p50 {row['p50_ms']:.2f}ms recall {row['recall_at_k']:.2f}"
+                                         for row in r['indexes']),
+            'query': lambda r: f"p50 {r['total']['p50_ms']:.0f}ms p95 {r['total']['p95_ms']:.0f}ms "
+                               f"(retrieval p50 {r['retrieval']['p50_ms']:.0f}ms, "
+                               f"generation p50 {r['generation']['p50_ms']:.0f}ms)",
+        }[result['stage']](result)
+        print(f"{result['stage']:<7}{result.get('docs', ''):>9}  {headline}  peak RSS {result['peak_rss_mb']:.0f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline ingest, embedding, index and query benchmarks.")
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=STAGES)
+    parser.add_argument('--docs', type=int, nargs='+', default=[10000],
+                        help="Corpus sizes for the ingest and index stages (the corpus is scaled up synthetically).")
+    parser.add_argument('--embed-docs', type=int, default=1000)
+    parser.add_argument('--query-docs', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--types', nargs='+', default=['flat', 'ivf_flat', 'hnsw'])
+    parser.add_argument('--unit', choices=["passage", "document"], default="passage")
+    parser.add_argument('--model', default="t5-small")
+    parser.add_argument('--max-length', type=int, default=64)
+    parser.add_argument('--data', default=DEFAULT_DATA)
+    parser.add_argument('--db-url', help="Database for the ingest and query stages (its tables are dropped!).")
+    parser.add_argument('--output', help="Results file (default: data/benchmarks/<timestamp>.json).")
+    parser.add_argument('--compare', help="Earlier results file to compare this run with.")
+    args = parser.parse_args()
+
+    run_result = run(args)
+    print_summary(run_result)
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(run_result, f, indent=2)
+    print(f"Results saved to {output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(run_result, json.load(f))
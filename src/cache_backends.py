@@ -0,0 +1,204 @@
+# src/cache_backends.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+
+# Backend used by make_cache: "memory" (per process) or "sqlite" (shared on disk).
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+CACHE_DIR = os.environ.get(
+    "CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'cache')
+)
+
+class MemoryCache:
+    """
+    Thread-safe in-process cache with a per-entry TTL and LRU eviction
+    once max_entries is exceeded. Counts hits, misses and evictions.
+    """
+
+    def __init__(self, max_entries=256, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Format: { key: (expires_at or None, value) }
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[0] is not None and item[0] <= time.time():
+                del self._entries[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Hit/miss/eviction counters and current size."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self),
+        }
+
+class SQLiteCache(MemoryCache):
+    """
+    Cache persisted in a SQLite file, so it survives restarts and is shared
+    safely by several worker processes (WAL mode, immediate write transactions).
+    Values must be JSON-serializable. Entries expire after their TTL and the
+    least recently used ones are evicted beyond max_entries or max_bytes.
+    Counters are kept per process.
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=None, max_bytes=None):
+        super().__init__(max_entries=max_entries, ttl=ttl)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " expires_at REAL, last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_last_access ON cache (last_access)")
+
+    def _conn(self):
+        # sqlite3 connections must not be shared between threads.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=None):
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[1] is not None and row[1] <= now:
+            conn.execute("DELETE FROM cache WHERE key = ? AND expires_at <= ?", (key, now))
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        now = time.time()
+        payload = json.dumps(value)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now + ttl if ttl is not None else None, now)
+            )
+            evicted = self._evict(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self.evictions += evicted
+
+    def _evict(self, conn, now):
+        """Drop expired rows, then least recently used rows beyond the bounds. Returns the count."""
+        evicted = conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)).rowcount
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        excess = max(0, count - self.max_entries)
+        if self.max_bytes is not None and total > self.max_bytes:
+            # Walk from the oldest entry until enough bytes are freed.
+            freed = 0
+            for n, (size,) in enumerate(conn.execute("SELECT size FROM cache ORDER BY last_access"), start=1):
+                freed += size
+                if total - freed <= self.max_bytes:
+                    excess = max(excess, n)
+                    break
+        if excess:
+            evicted += conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_access LIMIT ?)", (excess,)
+            ).rowcount
+        return evicted
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM cache")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+# Caches created by make_cache, for the metrics export.
+# Format: { name: MemoryCache or SQLiteCache }
+CACHES = {}
+
+def make_cache(name, max_entries=256, ttl=None, max_bytes=None, backend=None):
+    """
+    Create a named cache using the configured backend (CACHE_BACKEND).
+    The sqlite backend stores each named cache in its own file under CACHE_DIR.
+    """
+    backend = backend or CACHE_BACKEND
+    if backend == "memory":
+        cache = MemoryCache(max_entries=max_entries, ttl=ttl)
+    elif backend == "sqlite":
+        cache = SQLiteCache(os.path.join(CACHE_DIR, f"{name}.sqlite"),
+                            max_entries=max_entries, ttl=ttl, max_bytes=max_bytes)
+    else:
+        raise ValueError(f"Unknown cache backend '{backend}', expected 'memory' or 'sqlite'")
+    CACHES[name] = cache
+    return cache
+
+def cache_metrics():
+    """Hit, miss and eviction counts and hit rate of every named cache, as metric gauges."""
+    gauges = []
+    for name, cache in CACHES.items():
+        lookups = cache.hits + cache.misses
+        gauges.append(("cache_hits", {'cache': name}, cache.hits))
+        gauges.append(("cache_misses", {'cache': name}, cache.misses))
+        gauges.append(("cache_evictions", {'cache': name}, cache.evictions))
+        gauges.append(("cache_hit_rate", {'cache': name}, cache.hits / lookups if lookups else 0.0))
+    return gauges
+
+REGISTRY.register_collector(cache_metrics)
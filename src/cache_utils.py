@@ -1,17 +1,25 @@
 # src/cache_utils.py
 import time
+from cache_backends import make_cache
 from data_acquisition import query_arxiv_paginated, process_entries, download_and_save_topic_to_db
-from data_access import add_document
-from db import get_session
-from data_acquisition import query_arxiv  # if needed for individual calls
+from data_access import bulk_add_documents, normalize_topic_name
+from db import session_scope
+from embedding_store import update_topic_embeddings
+from passages import update_topic_passages
+from lexical_index import update_topic_lexical_index
+from metadata_index import update_metadata
+from index_store import update_topic_index
 
-# Global in-memory cache for fetched topics.
-# Format: { normalized_topic: (timestamp, [list_of_documents], count) }
-FETCH_CACHE = {}
+# Cache of fetched topics, bounded in entries and age. Entries hold Document
+# ids rather than full documents to cap memory. It is always kept on disk,
+# whatever CACHE_BACKEND says: it records what ingest jobs fetched, and those
+# may run in a standalone worker process (python ingest_jobs.py).
+# Format: { normalized_topic: {'fetched_at': timestamp, 'ids': [document ids], 'count': offset} }
+FETCH_CACHE = make_cache("fetch", max_entries=1024, ttl=7 * 24 * 3600, backend="sqlite")
 
 def normalize_topic(topic):
-    """Simple normalization: lowercase and trim whitespace."""
-    return topic.strip().lower()
+    """Simple normalization: lowercase and collapse whitespace, as for Topic.normalized_name."""
+    return normalize_topic_name(topic)
 
 def cached_fetch_topic(topic, total_requested, fetch_interval=3600):
     """
@@ -23,8 +31,8 @@ def cached_fetch_topic(topic, total_requested, fetch_interval=3600):
         fetch_interval (int): The minimum time (in seconds) to wait before re-fetching.
     
     Returns:
-        Tuple: (data, from_cache) where data is the list of documents and
-               from_cache is True if the data came from the cache.
+        Tuple: (ids, from_cache) where ids is the list of Document ids for the
+               topic and from_cache is True if the data came from the cache.
     
     Behavior:
         - If the topic is not in cache or the cache is too old, fetch fresh data.
@@ -34,43 +42,42 @@ def cached_fetch_topic(topic, total_requested, fetch_interval=3600):
     """
     normalized_topic = normalize_topic(topic)
     current_time = time.time()
-    session = None
 
     # Check if we have cached data for this topic.
-    if normalized_topic in FETCH_CACHE:
-        last_fetch, data, count = FETCH_CACHE[normalized_topic]
+    entry = FETCH_CACHE.get(normalized_topic)
+    if entry is not None:
         # If the cache is fresh:
-        if current_time - last_fetch < fetch_interval:
-            if count >= total_requested:
+        if current_time - entry['fetched_at'] < fetch_interval:
+            if entry['count'] >= total_requested:
                 # Enough data is in the cache.
-                return data, True
+                return entry['ids'], True
             else:
                 # Determine how many more documents are needed.
+                count = entry['count']
                 missing = total_requested - count
                 # Fetch additional documents starting from the current offset.
-                new_entries = query_arxiv_paginated(topic, total_results=missing, batch_size=5, start=count)
+                new_entries = query_arxiv_paginated(topic, total_results=missing, start=count)
                 new_docs = process_entries(new_entries)
-                # Insert the new documents into the database.
-                session = get_session()
-                for doc in new_docs:
-                    add_document(session,
-                                 topic_name=topic,
-                                 title=doc['title'],
-                                 text=doc['text'],
-                                 pdf_link=doc['pdf_link'],
-                                 authors=", ".join(doc['authors']))
-                if session:
-                    session.close()
-                # Update our cached data.
-                data.extend(new_docs)
-                new_total = count + len(new_docs)
-                FETCH_CACHE[normalized_topic] = (current_time, data, new_total)
-                return data, False
+                # Insert the new documents into the database in one transaction.
+                with session_scope() as session:
+                    new_ids = bulk_add_documents(session, topic, new_docs)
+                    # Embed just the newly stored documents and append them to the index.
+                    encoded_ids = update_topic_embeddings(session, topic)
+                    update_topic_passages(session, topic)
+                    update_topic_index(session, topic, refresh_ids=encoded_ids)
+                    update_topic_lexical_index(session, topic)
+                    update_metadata(session)
+                # Store a new entry rather than mutating the cached list in place.
+                ids = list(dict.fromkeys(entry['ids'] + new_ids))
+                FETCH_CACHE.set(normalized_topic, {'fetched_at': current_time, 'ids': ids,
+                                                   'count': count + len(new_entries)})
+                return ids, False
         # If the cache is too old, fall through to re-fetch fresh data.
     
     # If there's no cache or it's expired, perform a full fetch.
     # For a full fetch, fetch the total_requested number of documents.
-    new_data = download_and_save_topic_to_db(topic, total_results=total_requested, batch_size=5)
+    new_data = download_and_save_topic_to_db(topic, total_results=total_requested)
+    ids = list(dict.fromkeys(doc['id'] for doc in new_data))
     # Create a new cache entry.
-    FETCH_CACHE[normalized_topic] = (current_time, new_data, len(new_data))
-    return new_data, False
+    FETCH_CACHE.set(normalized_topic, {'fetched_at': current_time, 'ids': ids, 'count': len(new_data)})
+    return ids, False
@@ -0,0 +1,127 @@
+# src/context_builder.py
+import base64
+import re
+
+import numpy as np
+
+from cache_backends import make_cache
+from embedding_store import content_hash, encode_texts
+from generation import MAX_INPUT_TOKENS, build_input
+from lexical_index import tokenize
+
+# Sentence splits and their token counts, per (tokenizer, document, text version).
+# Format: { key: {'sentences': [str], 'tokens': [int]} }
+TOKEN_CACHE = make_cache("tokens", max_entries=20000, ttl=7 * 24 * 3600)
+# Sentence embeddings, per (embedding model, document, text version), as base64 float32 rows.
+# Format: { key: {'dim': int, 'vectors': str} }
+SENTENCE_VECTOR_CACHE = make_cache("sentence_vectors", max_entries=4096, ttl=7 * 24 * 3600)
+
+SENTENCE_RE = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9(\[])')
+
+def split_sentences(text):
+    """Split text into sentences on terminal punctuation followed by a capital, digit or bracket."""
+    return [s.strip() for s in SENTENCE_RE.split(" ".join(text.split())) if s.strip()]
+
+def _tokenizer_name(tokenizer):
+    return getattr(tokenizer, 'name_or_path', None) or type(tokenizer).__name__
+
+def document_chunks(doc, tokenizer):
+    """
+    Return (sentences, token_counts) for a Document or Passage. Results are cached,
+    so each text is split and tokenized once per tokenizer until it changes.
+    """
+    key = f"{_tokenizer_name(tokenizer)}:{type(doc).__name__}:{doc.id}:{content_hash(doc.text)}"
+    entry = TOKEN_CACHE.get(key)
+    if entry is None:
+        sentences = split_sentences(doc.text)
+        ids = tokenizer(sentences, add_special_tokens=False)['input_ids'] if sentences else []
+        entry = {'sentences': sentences, 'tokens': [len(i) for i in ids]}
+        TOKEN_CACHE.set(key, entry)
+    return entry['sentences'], entry['tokens']
+
+def _model_name(embed_model):
+    tokenizer = getattr(embed_model, 'tokenizer', None)
+    return getattr(tokenizer, 'name_or_path', None) or type(embed_model).__name__
+
+def sentence_vectors(docs, sentences, embed_model):
+    """
+    Return one (n_sentences, dim) float32 matrix per document, for the given
+    sentence lists. Cached like document_chunks, so only documents not seen
+    (or changed) since are sent through the model, in one encode call.
+    """
+    keys = [f"{_model_name(embed_model)}:{type(doc).__name__}:{doc.id}:{content_hash(doc.text)}" for doc in docs]
+    vectors = [None] * len(docs)
+    missing = []
+    for i, key in enumerate(keys):
+        entry = SENTENCE_VECTOR_CACHE.get(key)
+        if entry is not None:
+            vectors[i] = np.frombuffer(base64.b64decode(entry['vectors']), dtype='float32').reshape(-1, entry['dim'])
+        elif sentences[i]:
+            missing.append(i)
+        else:
+            vectors[i] = np.zeros((0, 0), dtype='float32')
+    if missing:
+        encoded = encode_texts(embed_model, [s for i in missing for s in sentences[i]])
+        offset = 0
+        for i in missing:
+            vectors[i] = encoded[offset:offset + len(sentences[i])]
+            offset += len(sentences[i])
+            SENTENCE_VECTOR_CACHE.set(keys[i], {'dim': encoded.shape[1],
+                                                'vectors': base64.b64encode(vectors[i].tobytes()).decode('ascii')})
+    return vectors
+
+def prompt_tokens(query, tokenizer):
+    """Tokens taken by the prompt around the context, including the end-of-sequence token."""
+    return len(tokenizer.encode(build_input(query, "")))
+
+def term_overlap_scores(query, sentences):
+    """Fraction of the query's distinct terms found in each sentence."""
+    terms = set(tokenize(query))
+    if not terms:
+        return np.zeros(len(sentences), dtype='float32')
+    return np.array([len(terms & set(tokenize(s))) / len(terms) for s in sentences], dtype='float32')
+
+def build_context(query, documents, tokenizer, embed_model, max_tokens=MAX_INPUT_TOKENS, query_embedding=None):
+    """
+    Assemble the generation context from the retrieved documents.
+
+    Every document is split into sentences, the sentences are scored by cosine
+    similarity to the query (or, without an embed_model, by the share of query
+    terms they contain), and the best ones are packed until the model's
+    input budget (max_tokens minus the prompt) is used up. Selected sentences
+    are emitted in retrieval order and, within a document, in their original
+    order. Returns (context, used_tokens).
+    """
+    budget = max_tokens - prompt_tokens(query, tokenizer)
+    chunks = []  # (doc rank, position, sentence, tokens)
+    doc_sentences = []
+    for rank, doc in enumerate(documents):
+        sentences, tokens = document_chunks(doc, tokenizer)
+        doc_sentences.append(sentences)
+        chunks.extend((rank, pos, s, n) for pos, (s, n) in enumerate(zip(sentences, tokens)))
+    if not chunks or budget <= 0:
+        return "", 0
+
+    if embed_model is None:
+        scores = term_overlap_scores(query, [c[2] for c in chunks])
+    else:
+        if query_embedding is None:
+            query_embedding = encode_texts(embed_model, [query])
+        query_vec = np.asarray(query_embedding, dtype='float32').reshape(-1)
+        # Rows line up with chunks: both follow document order, then sentence order.
+        sentence_vecs = np.vstack([v for v in sentence_vectors(documents, doc_sentences, embed_model) if len(v)])
+        norms = np.linalg.norm(sentence_vecs, axis=1) * np.linalg.norm(query_vec)
+        scores = sentence_vecs @ query_vec / np.maximum(norms, 1e-12)
+
+    selected, used, seen = [], 0, set()
+    for i in np.argsort(-scores, kind='stable'):
+        # Overlapping passages repeat text; each sentence is packed once.
+        if chunks[i][2] in seen:
+            continue
+        # Separators between sentences cost roughly nothing for SentencePiece tokenizers.
+        if used + chunks[i][3] <= budget:
+            selected.append(chunks[i])
+            seen.add(chunks[i][2])
+            used += chunks[i][3]
+    selected.sort(key=lambda c: (c[0], c[1]))
+    return " ".join(c[2] for c in selected), used
@@ -1,14 +1,71 @@
 # src/data_access.py
 
+import hashlib
+import re
+
+from sqlalchemy import insert, or_
+from sqlalchemy.orm import load_only, undefer_group
+from sqlalchemy.dialects import postgresql, sqlite
+
 from db import get_session
-from models import Topic, Document
+from metrics import span
+from models import Topic, Document, topic_documents
+
+# Matches abs/pdf links such as http://arxiv.org/abs/1805.08355v1 or .../pdf/hep-th/9901001v2.pdf
+ARXIV_LINK_RE = re.compile(r'arxiv\.org/(?:abs|pdf)/(.+?)(?:v(\d+))?(?:\.pdf)?$')
+
+def normalize_topic_name(topic_name):
+    """Lowercase a topic name and collapse whitespace, for indexed lookups."""
+    return " ".join(topic_name.lower().split())
+
+def title_hash(title):
+    """SHA-1 of a title with case, punctuation and whitespace normalized away."""
+    normalized = " ".join(re.sub(r'\W+', ' ', title.lower()).split())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+def parse_arxiv_id(link):
+    """
+    Extract the arXiv identifier and version from an abs or pdf link.
+    Returns (arxiv_id, version), or (None, None) if the link is not an arXiv link.
+    """
+    match = ARXIV_LINK_RE.search(link or "")
+    if not match:
+        return None, None
+    version = int(match.group(2)) if match.group(2) else None
+    return match.group(1), version
+
+def _insert_ignoring_conflicts(session, table, index_elements):
+    """
+    INSERT that silently skips rows violating the unique index on index_elements,
+    so concurrent ingests of the same paper cannot fail each other.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    return insert(table)
 
 def get_topic_by_name(session, topic_name):
     """
-    Retrieve a Topic by its name.
+    Retrieve a Topic by its name (compared after normalization).
     Returns the Topic instance if found, otherwise None.
     """
-    return session.query(Topic).filter(Topic.name == topic_name).first()
+    return session.query(Topic).filter(Topic.normalized_name == normalize_topic_name(topic_name)).first()
+
+def find_topic(session, topic_text):
+    """
+    Resolve user-entered text to a Topic: an exact normalized match via the
+    index first, then a substring match preferring the largest topic.
+    Returns the Topic instance if found, otherwise None.
+    """
+    topic = get_topic_by_name(session, topic_text)
+    if topic is None:
+        topic = session.query(Topic) \
+            .filter(Topic.name.ilike(f"%{normalize_topic_name(topic_text)}%")) \
+            .order_by(Topic.document_count.desc()) \
+            .first()
+    return topic
 
 def add_topic(session, topic_name):
     """
@@ -17,37 +74,80 @@ def add_topic(session, topic_name):
     """
     topic = get_topic_by_name(session, topic_name)
     if topic is None:
-        topic = Topic(name=topic_name, document_count=0)
+        topic = Topic(name=topic_name, normalized_name=normalize_topic_name(topic_name), document_count=0)
         session.add(topic)
         session.commit()  # Commit to assign an ID
         session.refresh(topic)  # Refresh to load the new data
     return topic
 
-def add_document(session, topic_name, title, text, pdf_link, authors):
+def link_documents(session, topic_id, document_ids):
+    """
+    Link documents to a topic, skipping links that already exist.
+    Does not commit. Returns the number of new links.
+    """
+    document_ids = set(document_ids)
+    if not document_ids:
+        return 0
+    existing = session.query(topic_documents.c.document_id).filter(
+        topic_documents.c.topic_id == topic_id,
+        topic_documents.c.document_id.in_(list(document_ids))
+    )
+    new_ids = document_ids - {row[0] for row in existing}
+    if new_ids:
+        stmt = _insert_ignoring_conflicts(session, topic_documents, ['topic_id', 'document_id'])
+        session.execute(stmt, [{'topic_id': topic_id, 'document_id': doc_id} for doc_id in new_ids])
+    return len(new_ids)
+
+def add_document(session, topic_name, title, text, pdf_link, authors, arxiv_id=None, arxiv_version=None):
     """
     Add a new document under the given topic.
     If the topic doesn't exist, it is created.
-    If a document with the same title exists, it is not inserted again.
+    If the same paper (by arXiv id, or by normalized title) exists, it is not
+    inserted again but linked to the topic.
     The topic's document_count is updated accordingly.
     
     Returns the Document instance.
     """
     # Ensure the topic exists
     topic = add_topic(session, topic_name)
+    if arxiv_id is None:
+        arxiv_id, arxiv_version = parse_arxiv_id(pdf_link)
+    digest = title_hash(title)
     
-    # Check for duplicate documents by title
-    existing_doc = session.query(Document).filter(Document.title == title).first()
+    # Check for duplicate documents by arXiv id, then by title hash
+    existing_doc = None
+    if arxiv_id is not None:
+        existing_doc = session.query(Document).filter(Document.arxiv_id == arxiv_id).first()
+    if existing_doc is None:
+        by_title = session.query(Document).filter(Document.title_hash == digest)
+        if arxiv_id is not None:
+            # A title match with another arXiv id is a different paper.
+            by_title = by_title.filter(Document.arxiv_id.is_(None))
+        existing_doc = by_title.first()
+        if existing_doc is not None and arxiv_id is not None:
+            # The paper claims the id-less row, so later lookups match it by id.
+            existing_doc.arxiv_id = arxiv_id
+            existing_doc.arxiv_version = arxiv_version
+            session.commit()
     if existing_doc:
+        # Same paper under another topic: link it rather than storing it twice
+        if link_documents(session, topic.id, [existing_doc.id]):
+            topic.document_count += 1
+            session.commit()
         return existing_doc  # Return the existing document if found
     
     # Create the new document
     new_doc = Document(
         topic_id=topic.id,
+        arxiv_id=arxiv_id,
+        arxiv_version=arxiv_version,
         title=title,
+        title_hash=digest,
         text=text,
         pdf_link=pdf_link,
         authors=authors
     )
+    new_doc.topics.append(topic)
     session.add(new_doc)
     
     # Update the document count for the topic
@@ -57,6 +157,133 @@ def add_document(session, topic_name, title, text, pdf_link, authors):
     session.refresh(new_doc)  # Refresh the new_doc instance to get its ID etc.
     return new_doc
 
+def bulk_add_documents(session, topic_name, docs, batch_size=500):
+    """
+    Add many documents under the given topic in a single transaction.
+    docs are dictionaries with 'title', 'text', 'pdf_link' and 'authors'
+    (a list of names or an already joined string), and optionally
+    'arxiv_id' / 'arxiv_version' (otherwise parsed from pdf_link).
+    
+    Duplicates (by arXiv id, else by normalized title; both within docs and
+    against the database) are found with one set-based query per batch
+    instead of one lookup per row. Existing papers are linked to the topic,
+    and replaced in place when a newer arXiv version arrives. New rows are
+    inserted in batches, and the topic's document_count is updated once.
+    
+    Returns the list of Document ids, one per input document, where duplicates
+    map to the id of the existing document.
+    """
+    topic = get_topic_by_name(session, topic_name)
+    if topic is None:
+        topic = Topic(name=topic_name, normalized_name=normalize_topic_name(topic_name), document_count=0)
+        session.add(topic)
+        session.flush()  # Assign an ID without committing
+
+    # Dedup key per document: ('arxiv', id) when known, else ('title', hash).
+    ids_by_key = {}
+    result_keys = []
+    linked = 0
+    try:
+        for batch_start in range(0, len(docs), batch_size):
+            batch = []
+            for doc in docs[batch_start:batch_start + batch_size]:
+                arxiv_id, version = doc.get('arxiv_id'), doc.get('arxiv_version')
+                if arxiv_id is None:
+                    arxiv_id, version = parse_arxiv_id(doc['pdf_link'])
+                digest = title_hash(doc['title'])
+                key = ('arxiv', arxiv_id) if arxiv_id else ('title', digest)
+                batch.append((doc, arxiv_id, version, digest, key))
+                result_keys.append(key)
+
+            _resolve_existing(session, batch, ids_by_key)
+
+            rows = []
+            for doc, arxiv_id, version, digest, key in batch:
+                if key in ids_by_key:
+                    continue
+                authors = doc['authors']
+                rows.append({
+                    'topic_id': topic.id,
+                    'arxiv_id': arxiv_id,
+                    'arxiv_version': version,
+                    'title': doc['title'],
+                    'title_hash': digest,
+                    'text': doc['text'],
+                    'pdf_link': doc['pdf_link'],
+                    'authors': authors if isinstance(authors, str) else ", ".join(authors),
+                })
+                # Reserve the key so repeats later in the input are skipped.
+                ids_by_key[key] = None
+            if rows:
+                stmt = _insert_ignoring_conflicts(session, Document.__table__, ['arxiv_id']) \
+                    .returning(Document.id, Document.arxiv_id, Document.title_hash)
+                for doc_id, arxiv_id, digest in session.execute(stmt, rows):
+                    ids_by_key[('arxiv', arxiv_id) if arxiv_id else ('title', digest)] = doc_id
+                # Rows skipped on conflict were inserted concurrently by someone else.
+                lost = [arxiv_id for _, arxiv_id, _, _, key in batch if ids_by_key.get(key) is None and arxiv_id]
+                if lost:
+                    for doc_id, arxiv_id in session.query(Document.id, Document.arxiv_id).filter(Document.arxiv_id.in_(lost)):
+                        ids_by_key[('arxiv', arxiv_id)] = doc_id
+
+            linked += link_documents(session, topic.id, [ids_by_key[item[4]] for item in batch])
+
+        topic.document_count = (topic.document_count or 0) + linked
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return [ids_by_key[key] for key in result_keys]
+
+def _resolve_existing(session, batch, ids_by_key):
+    """
+    Look up which documents of a batch are already stored, with one query,
+    and record their ids in ids_by_key. Stored papers (matched by arXiv id)
+    whose arXiv version is older than the incoming one are updated in place.
+    """
+    arxiv_ids = [arxiv_id for _, arxiv_id, _, _, key in batch if arxiv_id and key not in ids_by_key]
+    digests = [digest for _, _, _, digest, key in batch if key not in ids_by_key]
+    if not arxiv_ids and not digests:
+        return
+
+    existing = session.query(Document.id, Document.arxiv_id, Document.arxiv_version, Document.title_hash) \
+        .filter(or_(Document.arxiv_id.in_(arxiv_ids), Document.title_hash.in_(digests))).all()
+    by_arxiv = {row.arxiv_id: row for row in existing if row.arxiv_id}
+    # Format: { title_hash: [row, ...] }
+    by_title = {}
+    for row in existing:
+        by_title.setdefault(row.title_hash, []).append(row)
+
+    # Id-less rows given an arXiv id by this batch.
+    claimed = set()
+    for doc, arxiv_id, version, digest, key in batch:
+        if key in ids_by_key:
+            continue
+        row = by_arxiv.get(arxiv_id) if arxiv_id else None
+        if row is None:
+            # A title match with another arXiv id is a different paper.
+            candidates = [row for row in by_title.get(digest, [])
+                          if arxiv_id is None or (row.arxiv_id is None and row.id not in claimed)]
+            if not candidates:
+                continue
+            row = candidates[0]
+            ids_by_key[key] = row.id
+            if arxiv_id is not None and row.arxiv_id is None:
+                # The paper claims the id-less row, so later ingests match it by id
+                # and other papers with the same title no longer do.
+                claimed.add(row.id)
+                session.query(Document).filter(Document.id == row.id).update(
+                    {'arxiv_id': arxiv_id, 'arxiv_version': version}, synchronize_session=False)
+            continue
+        ids_by_key[key] = row.id
+        if version and (row.arxiv_version or 0) < version:
+            session.query(Document).filter(Document.id == row.id).update({
+                'arxiv_version': version,
+                'title': doc['title'],
+                'title_hash': digest,
+                'text': doc['text'],
+                'pdf_link': doc['pdf_link'],
+            }, synchronize_session=False)
+
 def get_documents_by_topic(session, topic_name):
     """
     Retrieve all documents associated with the given topic name.
@@ -64,9 +291,40 @@ def get_documents_by_topic(session, topic_name):
     """
     topic = get_topic_by_name(session, topic_name)
     if topic:
-        return session.query(Document).filter(Document.topic_id == topic.id).all()
+        return session.query(Document) \
+            .options(undefer_group('content')) \
+            .join(topic_documents, topic_documents.c.document_id == Document.id) \
+            .filter(topic_documents.c.topic_id == topic.id).all()
     return []
 
+def get_documents_by_ids(session, document_ids, with_text=False):
+    """
+    Return the Document instances with the given ids (in no particular order)
+    in a single IN query. Only ids, titles and links are loaded unless
+    with_text is set, for displaying search hits without pulling abstracts.
+    """
+    if not document_ids:
+        return []
+    query = session.query(Document).filter(Document.id.in_([int(i) for i in document_ids]))
+    if with_text:
+        query = query.options(undefer_group('content'))
+    else:
+        query = query.options(load_only(Document.id, Document.title, Document.pdf_link))
+    with span("db_load"):
+        return query.all()
+
+def iter_documents(session, topic_id=None, batch_size=500):
+    """
+    Stream full Document instances (optionally one topic's) in id order,
+    batch_size rows at a time, for scans such as re-indexing. The session
+    must not be committed until the iteration is finished.
+    """
+    query = session.query(Document).options(undefer_group('content'))
+    if topic_id is not None:
+        query = query.join(topic_documents, topic_documents.c.document_id == Document.id) \
+            .filter(topic_documents.c.topic_id == topic_id)
+    return query.order_by(Document.id).yield_per(batch_size)
+
 # Testing the data access functions:
 if __name__ == "__main__":
     session = get_session()
@@ -1,33 +1,28 @@
 # src/data_acquisition.py
 
-import requests
-import feedparser
-import os
-from data_access import add_document
-from db import get_session
+from arxiv_fetcher import get_fetcher
+from data_access import bulk_add_documents, get_documents_by_ids, parse_arxiv_id
+from db import session_scope
+from embedding_store import update_topic_embeddings
+from passages import update_topic_passages
+from lexical_index import update_topic_lexical_index
+from metadata_index import update_metadata
+from index_store import update_topic_index
 
 def query_arxiv(search_query, start=0, max_results=5):
     """
     Query the arXiv API with a search query starting at a given index,
     returning up to max_results entries.
+    Uses the shared fetcher's pooled session, rate limit and retries.
     """
-    base_url = "http://export.arxiv.org/api/query?"
-    query = f"search_query=all:{search_query}&start={start}&max_results={max_results}"
-    url = base_url + query
-    print("Querying:", url)
-    
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f"Error querying arXiv API: {response.status_code}")
-    
-    feed = feedparser.parse(response.text)
-    return feed.entries
+    print(f"Querying arXiv: {search_query} (start={start}, max_results={max_results})")
+    return get_fetcher().fetch_page(search_query, start, max_results)
 
 def process_entries(entries):
     """
     Process arXiv API feed entries into a list of document dictionaries.
     Each document contains a title, combined text (title + summary),
-    PDF link, and list of authors.
+    PDF link, list of authors, and the arXiv id and version.
     """
     documents = []
     for entry in entries:
@@ -35,59 +30,94 @@ def process_entries(entries):
         text = entry.title + ". " + entry.summary
         # Construct the PDF link by replacing 'abs' with 'pdf' and appending '.pdf'
         pdf_link = entry.id.replace("abs", "pdf") + ".pdf"
+        arxiv_id, arxiv_version = parse_arxiv_id(entry.id)
         documents.append({
             'title': entry.title,
             'text': text,
             'pdf_link': pdf_link,
-            'authors': [author.name for author in entry.authors]
+            'authors': [author.name for author in entry.authors],
+            'arxiv_id': arxiv_id,
+            'arxiv_version': arxiv_version
         })
     return documents
 
-def query_arxiv_paginated(search_query, total_results=50, batch_size=5, start=0):
+def query_arxiv_paginated(search_query, total_results=50, batch_size=100, start=0):
     """
     Retrieve entries from the arXiv API using pagination,
-    starting from a given offset.
+    starting from a given offset. Pages are fetched concurrently.
     """
-    all_entries = []
-    for offset in range(start, start + total_results, batch_size):
-        entries = query_arxiv(search_query, start=offset, max_results=batch_size)
-        all_entries.extend(entries)
-    return all_entries
+    return get_fetcher().fetch_topic(search_query, total_results=total_results,
+                                     start=start, page_size=batch_size)
 
-def download_and_save_topic_to_db(topic, total_results=50, batch_size=5):
+def download_and_save_topic_to_db(topic, total_results=50, batch_size=100):
     """
     Fetch documents for the given topic via the arXiv API and insert them
-    into the PostgreSQL database. Uses the add_document function for insertion.
+    into the PostgreSQL database. Each page is inserted with bulk_add_documents.
+    Embeddings for new or changed documents are computed once here, at ingest time.
     
-    Returns the list of processed document dictionaries.
-    """
-    # Open a new session.
-    session = get_session()
+    Pages are stored as they arrive and the fetch is checkpointed, so an
+    interrupted ingest resumes from the last stored page.
     
-    print(f"\nFetching documents for topic: '{topic}' ...")
-    # Retrieve entries using pagination.
-    entries = query_arxiv_paginated(topic, total_results=total_results, batch_size=batch_size)
-    docs = process_entries(entries)
-    
-    # For each document, insert it into the database.
-    for doc in docs:
-        # Convert the list of authors to a comma-separated string.
-        authors_str = ", ".join(doc['authors'])
-        add_document(
-            session,
-            topic_name=topic,
-            title=doc['title'],
-            text=doc['text'],
-            pdf_link=doc['pdf_link'],
-            authors=authors_str
-        )
+    Returns the list of processed document dictionaries, each with the 'id'
+    of its stored Document.
+    """
+    return download_and_save_topics_to_db([topic], total_results=total_results, batch_size=batch_size)[topic]
+
+def stored_documents(session, document_ids):
+    """Document dictionaries, as process_entries returns them plus 'id', rebuilt from the stored rows."""
+    by_id = {doc.id: doc for doc in get_documents_by_ids(session, document_ids, with_text=True)}
+    return [{
+        'id': doc.id,
+        'title': doc.title,
+        'text': doc.text,
+        'pdf_link': doc.pdf_link,
+        'authors': doc.authors.split(", ") if doc.authors else [],
+        'arxiv_id': doc.arxiv_id,
+        'arxiv_version': doc.arxiv_version,
+    } for doc in (by_id.get(i) for i in document_ids) if doc is not None]
+
+def download_and_save_topics_to_db(topics, total_results=50, batch_size=100):
+    """
+    Fetch several topics concurrently under the shared rate limit and store them.
+    Returns { topic: [processed document dictionaries] } covering the whole
+    requested range, also when the fetch resumed from a checkpoint.
+    """
+    results = {topic: [] for topic in topics}
+    # Ids stored per topic, kept in the fetch checkpoint.
+    # Format: { topic: [document ids] }
+    stored = {}
     
-    session.close()
-    print(f"Stored documents for topic: '{topic}' in the database.")
-    return docs
+    print(f"\nFetching documents for topics: {topics} ...")
+    # Open a session for the whole run; it is closed even if a fetch fails.
+    with session_scope() as session:
+        for topic, offset, entries in get_fetcher().iter_pages(topics, total_results=total_results,
+                                                               page_size=batch_size, stored=stored):
+            docs = process_entries(entries)
+            ids = bulk_add_documents(session, topic, docs)
+            for doc, doc_id in zip(docs, ids):
+                doc['id'] = doc_id
+            stored[topic].extend(ids)
+            results[topic].extend(docs)
+        
+        for topic in topics:
+            # Pages stored before an interrupted fetch was resumed come from the database.
+            ids = stored.get(topic, [])
+            resumed = ids[:len(ids) - len(results[topic])]
+            if resumed:
+                results[topic] = stored_documents(session, resumed) + results[topic]
+
+            # Encode only the documents that have no up-to-date stored embedding,
+            # chunk and embed their passages, then append both to the on-disk indexes.
+            encoded_ids = update_topic_embeddings(session, topic)
+            update_topic_passages(session, topic)
+            update_topic_index(session, topic, refresh_ids=encoded_ids)
+            update_topic_lexical_index(session, topic)
+            print(f"Stored documents for topic: '{topic}' in the database.")
+        # Refresh the filter metadata used by global search once for all topics.
+        update_metadata(session)
+    return results
 
 if __name__ == "__main__":
     # Example: Fetch and store documents for multiple topics.
     topics = ["deep learning", "machine learning", "neural networks"]
-    for topic in topics:
-        download_and_save_topic_to_db(topic, total_results=20, batch_size=5)
+    download_and_save_topics_to_db(topics, total_results=20)
@@ -1,28 +1,150 @@
 # src/db.py
+import logging
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+from metrics import incr, observe
+
 # Load environment variables from .env file in project root
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 username = os.environ.get("PG_USERNAME")
 password = os.environ.get("PG_PASSWORD")
 host = os.environ.get("PG_HOST", "localhost")
 db_name = os.environ.get("PG_DATABASE")
 port = os.environ.get("PG_PORT", "5432")
 
-db_url = f"postgresql+psycopg2://{username}:{password}@{host}:{port}/{db_name}"
+# Opt-in SQLite database for tests and quick local runs, used when no PostgreSQL
+# database is configured. Without it, a missing configuration is an error rather
+# than silently writing to a local file.
+SQLITE_FALLBACK = os.environ.get("DB_SQLITE_FALLBACK", "0") == "1"
+SQLITE_PATH = os.environ.get(
+    "SQLITE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'app.sqlite')
+)
+
+# Connection pool settings (PostgreSQL).
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") == "1"
+# SQL echo and statement timing are off by default; they cost log I/O on every query.
+ECHO = os.environ.get("DB_ECHO", "0") == "1"
+TIMING = os.environ.get("DB_TIMING", "0") == "1"
+SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", "100"))
+
+def database_url():
+    """
+    DATABASE_URL if set, else the PostgreSQL database from the PG_* variables,
+    else, with DB_SQLITE_FALLBACK=1, a local SQLite file (for tests and quick local runs).
+    """
+    if os.environ.get("DATABASE_URL"):
+        return os.environ["DATABASE_URL"]
+    if db_name:
+        return f"postgresql+psycopg2://{username}:{password}@{host}:{port}/{db_name}"
+    if not SQLITE_FALLBACK:
+        raise RuntimeError("No database configured: set PG_DATABASE (and the other PG_* variables) or "
+                           "DATABASE_URL, or DB_SQLITE_FALLBACK=1 to use a local SQLite file.")
+    logger.warning("No PostgreSQL database configured; using SQLite at %s", os.path.abspath(SQLITE_PATH))
+    os.makedirs(os.path.dirname(os.path.abspath(SQLITE_PATH)), exist_ok=True)
+    return f"sqlite:///{SQLITE_PATH}"
+
+def make_engine(url=None, echo=ECHO, timing=TIMING):
+    """
+    Create an engine with pooling suited to the backend. Statements are always
+    counted (db_statements_total); timing them is optional.
+    """
+    url = url or database_url()
+    if url.startswith("sqlite"):
+        engine = create_engine(url, echo=echo, connect_args={'check_same_thread': False})
+
+        @event.listens_for(engine, "connect")
+        def _sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            # Enforce ON DELETE CASCADE and let readers run alongside a writer.
+            cursor.execute("PRAGMA foreign_keys=ON")
+            if ":memory:" not in url:
+                cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.close()
+    else:
+        engine = create_engine(url, echo=echo, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                               pool_timeout=POOL_TIMEOUT, pool_recycle=POOL_RECYCLE, pool_pre_ping=POOL_PRE_PING)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        incr("db_statements_total")
+
+    if timing:
+        enable_timing(engine)
+    return engine
+
+# Statement timing, collected only when enabled.
+# Format: { 'statements': int, 'total_ms': float, 'slow': int }
+_TIMING_STATS = {'statements': 0, 'total_ms': 0.0, 'slow': 0}
+_TIMING_LOCK = threading.Lock()
+
+def enable_timing(engine):
+    """Time every statement on the engine and log the ones slower than SLOW_QUERY_MS."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info['query_start'].pop()) * 1000
+        observe("db_statement_seconds", elapsed_ms / 1000)
+        with _TIMING_LOCK:
+            _TIMING_STATS['statements'] += 1
+            _TIMING_STATS['total_ms'] += elapsed_ms
+            if elapsed_ms >= SLOW_QUERY_MS:
+                _TIMING_STATS['slow'] += 1
+        if elapsed_ms >= SLOW_QUERY_MS:
+            logger.warning("Slow query (%.0f ms): %s", elapsed_ms, " ".join(statement.split())[:500])
+
+def timing_stats():
+    """Statement count, total time and slow statement count since timing was enabled."""
+    with _TIMING_LOCK:
+        return dict(_TIMING_STATS)
+
+def pool_status():
+    """Checked-out and idle connections of the shared engine's pool."""
+    return engine.pool.status()
 
 # Create the SQLAlchemy engine
-engine = create_engine(db_url, echo=True)  # echo=True logs SQL commands to the console
+engine = make_engine()
 
-# Create a configured "Session" class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Create a configured "Session" class. Objects stay usable after their session
+# is closed, since callers render them once the session_scope block has ended.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 def get_session():
     """
     Returns a new session for interacting with the database.
+    Prefer session_scope, which always returns the connection to the pool.
     """
     return SessionLocal()
+
+@contextmanager
+def session_scope():
+    """
+    Provide a session for a unit of work: committed if the block succeeds,
+    rolled back if it raises, and closed either way.
+    """
+    session = SessionLocal()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
@@ -0,0 +1,157 @@
+# src/embedding_store.py
+import hashlib
+import numpy as np
+
+from models import Document, DocumentEmbedding, Passage, PassageEmbedding, topic_documents
+from sqlalchemy import and_
+from sqlalchemy.orm import undefer_group
+
+from data_access import get_topic_by_name, iter_documents
+from metrics import incr, span
+from model_registry import get_embedding_model
+
+DEFAULT_EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+
+def content_hash(text):
+    """Return the SHA-1 hex digest used to detect changed document text."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def encode_texts(model, texts, batch_size=64):
+    """
+    Encode a list of texts into a contiguous float32 matrix of shape (n, dim).
+    """
+    with span("embed"):
+        embeddings = model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    incr("texts_embedded_total", len(texts))
+    return np.ascontiguousarray(embeddings, dtype='float32')
+
+def update_embeddings(session, documents, model_name=DEFAULT_EMBEDDING_MODEL, model=None):
+    """
+    Encode and persist embeddings for the given Document instances.
+    Only documents with no stored embedding for model_name, or whose text
+    has changed since it was encoded, are sent through the model.
+
+    Returns the list of Document ids that were (re-)encoded.
+    """
+    if not documents:
+        return []
+
+    doc_ids = [doc.id for doc in documents]
+    stored = dict(
+        session.query(DocumentEmbedding.document_id, DocumentEmbedding.content_hash)
+        .filter(DocumentEmbedding.model_name == model_name,
+                DocumentEmbedding.document_id.in_(doc_ids))
+        .all()
+    )
+
+    stale = []
+    for doc in documents:
+        digest = content_hash(doc.text)
+        if stored.get(doc.id) != digest:
+            stale.append((doc, digest))
+    if not stale:
+        return []
+
+    # The model is only loaded when there is actually something to encode.
+    if model is None:
+        model = get_embedding_model(model_name)
+    vectors = encode_texts(model, [doc.text for doc, _ in stale])
+
+    for (doc, digest), vector in zip(stale, vectors):
+        session.merge(DocumentEmbedding(
+            document_id=doc.id,
+            model_name=model_name,
+            content_hash=digest,
+            dim=vector.shape[0],
+            vector=vector.tobytes()
+        ))
+    session.commit()
+    return [doc.id for doc, _ in stale]
+
+def update_topic_embeddings(session, topic_name, model_name=DEFAULT_EMBEDDING_MODEL, model=None):
+    """
+    Bring the stored embeddings for every document of a topic up to date.
+    The topic is streamed and only the changed documents are kept in memory.
+    Returns the list of Document ids that were (re-)encoded.
+    """
+    topic = get_topic_by_name(session, topic_name)
+    if topic is None:
+        return []
+    stored = dict(
+        session.query(DocumentEmbedding.document_id, DocumentEmbedding.content_hash)
+        .join(topic_documents, topic_documents.c.document_id == DocumentEmbedding.document_id)
+        .filter(topic_documents.c.topic_id == topic.id, DocumentEmbedding.model_name == model_name)
+        .all()
+    )
+    stale = [doc for doc in iter_documents(session, topic_id=topic.id) if stored.get(doc.id) != content_hash(doc.text)]
+    return update_embeddings(session, stale, model_name=model_name, model=model)
+
+def documents_without_embeddings(session, topic_id, model_name=DEFAULT_EMBEDDING_MODEL):
+    """
+    Documents of a topic with no stored embedding for model_name, found with
+    an anti-join so the rest of the topic is never loaded.
+    """
+    return session.query(Document).options(undefer_group('content')) \
+        .join(topic_documents, topic_documents.c.document_id == Document.id) \
+        .outerjoin(DocumentEmbedding, and_(DocumentEmbedding.document_id == Document.id,
+                                           DocumentEmbedding.model_name == model_name)) \
+        .filter(topic_documents.c.topic_id == topic_id, DocumentEmbedding.document_id.is_(None)).all()
+
+def _embedding_columns(level):
+    """(table, id column) holding the embeddings of the given level: 'document' or 'passage'."""
+    if level == 'passage':
+        return PassageEmbedding, PassageEmbedding.passage_id
+    if level == 'document':
+        return DocumentEmbedding, DocumentEmbedding.document_id
+    raise ValueError(f"Unknown embedding level '{level}', expected 'document' or 'passage'")
+
+def _filter_topic(query, level, topic_id):
+    """Restrict an embedding query to one topic's documents (or their passages)."""
+    if level == 'passage':
+        query = query.join(Passage, Passage.id == PassageEmbedding.passage_id)
+        document_id = Passage.document_id
+    else:
+        document_id = DocumentEmbedding.document_id
+    return query.join(topic_documents, topic_documents.c.document_id == document_id) \
+        .filter(topic_documents.c.topic_id == topic_id)
+
+def stored_embedding_ids(session, topic_id=None, model_name=DEFAULT_EMBEDDING_MODEL, level='document'):
+    """
+    Return the ids of documents (or passages, with level='passage') that have
+    a stored embedding for model_name, optionally restricted to one topic,
+    without loading the vectors.
+    """
+    table, id_column = _embedding_columns(level)
+    query = session.query(id_column).filter(table.model_name == model_name)
+    if topic_id is not None:
+        query = _filter_topic(query, level, topic_id)
+    return np.array([row[0] for row in query.all()], dtype='int64')
+
+def load_embedding_matrix(session, topic_id=None, model_name=DEFAULT_EMBEDDING_MODEL, document_ids=None,
+                          level='document'):
+    """
+    Load stored embeddings as one contiguous float32 matrix.
+    If topic_id is given, only that topic's documents are loaded; if
+    document_ids is given, only those documents are loaded. With
+    level='passage' the rows are passages and document_ids are passage ids.
+
+    Returns (ids, matrix) where ids is an int64 array of Document (or Passage)
+    ids and matrix[i] is the embedding of ids[i].
+    """
+    table, id_column = _embedding_columns(level)
+    query = session.query(id_column.label('id'), table.dim, table.vector) \
+        .filter(table.model_name == model_name)
+    if topic_id is not None:
+        query = _filter_topic(query, level, topic_id)
+    if document_ids is not None:
+        query = query.filter(id_column.in_([int(i) for i in document_ids]))
+    rows = query.order_by(id_column).all()
+
+    if not rows:
+        return np.empty(0, dtype='int64'), np.empty((0, 0), dtype='float32')
+
+    ids = np.fromiter((row.id for row in rows), dtype='int64', count=len(rows))
+    dim = rows[0].dim
+    # Join the raw buffers once so the result is a single contiguous block.
+    matrix = np.frombuffer(b''.join(row.vector for row in rows), dtype='float32').reshape(len(rows), dim)
+    return ids, matrix
@@ -1,22 +1,304 @@
 # src/generation.py
-from transformers import T5ForConditionalGeneration, T5Tokenizer
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
 
-def load_generator(model_name="t5-small"):
+import numpy as np
+import torch
+from transformers import T5ForConditionalGeneration, T5Tokenizer, TextIteratorStreamer
+
+from metrics import observe, span
+
+# Inference backends selectable in load_generator.
+BACKENDS = ('fp32', 'int8', 'onnx')
+
+# Decoding presets: greedy is the fastest, beam the most thorough.
+DECODING_PRESETS = {
+    'greedy': {'num_beams': 1},
+    'fast_beam': {'num_beams': 2},
+    'beam': {'num_beams': 4},
+}
+
+# Longest input (prompt plus context) the T5 encoder is given.
+MAX_INPUT_TOKENS = 512
+
+# Where exported ONNX models are kept so the export only happens once.
+ONNX_DIR = os.environ.get(
+    "ONNX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'onnx')
+)
+
+_THREADS_CONFIGURED = False
+
+def configure_threads(num_threads=None, num_interop_threads=None):
+    """
+    Set torch's intra-op and inter-op thread pools. Defaults come from the
+    GENERATION_THREADS / GENERATION_INTEROP_THREADS environment variables;
+    unset values leave torch's defaults alone. Inter-op threads can only be
+    set once per process, before any parallel work has run.
+    """
+    global _THREADS_CONFIGURED
+    num_threads = num_threads or int(os.environ.get("GENERATION_THREADS", "0"))
+    num_interop_threads = num_interop_threads or int(os.environ.get("GENERATION_INTEROP_THREADS", "0"))
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads and not _THREADS_CONFIGURED:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            # Already fixed by earlier parallel work in this process.
+            pass
+        _THREADS_CONFIGURED = True
+
+def load_tokenizer(model_name="t5-small"):
+    """Load the tokenizer for a T5 model."""
+    return T5Tokenizer.from_pretrained(model_name)
+
+def load_generator(model_name="t5-small", backend="fp32"):
     """
     Load the T5 model and tokenizer.
     You can change model_name to, e.g., "t5-base" or "t5-large" as desired.
+    
+    backend selects the CPU inference path:
+        fp32 - the original PyTorch model
+        int8 - dynamic int8 quantization of the Linear layers
+        onnx - ONNX Runtime via optimum (optional dependency), exported once to ONNX_DIR
     """
-    tokenizer = T5Tokenizer.from_pretrained(model_name)
-    model = T5ForConditionalGeneration.from_pretrained(model_name)
+    configure_threads()
+    tokenizer = load_tokenizer(model_name)
+    if backend == "fp32":
+        model = T5ForConditionalGeneration.from_pretrained(model_name)
+    elif backend == "int8":
+        model = T5ForConditionalGeneration.from_pretrained(model_name)
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif backend == "onnx":
+        model = _load_onnx_generator(model_name)
+    else:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
     return model, tokenizer
 
-def generate_response(query, context, model, tokenizer, max_length=150, num_beams=4):
+def onnx_export_dir(model_name):
+    """Directory holding the ONNX export of a model."""
+    return os.path.join(ONNX_DIR, model_name.replace('/', '_'))
+
+def onnx_size_bytes(model_name):
+    """
+    Size of a model's exported ONNX graphs and external weight files. Each
+    ONNX Runtime session loads its file's weights, so this approximates the
+    resident size of the loaded generator.
+    """
+    export_dir = onnx_export_dir(model_name)
+    if not os.path.isdir(export_dir):
+        return 0
+    return sum(os.path.getsize(os.path.join(export_dir, name)) for name in os.listdir(export_dir)
+               if name.endswith(('.onnx', '.onnx_data')))
+
+def _load_onnx_generator(model_name):
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError as e:
+        raise ImportError("The onnx backend needs optimum[onnxruntime]: pip install optimum[onnxruntime]") from e
+    export_dir = onnx_export_dir(model_name)
+    if os.path.isdir(export_dir):
+        return ORTModelForSeq2SeqLM.from_pretrained(export_dir)
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True)
+    model.save_pretrained(export_dir)
+    return model
+
+def build_input(query, context):
+    """The T5 question-answering prompt for a query and its context."""
+    return f"question: {query} context: {context}"
+
+def generate_response(query, context, model, tokenizer, max_length=150, num_beams=4, preset=None):
     """
     Generate a response given a query and context.
     Combines query and context, encodes them, and generates an answer.
+    A decoding preset (see DECODING_PRESETS) overrides num_beams.
     """
-    input_text = f"question: {query} context: {context}"
-    input_ids = tokenizer.encode(input_text, return_tensors="pt", truncation=True, max_length=512)
-    outputs = model.generate(input_ids, max_length=max_length, num_beams=num_beams, early_stopping=True)
+    if preset is not None:
+        num_beams = DECODING_PRESETS[preset]['num_beams']
+    input_text = build_input(query, context)
+    input_ids = tokenizer.encode(input_text, return_tensors="pt", truncation=True, max_length=MAX_INPUT_TOKENS)
+    with span("generate"), torch.inference_mode():
+        outputs = model.generate(input_ids, max_length=max_length, num_beams=num_beams, early_stopping=num_beams > 1)
     response = tokenizer.decode(outputs[0], skip_special_tokens=True)
     return response
+
+def stream_response(query, context, model, tokenizer, max_length=150, do_sample=False, top_p=0.9, temperature=1.0):
+    """
+    Generate a response token by token, yielding text pieces as soon as they
+    are decoded so the UI can render them progressively.
+    Beam search cannot emit tokens before it finishes, so streaming always
+    decodes greedily (or by nucleus sampling with do_sample=True).
+    """
+    input_ids = tokenizer.encode(build_input(query, context), return_tensors="pt", truncation=True, max_length=MAX_INPUT_TOKENS)
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    kwargs = {'max_length': max_length, 'num_beams': 1, 'do_sample': do_sample, 'streamer': streamer}
+    if do_sample:
+        kwargs.update(top_p=top_p, temperature=temperature)
+
+    errors = []
+    def run():
+        try:
+            with torch.inference_mode():
+                model.generate(input_ids, **kwargs)
+        except Exception as e:
+            errors.append(e)
+            # Unblock the consumer waiting on the streamer.
+            streamer.end()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    for text in streamer:
+        if text:
+            yield text
+    thread.join()
+    if errors:
+        raise errors[0]
+
+def timed_stream(pieces, timings):
+    """
+    Pass through a stream of text pieces, recording into the timings dict the
+    time to first token ('ttft_s') and the total time ('total_s') in seconds.
+    """
+    start = time.perf_counter()
+    timings['ttft_s'] = None
+    for piece in pieces:
+        if timings['ttft_s'] is None:
+            timings['ttft_s'] = time.perf_counter() - start
+            observe("generation_ttft_seconds", timings['ttft_s'])
+        yield piece
+    timings['total_s'] = time.perf_counter() - start
+    observe("stage_seconds", timings['total_s'], stage="generate_stream")
+
+def generate_batch(queries, contexts, model, tokenizer, max_length=150, num_beams=4):
+    """
+    Generate responses for several (query, context) pairs with one padded
+    generate call. Returns the responses in input order.
+    """
+    input_texts = [build_input(query, context) for query, context in zip(queries, contexts)]
+    inputs = tokenizer(input_texts, return_tensors="pt", padding=True, truncation=True, max_length=MAX_INPUT_TOKENS)
+    observe("generation_batch_size", len(input_texts))
+    with span("generate"), torch.inference_mode():
+        outputs = model.generate(**inputs, max_length=max_length, num_beams=num_beams, early_stopping=num_beams > 1)
+    return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+class BatcherClosed(RuntimeError):
+    """Raised when submitting to a BatchingGenerator that has been closed."""
+
+class BatchingGenerator:
+    """
+    Background micro-batching front end for one model.
+
+    Requests submitted from any thread are queued; a worker thread collects
+    the requests that arrive within max_wait_ms of the first one (up to
+    max_batch_size), runs one generate_batch call per set of generation
+    parameters, and resolves each request's future with its answer. This
+    keeps concurrent sessions from each running their own generate call and
+    fighting over CPU threads.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8, max_wait_ms=20):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._queue_waits = deque(maxlen=1000)
+        self.requests = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self._closed = False
+        # Orders submits against close, so no request is queued behind the shutdown marker.
+        self._submit_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="batching-generator", daemon=True)
+        self._worker.start()
+
+    def submit(self, query, context, max_length=150, num_beams=4):
+        """Queue a request. Returns a Future resolving to the generated answer."""
+        future = Future()
+        with self._submit_lock:
+            if self._closed:
+                raise BatcherClosed("BatchingGenerator is closed")
+            self._queue.put((time.perf_counter(), query, context, (max_length, num_beams), future))
+        return future
+
+    def generate(self, query, context, max_length=150, num_beams=4, timeout=None):
+        """Submit a request and wait for its answer."""
+        return self.submit(query, context, max_length=max_length, num_beams=num_beams).result(timeout=timeout)
+
+    def _collect(self):
+        """Block for one request, then gather more until the batch is full or the wait expires."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the shutdown marker back for the main loop.
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            # Only requests with identical generation parameters can share a generate call.
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[3], []).append(item)
+            for (max_length, num_beams), items in groups.items():
+                try:
+                    answers = generate_batch([item[1] for item in items], [item[2] for item in items],
+                                             self.model, self.tokenizer,
+                                             max_length=max_length, num_beams=num_beams)
+                    for item, answer in zip(items, answers):
+                        item[4].set_result(answer)
+                except Exception as e:
+                    for item in items:
+                        item[4].set_exception(e)
+            with self._lock:
+                self.requests += len(batch)
+                self.batches += len(groups)
+                self.busy_seconds += time.perf_counter() - start
+                self._queue_waits.extend(start - item[0] for item in batch)
+
+    def stats(self):
+        """Throughput, batch sizes and queue latency percentiles (milliseconds)."""
+        with self._lock:
+            waits = np.array(self._queue_waits) * 1000 if self._queue_waits else np.zeros(1)
+            return {
+                'requests': self.requests,
+                'batches': self.batches,
+                'avg_batch_size': self.requests / self.batches if self.batches else 0.0,
+                'throughput_rps': self.requests / self.busy_seconds if self.busy_seconds else 0.0,
+                'queue_p50_ms': float(np.percentile(waits, 50)),
+                'queue_p95_ms': float(np.percentile(waits, 95)),
+                'pending': self._queue.qsize(),
+            }
+
+    def close(self, wait=True):
+        """Stop the worker once the queued requests have been served; wait=False returns at once."""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        if wait:
+            self._worker.join()
@@ -0,0 +1,234 @@
+# src/index_store.py
+import os
+import tempfile
+import threading
+import numpy as np
+import faiss
+
+from data_access import get_topic_by_name
+from metrics import span
+from embedding_store import DEFAULT_EMBEDDING_MODEL, load_embedding_matrix, stored_embedding_ids
+from retrieval import make_index, min_training_points, train_index, set_search_params
+
+# Directory holding the serialized indexes; override with the INDEX_DIR env variable.
+INDEX_DIR = os.environ.get(
+    "INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'indexes')
+)
+
+GLOBAL_INDEX = "global"
+GLOBAL_PASSAGE_INDEX = "global_passages"
+
+# Index type used for new indexes (see retrieval.INDEX_TYPES) and its search-time knobs.
+INDEX_TYPE = os.environ.get("INDEX_TYPE", "flat")
+NPROBE = int(os.environ.get("INDEX_NPROBE", "16"))
+EF_SEARCH = int(os.environ.get("INDEX_EF_SEARCH", "64"))
+
+# Per-process cache of opened read-only indexes.
+# Format: { path: (mtime_ns, index) }
+_OPEN_INDEXES = {}
+_LOCK = threading.Lock()
+
+def topic_index_name(topic_id, level='document'):
+    """Name of the on-disk index for a topic, over its documents or its passages."""
+    return f"topic_{topic_id}_passages" if level == 'passage' else f"topic_{topic_id}"
+
+def index_path(name, model_name=DEFAULT_EMBEDDING_MODEL):
+    """Path of the serialized index for the given index name and embedding model."""
+    safe_model = model_name.replace('/', '_')
+    return os.path.join(INDEX_DIR, f"{name}.{safe_model}.faiss")
+
+def new_index(embeddings, index_type=None):
+    """
+    Create an empty index whose search results are Document ids
+    rather than row positions, trained on the given embeddings if the
+    index type needs it. Falls back to an exact flat index while there
+    are too few vectors to train the configured type.
+    """
+    index_type = index_type or INDEX_TYPE
+    if len(embeddings) < min_training_points(index_type):
+        index_type = 'flat'
+    index = make_index(index_type, embeddings.shape[1])
+    train_index(index, embeddings)
+    return faiss.IndexIDMap2(index)
+
+def indexed_ids(index):
+    """Return the Document ids stored in the index as an int64 array."""
+    return faiss.vector_to_array(index.id_map).astype('int64')
+
+def save_index(index, path):
+    """
+    Atomically write an index to disk: the index is written to a temporary
+    file in the same directory and then renamed over the old one, so readers
+    never see a partially written file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def index_version(name, model_name=DEFAULT_EMBEDDING_MODEL):
+    """
+    Version stamp of an on-disk index (its modification time), or None if it
+    does not exist. Changes whenever the index is rewritten.
+    """
+    try:
+        return os.stat(index_path(name, model_name)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def open_index(name, model_name=DEFAULT_EMBEDDING_MODEL):
+    """
+    Open an index read-only and memory-mapped, so several worker processes
+    share the same pages instead of each holding a copy.
+    The opened index is cached and transparently reopened when the file is replaced.
+
+    Returns the index, or None if it has not been built yet.
+    """
+    path = index_path(name, model_name)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    with _LOCK:
+        cached = _OPEN_INDEXES.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        # Newer faiss releases can also memory-map flat code storage; the two
+        # mmap flags must not be combined.
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        index = faiss.read_index(path, flags)
+        set_search_params(index, nprobe=NPROBE, ef_search=EF_SEARCH)
+        _OPEN_INDEXES[path] = (mtime, index)
+        return index
+
+def update_index(session, name, topic_id=None, model_name=DEFAULT_EMBEDDING_MODEL, refresh_ids=None,
+                 level='document'):
+    """
+    Append the stored embeddings that are not yet in the named index and save it.
+    If topic_id is given, only that topic's documents are considered.
+    Documents in refresh_ids (e.g. re-encoded after a text change) are replaced,
+    and ids whose embedding no longer exists (e.g. passages of a re-chunked
+    document) are removed. level='passage' indexes passage embeddings.
+
+    The update is idempotent: anything missing from the index (for example
+    after two processes raced on the same file) is picked up on the next call.
+
+    Returns the number of vectors added.
+    """
+    path = index_path(name, model_name)
+    # Writers need a private, writable copy rather than the shared mmap.
+    index = faiss.read_index(path) if os.path.exists(path) else None
+    stored_ids = stored_embedding_ids(session, topic_id=topic_id, model_name=model_name, level=level)
+
+    stale = np.empty(0, dtype='int64')
+    if index is not None and _outgrew_flat(index, len(stored_ids)):
+        # Rebuild once the corpus is large enough to train the configured type.
+        index = None
+    elif index is not None:
+        current = indexed_ids(index)
+        stale = np.union1d(np.intersect1d(np.asarray(refresh_ids or [], dtype='int64'), current),
+                           np.setdiff1d(current, stored_ids))
+        if len(stale):
+            if isinstance(faiss.downcast_index(index.index), faiss.IndexHNSW):
+                # HNSW graphs do not support removal, so rebuild instead.
+                index = None
+            else:
+                index.remove_ids(stale)
+
+    if index is None:
+        ids, matrix = load_embedding_matrix(session, topic_id=topic_id, model_name=model_name, level=level)
+        if len(ids) == 0:
+            return 0
+        index = new_index(matrix)
+        index.add_with_ids(matrix, ids)
+        save_index(index, path)
+        return len(ids)
+
+    # Diff on ids first so only the missing vectors are read from the database.
+    missing = np.setdiff1d(stored_ids, indexed_ids(index))
+    if len(missing) == 0:
+        if len(stale):
+            save_index(index, path)
+        return 0
+
+    ids, matrix = load_embedding_matrix(session, model_name=model_name, document_ids=missing, level=level)
+    index.add_with_ids(matrix, ids)
+    save_index(index, path)
+    return len(ids)
+
+def _outgrew_flat(index, n_vectors):
+    """True if a fallback flat index now has enough vectors to train INDEX_TYPE."""
+    base = faiss.downcast_index(index.index)
+    return (INDEX_TYPE != 'flat' and isinstance(base, faiss.IndexFlat)
+            and n_vectors >= min_training_points(INDEX_TYPE))
+
+def update_topic_index(session, topic_name, model_name=DEFAULT_EMBEDDING_MODEL, refresh_ids=None):
+    """
+    Bring a topic's document and passage indexes, and the global ones, up to
+    date with the stored embeddings. refresh_ids are re-encoded Document ids;
+    re-chunked passages get new ids, so their indexes need no refresh list.
+    Returns the number of vectors added to the topic's document index.
+    """
+    topic = get_topic_by_name(session, topic_name)
+    if topic is None:
+        return 0
+    added = update_index(session, topic_index_name(topic.id), topic_id=topic.id,
+                         model_name=model_name, refresh_ids=refresh_ids)
+    update_index(session, GLOBAL_INDEX, model_name=model_name, refresh_ids=refresh_ids)
+    update_index(session, topic_index_name(topic.id, level='passage'), topic_id=topic.id,
+                 model_name=model_name, level='passage')
+    update_index(session, GLOBAL_PASSAGE_INDEX, model_name=model_name, level='passage')
+    return added
+
+def id_selector(ids):
+    """
+    A faiss bitmap selector admitting only the given ids. The bitmap is kept
+    alive on the selector, which must itself outlive the search.
+    """
+    ids = np.asarray(ids, dtype='int64')
+    bits = np.zeros(int(ids.max()) + 1 if len(ids) else 1, dtype=bool)
+    bits[ids] = True
+    bitmap = np.packbits(bits, bitorder='little')
+    # The size is given in bytes; faiss treats ids past the end as excluded.
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    selector.bitmap_array = bitmap
+    return selector
+
+def search_params(index, ids):
+    """Search parameters restricting an id-mapped index to ids, keeping its nprobe / efSearch."""
+    selector = id_selector(ids)
+    base = faiss.downcast_index(index.index)
+    if isinstance(base, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+    if isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+def search_index(index, query_embeddings, top_k=3, ids=None):
+    """
+    Search an id-mapped index, optionally only among the given ids; the
+    filter is applied inside the search, so top_k results are still returned
+    when most of the index is excluded.
+    Returns (distances, ids) where ids are Document (or Passage) ids, and -1 marks an empty slot.
+    """
+    query_np = np.ascontiguousarray(query_embeddings, dtype='float32')
+    if query_np.ndim == 1:
+        query_np = query_np.reshape(1, -1)
+    if ids is None:
+        with span("faiss_search"):
+            return index.search(query_np, top_k)
+    if len(ids) == 0:
+        return (np.full((len(query_np), top_k), np.inf, dtype='float32'),
+                np.full((len(query_np), top_k), -1, dtype='int64'))
+    params = search_params(index, ids)
+    with span("faiss_search", filtered="1"):
+        return index.search(query_np, top_k, params=params)
@@ -0,0 +1,398 @@
+# src/ingest_jobs.py
+"""
+Background ingestion jobs.
+
+Fetch requests are queued in a SQLite file shared by every process, so a
+job keeps running when the browser tab that submitted it is closed, and
+several app processes (or a standalone worker, `python ingest_jobs.py`)
+can drain the same queue. A topic has at most one queued or running job.
+
+Each job is pipelined: arXiv pages are fetched concurrently by the shared
+fetcher while the previous pages are parsed and stored, and stored pages
+are embedded on a second thread as soon as they land, so network I/O and
+CPU-bound encoding overlap. The topic's indexes are updated once at the end.
+"""
+import argparse
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from arxiv_fetcher import get_fetcher
+from cache_utils import FETCH_CACHE, normalize_topic
+from data_access import bulk_add_documents, get_documents_by_ids
+from data_acquisition import process_entries
+from db import session_scope
+from embedding_store import DEFAULT_EMBEDDING_MODEL, update_embeddings
+from index_store import update_topic_index
+from lexical_index import update_topic_lexical_index
+from metadata_index import update_metadata
+from metrics import incr, span
+from model_registry import get_embedding_model
+from passages import update_document_passages
+
+JOBS_DB = os.environ.get(
+    "JOBS_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'jobs.sqlite')
+)
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "1"))
+# A running job whose worker has not reported for this long is assumed dead and re-queued.
+JOB_STALE_SECONDS = float(os.environ.get("JOB_STALE_SECONDS", "300"))
+# Stored pages waiting to be embedded before the fetch stage pauses.
+EMBED_QUEUE_PAGES = 4
+
+# Statuses of jobs that still hold their topic; the others are done, failed or cancelled.
+ACTIVE = ('queued', 'running')
+
+class JobCancelled(Exception):
+    pass
+
+class JobLost(Exception):
+    """The job was reclaimed by another worker after this one stopped reporting."""
+
+class JobQueue:
+    """
+    Ingest jobs persisted in SQLite (WAL mode, immediate write transactions),
+    safe to share between threads and processes. Each claim gets a new
+    claim_token; updates made with an outdated token are ignored, so a worker
+    whose job was reclaimed cannot overwrite the new owner's progress.
+    """
+
+    COLUMNS = ('id', 'topic', 'normalized_topic', 'start', 'total', 'status', 'stage', 'fetched', 'stored',
+               'embedded', 'error', 'cancel_requested', 'created_at', 'updated_at', 'claim_token')
+
+    def __init__(self, path=JOBS_DB):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, normalized_topic TEXT NOT NULL,"
+            " start INTEGER NOT NULL, total INTEGER NOT NULL, status TEXT NOT NULL, stage TEXT,"
+            " fetched INTEGER NOT NULL DEFAULT 0, stored INTEGER NOT NULL DEFAULT 0,"
+            " embedded INTEGER NOT NULL DEFAULT 0, error TEXT, cancel_requested INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL, claim_token TEXT)"
+        )
+        if 'claim_token' not in {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}:
+            conn.execute("ALTER TABLE jobs ADD COLUMN claim_token TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status, created_at)")
+        # Signalled on submit so workers in this process start without waiting for their next poll.
+        self.submitted = threading.Event()
+
+    def _conn(self):
+        # sqlite3 connections must not be shared between threads.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _row(self, row):
+        return dict(zip(self.COLUMNS, row)) if row is not None else None
+
+    def _cancel_abandoned(self, conn, now):
+        """Mark running jobs that were asked to stop, and whose worker has since died, as cancelled."""
+        conn.execute(
+            "UPDATE jobs SET status = 'cancelled', stage = NULL, claim_token = NULL, updated_at = ?"
+            " WHERE status = 'running' AND cancel_requested = 1 AND updated_at < ?", (now, now - JOB_STALE_SECONDS)
+        )
+
+    def submit(self, topic, total, start=0):
+        """
+        Queue a fetch of total documents for topic from offset start.
+        Returns (job_id, created); created is False when the topic already has
+        a queued or running job, whose id is returned instead.
+        """
+        normalized = normalize_topic(topic)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._cancel_abandoned(conn, now)
+            row = conn.execute(
+                f"SELECT id FROM jobs WHERE normalized_topic = ? AND status IN {ACTIVE} ORDER BY id LIMIT 1",
+                (normalized,)
+            ).fetchone()
+            if row is None:
+                job_id = conn.execute(
+                    "INSERT INTO jobs (topic, normalized_topic, start, total, status, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, 'queued', ?, ?)", (topic, normalized, start, total, now, now)
+                ).lastrowid
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is not None:
+            return row[0], False
+        self.submitted.set()
+        return job_id, True
+
+    def claim(self):
+        """
+        Mark the oldest queued (or abandoned running) job as running under a
+        new claim_token and return it, or None. Abandoned jobs that were asked
+        to stop are cancelled instead of being run again.
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._cancel_abandoned(conn, now)
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE (status = 'queued' OR (status = 'running' AND updated_at < ?))"
+                " AND cancel_requested = 0 ORDER BY created_at LIMIT 1", (now - JOB_STALE_SECONDS,)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', stage = 'fetch', claim_token = ?, updated_at = ?"
+                             " WHERE id = ?", (uuid.uuid4().hex, now, row[0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(row[0]) if row is not None else None
+
+    def get(self, job_id):
+        row = self._conn().execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row)
+
+    def list(self, limit=20):
+        """The most recent jobs, newest first."""
+        rows = self._conn().execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM jobs ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def update(self, job, **fields):
+        """
+        Set progress fields (stage, fetched, stored, embedded, status, error) of
+        a claimed job; also the heartbeat. Returns False, changing nothing, when
+        the job has since been reclaimed under another claim_token.
+        """
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        cursor = self._conn().execute(f"UPDATE jobs SET {assignments} WHERE id = ? AND claim_token = ?",
+                                      (*fields.values(), job['id'], job['claim_token']))
+        return cursor.rowcount > 0
+
+    def cancel(self, job_id):
+        """Cancel a queued job at once; a running job stops after the page it is working on."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status = 'queued'",
+                     (now, job_id))
+        # Leaves updated_at alone so a job whose worker has died is still seen as abandoned.
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+
+    def cancel_requested(self, job_id):
+        row = self._conn().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+def report(jobs, job, **fields):
+    """Update a job's progress, raising JobLost once another worker owns it."""
+    if not jobs.update(job, **fields):
+        raise JobLost()
+
+@contextmanager
+def heartbeat(jobs, job, interval=None):
+    """Keep a job's heartbeat fresh from a background thread during a long stage without progress updates."""
+    interval = interval or JOB_STALE_SECONDS / 4
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            if not jobs.update(job):
+                return
+
+    thread = threading.Thread(target=beat, name=f"ingest-heartbeat-{job['id']}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+def run_job(jobs, job, page_size=100, model_name=DEFAULT_EMBEDDING_MODEL):
+    """
+    Fetch, parse, store, embed and index one job's documents.
+    This thread fetches, parses and stores page by page (the fetcher already
+    downloads later pages concurrently); an embedding thread encodes each
+    stored page while the next ones are fetched. Returns the stored Document ids.
+    """
+    topic = job['topic']
+    pages = queue.Queue(maxsize=EMBED_QUEUE_PAGES)
+    errors, encoded_ids = [], []
+    progress = {'fetched': 0, 'stored': 0, 'embedded': 0}
+
+    def embed():
+        # Keeps draining the queue after an error so the fetch stage never blocks on it.
+        model = None
+        with session_scope() as session:
+            while True:
+                ids = pages.get()
+                if ids is None:
+                    return
+                if errors:
+                    continue
+                try:
+                    if model is None:
+                        model = get_embedding_model(model_name)
+                    with span("ingest_embed"):
+                        docs = get_documents_by_ids(session, ids, with_text=True)
+                        encoded_ids.extend(update_embeddings(session, docs, model_name=model_name, model=model))
+                        update_document_passages(session, docs, model_name=model_name, model=model)
+                    progress['embedded'] += len(ids)
+                    report(jobs, job, embedded=progress['embedded'])
+                except Exception as e:
+                    errors.append(e)
+
+    embedder = threading.Thread(target=embed, name=f"ingest-embed-{job['id']}", daemon=True)
+    embedder.start()
+    # Ids stored for the job's range, kept in the fetch checkpoint.
+    # Format: { topic: [document ids] }
+    stored, cancelled = {}, False
+    try:
+        with session_scope() as session:
+            pages_iter = get_fetcher().iter_pages([topic], total_results=job['total'], start=job['start'],
+                                                  page_size=page_size, stored=stored)
+            try:
+                for n, (_, _, entries) in enumerate(pages_iter):
+                    if n == 0 and stored[topic]:
+                        # Resumed from the checkpoint of an earlier run of this job; embed
+                        # whatever of its pages that run did not get to.
+                        progress['fetched'] = progress['stored'] = len(stored[topic])
+                        pages.put(list(stored[topic]))
+                    if errors:
+                        break
+                    if jobs.cancel_requested(job['id']):
+                        cancelled = True
+                        break
+                    progress['fetched'] += len(entries)
+                    with span("ingest_store"):
+                        ids = bulk_add_documents(session, topic, process_entries(entries))
+                    stored[topic].extend(ids)
+                    progress['stored'] += len(ids)
+                    report(jobs, job, stage='fetch', fetched=progress['fetched'], stored=progress['stored'])
+                    pages.put(ids)
+            finally:
+                pages_iter.close()
+    finally:
+        pages.put(None)
+        embedder.join()
+    if errors:
+        raise errors[0]
+
+    # Index whatever was stored, also when the job was cancelled part way.
+    report(jobs, job, stage='index')
+    with heartbeat(jobs, job), session_scope() as session, span("ingest_index"):
+        update_topic_index(session, topic, model_name=model_name, refresh_ids=encoded_ids)
+        update_topic_lexical_index(session, topic)
+        update_metadata(session)
+    if cancelled:
+        raise JobCancelled()
+    return stored.get(topic, [])
+
+def record_fetch(job, stored_ids):
+    """Merge a finished job's documents into the topic's FETCH_CACHE entry, as cached_fetch_topic would."""
+    normalized = normalize_topic(job['topic'])
+    entry = FETCH_CACHE.get(normalized)
+    ids = stored_ids if entry is None or job['start'] == 0 else list(dict.fromkeys(entry['ids'] + stored_ids))
+    FETCH_CACHE.set(normalized, {'fetched_at': time.time(), 'ids': ids, 'count': job['start'] + len(stored_ids)})
+
+def process_job(jobs, job):
+    """Run a claimed job and record its outcome, unless another worker has reclaimed it meanwhile."""
+    try:
+        stored_ids = run_job(jobs, job)
+    except JobLost:
+        incr("ingest_jobs_total", status="lost")
+        return
+    except JobCancelled:
+        if jobs.update(job, status='cancelled', stage=None):
+            incr("ingest_jobs_total", status="cancelled")
+        return
+    except Exception as e:
+        if jobs.update(job, status='failed', stage=None, error=str(e)):
+            incr("ingest_jobs_total", status="failed")
+        return
+    if jobs.update(job, status='done', stage=None):
+        record_fetch(job, stored_ids)
+        incr("ingest_jobs_total", status="done")
+
+class IngestWorkers:
+    """A pool of threads that claim and run jobs from a JobQueue until stopped."""
+
+    def __init__(self, jobs, workers=INGEST_WORKERS, poll_interval=2.0):
+        self.jobs = jobs
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._run, name=f"ingest-worker-{n}", daemon=True)
+                         for n in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            job = self.jobs.claim()
+            if job is None:
+                self.jobs.submitted.wait(self.poll_interval)
+                self.jobs.submitted.clear()
+                continue
+            process_job(self.jobs, job)
+
+    def stop(self):
+        self._stop.set()
+        self.jobs.submitted.set()
+        for thread in self._threads:
+            thread.join()
+
+_DEFAULT_QUEUE = None
+_DEFAULT_WORKERS = None
+_DEFAULT_LOCK = threading.Lock()
+
+def get_job_queue(start_workers=True):
+    """Shared job queue for this process, with its worker threads started on first use."""
+    global _DEFAULT_QUEUE, _DEFAULT_WORKERS
+    with _DEFAULT_LOCK:
+        if _DEFAULT_QUEUE is None:
+            _DEFAULT_QUEUE = JobQueue()
+        if start_workers and _DEFAULT_WORKERS is None and INGEST_WORKERS > 0:
+            _DEFAULT_WORKERS = IngestWorkers(_DEFAULT_QUEUE)
+        return _DEFAULT_QUEUE
+
+def submit_fetch(topic, total_requested, fetch_interval=3600):
+    """
+    Queue the fetch cached_fetch_topic would perform, without waiting for it.
+    Returns (job_id, created), or (None, False) when the cache already holds
+    enough fresh documents for the topic.
+    """
+    entry = FETCH_CACHE.get(normalize_topic(topic))
+    start = 0
+    if entry is not None and time.time() - entry['fetched_at'] < fetch_interval:
+        if entry['count'] >= total_requested:
+            return None, False
+        # Fetch only the documents missing from the cached entry.
+        start = entry['count']
+    return get_job_queue().submit(topic, total_requested - start, start=start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run ingest workers against the shared job queue.")
+    parser.add_argument('--workers', type=int, default=max(1, INGEST_WORKERS))
+    parser.add_argument('--submit', nargs='*', default=[], help="Topics to queue before starting.")
+    parser.add_argument('--total', type=int, default=50, help="Documents per submitted topic.")
+    args = parser.parse_args()
+
+    jobs = get_job_queue(start_workers=False)
+    for topic in args.submit:
+        job_id, created = jobs.submit(topic, args.total)
+        print(f"{'Queued' if created else 'Already queued'}: job {job_id} for '{topic}'")
+    workers = IngestWorkers(jobs, workers=args.workers)
+    print(f"{args.workers} ingest worker(s) running; press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        workers.stop()
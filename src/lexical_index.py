@@ -0,0 +1,182 @@
+# src/lexical_index.py
+import os
+import re
+import tempfile
+import threading
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+from models import Document, topic_documents
+from data_access import get_topic_by_name
+from metrics import span
+from index_store import INDEX_DIR, GLOBAL_INDEX, topic_index_name
+
+# Terms keep inner hyphens and dots so names like "gpt-3.5" or "resnet-50" stay whole.
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-.][a-z0-9]+)*")
+
+# Per-process cache of loaded lexical indexes.
+# Format: { path: (mtime_ns, BM25Index) }
+_OPEN_INDEXES = {}
+_LOCK = threading.Lock()
+
+def tokenize(text):
+    """Lowercased terms of a text."""
+    return TOKEN_RE.findall(text.lower())
+
+def document_terms(doc):
+    """Terms indexed for a document: its text (title and abstract) and its authors."""
+    return tokenize(f"{doc.text} {doc.authors or ''}")
+
+class BM25Index:
+    """
+    In-process BM25 inverted index.
+
+    The BM25 weight of every (document, term) pair is computed at build time
+    and held in a sparse column-major matrix, so scoring a query is a sum over
+    the columns of its terms.
+    """
+
+    def __init__(self, ids, vocabulary, weights):
+        self.ids = np.asarray(ids, dtype='int64')
+        # Format: { term: column }
+        self.vocabulary = vocabulary
+        self.weights = weights.tocsc()
+
+    @classmethod
+    def build(cls, ids, token_lists, k1=1.5, b=0.75):
+        """Build an index from document ids and their term lists."""
+        vocabulary, rows, cols, tfs = {}, [], [], []
+        lengths = np.array([len(tokens) for tokens in token_lists], dtype='float32')
+        for row, tokens in enumerate(token_lists):
+            for term, tf in Counter(tokens).items():
+                rows.append(row)
+                cols.append(vocabulary.setdefault(term, len(vocabulary)))
+                tfs.append(tf)
+        rows, cols, tfs = np.array(rows, dtype='int64'), np.array(cols, dtype='int64'), np.array(tfs, dtype='float32')
+
+        n_docs = len(token_lists)
+        df = np.bincount(cols, minlength=len(vocabulary))
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype('float32')
+        avg_length = lengths.mean() if n_docs else 0.0
+        norm = k1 * (1 - b + b * lengths[rows] / max(avg_length, 1e-9))
+        data = idf[cols] * tfs * (k1 + 1) / (tfs + norm)
+        weights = sparse.csc_matrix((data, (rows, cols)), shape=(n_docs, len(vocabulary)), dtype='float32')
+        return cls(ids, vocabulary, weights)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, top_k=10, ids=None):
+        """
+        Score the documents containing any query term, optionally only among
+        the given ids. Returns (ids, scores) of the top_k matches, best first.
+        """
+        cols = sorted({self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary})
+        if not cols:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='float32')
+        with span("bm25_search"):
+            scores = np.asarray(self.weights[:, cols].sum(axis=1)).ravel()
+            if ids is not None:
+                scores[~np.isin(self.ids, ids)] = 0
+            hits = np.flatnonzero(scores)
+            if len(hits) > top_k:
+                hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+            hits = hits[np.argsort(-scores[hits], kind='stable')]
+        return self.ids[hits], scores[hits]
+
+    def save(self, path):
+        """Atomically write the index as a compressed .npz file."""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        terms = np.empty(len(self.vocabulary), dtype=object)
+        for term, col in self.vocabulary.items():
+            terms[col] = term
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, ids=self.ids, terms=terms.astype(str), data=self.weights.data,
+                                    indices=self.weights.indices, indptr=self.weights.indptr,
+                                    shape=np.array(self.weights.shape))
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            weights = sparse.csc_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            vocabulary = {term: col for col, term in enumerate(f['terms'].tolist())}
+            return cls(f['ids'], vocabulary, weights)
+
+def lexical_index_path(name):
+    """Path of the serialized lexical index with the given name (as used for the FAISS indexes)."""
+    return os.path.join(INDEX_DIR, f"{name}.bm25.npz")
+
+def lexical_index_version(name):
+    """Modification time of the on-disk lexical index, or None if it does not exist."""
+    try:
+        return os.stat(lexical_index_path(name)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def open_lexical_index(name):
+    """
+    Load a lexical index, cached per process and reloaded when the file is replaced.
+    Returns None if it has not been built yet.
+    """
+    path = lexical_index_path(name)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _LOCK:
+        cached = _OPEN_INDEXES.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        index = BM25Index.load(path)
+        _OPEN_INDEXES[path] = (mtime, index)
+        return index
+
+def update_lexical_index(session, name, topic_id=None):
+    """
+    Rebuild the named lexical index from the stored documents (optionally
+    one topic's) and save it. BM25 statistics depend on the whole corpus, so
+    the index is rebuilt rather than appended to; only ids, text and authors
+    are read. Returns the number of documents indexed.
+    """
+    query = session.query(Document.id, Document.text, Document.authors)
+    if topic_id is not None:
+        query = query.join(topic_documents, topic_documents.c.document_id == Document.id) \
+            .filter(topic_documents.c.topic_id == topic_id)
+    rows = query.order_by(Document.id).all()
+    if not rows:
+        return 0
+    index = BM25Index.build([row.id for row in rows], [document_terms(row) for row in rows])
+    index.save(lexical_index_path(name))
+    return len(index)
+
+def update_topic_lexical_index(session, topic_name):
+    """Rebuild a topic's lexical index and the global one. Returns the topic's document count."""
+    topic = get_topic_by_name(session, topic_name)
+    if topic is None:
+        return 0
+    indexed = update_lexical_index(session, topic_index_name(topic.id), topic_id=topic.id)
+    update_lexical_index(session, GLOBAL_INDEX)
+    return indexed
+
+def reciprocal_rank_fusion(rankings, k=60, top_k=None):
+    """
+    Fuse several ranked id lists: each id scores sum(1 / (k + rank)) over the
+    lists it appears in (rank starting at 1).
+    Returns (ids, scores), best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[int(item)] = scores.get(int(item), 0.0) + 1.0 / (k + rank)
+    ranked = sorted(scores, key=lambda item: -scores[item])[:top_k]
+    return ranked, [scores[item] for item in ranked]
@@ -0,0 +1,123 @@
+# src/metadata_index.py
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from models import Document, Passage, topic_documents
+from index_store import INDEX_DIR
+
+METADATA_FILE = "metadata.npz"
+
+# Per-process cache of the loaded metadata.
+# Format: { path: (mtime_ns, DocumentMetadata) }
+_OPEN = {}
+_LOCK = threading.Lock()
+
+class DocumentMetadata:
+    """
+    Column arrays of the document fields search results can be filtered on:
+    topic links, authors and fetch date, plus the passage-to-document map.
+    Filters are evaluated on these arrays in memory and produce the id sets
+    handed to the FAISS and BM25 searches, so no documents are read from SQL.
+    """
+
+    def __init__(self, ids, fetch_dates, authors, link_topic_ids, link_document_ids, passage_ids, passage_document_ids):
+        self.ids = ids
+        self.fetch_dates = fetch_dates
+        self.authors = authors
+        self.link_topic_ids = link_topic_ids
+        self.link_document_ids = link_document_ids
+        self.passage_ids = passage_ids
+        self.passage_document_ids = passage_document_ids
+
+    @classmethod
+    def build(cls, session):
+        """Read the filterable columns of every document (no text) from the database."""
+        rows = session.query(Document.id, Document.fetch_date, Document.authors).order_by(Document.id).all()
+        links = session.query(topic_documents.c.topic_id, topic_documents.c.document_id).all()
+        passages = session.query(Passage.id, Passage.document_id).all()
+        return cls(
+            ids=np.array([row.id for row in rows], dtype='int64'),
+            fetch_dates=np.array([row.fetch_date or 'NaT' for row in rows], dtype='datetime64[s]'),
+            authors=np.array([(row.authors or '').lower() for row in rows], dtype=str),
+            link_topic_ids=np.array([link[0] for link in links], dtype='int64'),
+            link_document_ids=np.array([link[1] for link in links], dtype='int64'),
+            passage_ids=np.array([p[0] for p in passages], dtype='int64'),
+            passage_document_ids=np.array([p[1] for p in passages], dtype='int64'),
+        )
+
+    def select(self, topic_ids=None, author=None, date_from=None, date_to=None):
+        """
+        Return the sorted Document ids matching every given filter: linked to
+        any of topic_ids, an author name containing author (case-insensitive),
+        fetched on or after date_from and on or before date_to (dates or datetimes).
+        Returns None when no filter is given.
+        """
+        if not topic_ids and not author and date_from is None and date_to is None:
+            return None
+        mask = np.ones(len(self.ids), dtype=bool)
+        if topic_ids:
+            linked = self.link_document_ids[np.isin(self.link_topic_ids, list(topic_ids))]
+            mask &= np.isin(self.ids, linked)
+        if author:
+            mask &= np.char.find(self.authors, author.lower()) >= 0
+        if date_from is not None:
+            mask &= self.fetch_dates >= np.datetime64(date_from, 's')
+        if date_to is not None:
+            # A bare date includes the whole day.
+            end = np.datetime64(date_to, 'D') + np.timedelta64(1, 'D') if not hasattr(date_to, 'hour') \
+                else np.datetime64(date_to, 's') + np.timedelta64(1, 's')
+            mask &= self.fetch_dates < end
+        return self.ids[mask]
+
+    def passage_ids_for(self, document_ids):
+        """Sorted ids of the passages of the given documents."""
+        return np.sort(self.passage_ids[np.isin(self.passage_document_ids, document_ids)])
+
+    def save(self, path):
+        """Atomically write the arrays as one .npz file."""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **vars(self))
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(**{name: f[name] for name in f.files})
+
+def metadata_path():
+    return os.path.join(INDEX_DIR, METADATA_FILE)
+
+def update_metadata(session):
+    """Rebuild the metadata arrays from the database. Returns the number of documents."""
+    metadata = DocumentMetadata.build(session)
+    metadata.save(metadata_path())
+    return len(metadata.ids)
+
+def open_metadata():
+    """
+    Load the metadata arrays, cached per process and reloaded when the file is replaced.
+    Returns None if they have not been built yet.
+    """
+    path = metadata_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _LOCK:
+        cached = _OPEN.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        metadata = DocumentMetadata.load(path)
+        _OPEN[path] = (mtime, metadata)
+        return metadata
@@ -0,0 +1,214 @@
+# src/metrics.py
+"""
+Lightweight in-process metrics and request tracing.
+
+    with trace("query") as request:      # one request; collects its spans
+        with span("faiss_search"):       # one stage, timed into stage_seconds
+            ...
+        incr("cache_misses_total", cache="retrieval")
+        observe("arxiv_fetch_seconds", 0.42)
+
+Counters and histograms (p50/p95/p99 over the most recent samples) are kept
+per process and exported with to_json() or to_prometheus(). A fraction
+(PROFILE_SAMPLE_RATE) of traces also run under cProfile, with the stats
+written to PROFILE_DIR for `python -m pstats` or snakeviz.
+"""
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+# Samples kept per histogram for the percentiles.
+METRICS_SAMPLES = int(os.environ.get("METRICS_SAMPLES", "2048"))
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'profiles')
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+class Histogram:
+    """Count, sum and a window of the most recent samples for percentiles."""
+
+    def __init__(self, max_samples=METRICS_SAMPLES):
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def quantiles(self, qs=QUANTILES):
+        """Nearest-rank quantiles of the sample window."""
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in qs}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in qs}
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and histograms, keyed on a name and a set of labels.
+    Collectors are callables returning (name, labels, value) gauges, read at
+    export time (e.g. cache hit rates that are already counted elsewhere).
+    """
+
+    def __init__(self):
+        # Format: { (name, ((label, value), ...)): float }
+        self.counters = {}
+        # Format: { (name, ((label, value), ...)): Histogram }
+        self.histograms = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def incr(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def register_collector(self, collector):
+        self.collectors.append(collector)
+
+    def gauges(self):
+        return [gauge for collector in self.collectors for gauge in collector()]
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        """All metrics as plain lists of dicts."""
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = []
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                quantiles = histogram.quantiles()
+                histograms.append({
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    **{f"p{int(q * 100)}": value for q, value in quantiles.items()},
+                })
+        gauges = [{'name': name, 'labels': labels, 'value': value} for name, labels, value in self.gauges()]
+        return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+REGISTRY = MetricsRegistry()
+
+def incr(name, amount=1, **labels):
+    """Add to a counter, and to the current trace's counters."""
+    if not METRICS_ENABLED:
+        return
+    REGISTRY.incr(name, amount, **labels)
+    request = getattr(_local, 'trace', None)
+    if request is not None:
+        request['counters'][name] = request['counters'].get(name, 0) + amount
+
+def observe(name, value, **labels):
+    """Record a sample (seconds, for timings) in a histogram."""
+    if METRICS_ENABLED:
+        REGISTRY.observe(name, value, **labels)
+
+# The trace being recorded on this thread, if any.
+_local = threading.local()
+
+@contextmanager
+def span(stage, **labels):
+    """Time a stage into stage_seconds{stage=...} and the current trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("stage_seconds", elapsed, stage=stage, **labels)
+        request = getattr(_local, 'trace', None)
+        if request is not None:
+            request['spans'].append({'stage': stage, 'ms': elapsed * 1000})
+
+@contextmanager
+def trace(name, profile=None):
+    """
+    Record one request: the spans and counters hit on this thread while it
+    runs, and its total time in request_seconds{request=name}.
+    With profile=None the request is profiled with probability PROFILE_SAMPLE_RATE.
+
+    Yields the trace dict: { 'name', 'spans', 'counters', 'total_ms', 'profile' (path or None) }.
+    """
+    record = {'name': name, 'spans': [], 'counters': {}, 'total_ms': None, 'profile': None}
+    previous = getattr(_local, 'trace', None)
+    _local.trace = record
+    if profile is None:
+        profile = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+    profiler = cProfile.Profile() if profile else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            record['profile'] = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+            profiler.dump_stats(record['profile'])
+        elapsed = time.perf_counter() - start
+        record['total_ms'] = elapsed * 1000
+        observe("request_seconds", elapsed, request=name)
+        _local.trace = previous
+
+def to_json(indent=None):
+    return json.dumps(REGISTRY.snapshot(), indent=indent)
+
+def _labels(labels, **extra):
+    items = {**labels, **extra}
+    if not items:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in items.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(items, escaped)) + "}"
+
+def to_prometheus():
+    """The metrics in the Prometheus text exposition format; histograms are exported as summaries."""
+    snapshot = REGISTRY.snapshot()
+    lines, typed = [], set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for counter in snapshot['counters']:
+        declare(counter['name'], "counter")
+        lines.append(f"{counter['name']}{_labels(counter['labels'])} {counter['value']}")
+    # Samples of one metric must be contiguous in the exposition format.
+    for gauge in sorted(snapshot['gauges'], key=lambda gauge: gauge['name']):
+        declare(gauge['name'], "gauge")
+        lines.append(f"{gauge['name']}{_labels(gauge['labels'])} {gauge['value']}")
+    for histogram in snapshot['histograms']:
+        name, labels = histogram['name'], histogram['labels']
+        declare(name, "summary")
+        for q in QUANTILES:
+            lines.append(f"{name}{_labels(labels, quantile=q)} {histogram[f'p{int(q * 100)}']}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+def write_metrics(path):
+    """Write the metrics to path, as Prometheus text for a .prom file and JSON otherwise."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(to_prometheus() if path.endswith('.prom') else to_json(indent=2))
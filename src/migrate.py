@@ -0,0 +1,159 @@
+# src/migrate.py
+"""
+Upgrade an existing database to the current schema.
+
+Adds the arXiv id/version, title hash and normalized topic name columns,
+backfills them, fills the topic_documents link table, merges documents that
+turn out to be the same arXiv paper (and topics with the same normalized
+name), and creates the lookup indexes.
+Every step is idempotent, so the script can be re-run safely:
+    python migrate.py
+"""
+from sqlalchemy import inspect, text
+
+from db import engine
+from models import Base, Topic, Document, DocumentEmbedding, Passage, PassageEmbedding, topic_documents
+from data_access import normalize_topic_name, title_hash, parse_arxiv_id
+
+# (table, column, SQL type) added to tables created before the column existed.
+NEW_COLUMNS = [
+    ('topics', 'normalized_name', 'VARCHAR'),
+    ('documents', 'arxiv_id', 'VARCHAR'),
+    ('documents', 'arxiv_version', 'INTEGER'),
+    ('documents', 'title_hash', 'VARCHAR(40)'),
+]
+
+def add_missing_columns(conn):
+    inspector = inspect(conn)
+    for table, column, sql_type in NEW_COLUMNS:
+        existing = {col['name'] for col in inspector.get_columns(table)}
+        if column not in existing:
+            print(f"Adding column {table}.{column}")
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}"))
+
+def backfill_topics(conn):
+    rows = conn.execute(text("SELECT id, name FROM topics WHERE normalized_name IS NULL")).fetchall()
+    for topic_id, name in rows:
+        conn.execute(text("UPDATE topics SET normalized_name = :n WHERE id = :id"),
+                     {'n': normalize_topic_name(name), 'id': topic_id})
+    print(f"Backfilled {len(rows)} topic names.")
+
+def backfill_documents(conn):
+    rows = conn.execute(text(
+        "SELECT id, title, pdf_link FROM documents WHERE title_hash IS NULL"
+    )).fetchall()
+    for doc_id, title, pdf_link in rows:
+        arxiv_id, version = parse_arxiv_id(pdf_link)
+        conn.execute(text(
+            "UPDATE documents SET title_hash = :h, arxiv_id = COALESCE(arxiv_id, :a), "
+            "arxiv_version = COALESCE(arxiv_version, :v) WHERE id = :id"
+        ), {'h': title_hash(title), 'a': arxiv_id, 'v': version, 'id': doc_id})
+    print(f"Backfilled {len(rows)} documents.")
+
+def link_topics(conn):
+    """Create a topic link for every document's original topic_id."""
+    result = conn.execute(text(
+        "INSERT INTO topic_documents (topic_id, document_id) "
+        "SELECT d.topic_id, d.id FROM documents d "
+        "WHERE d.topic_id IS NOT NULL AND NOT EXISTS ("
+        "  SELECT 1 FROM topic_documents td WHERE td.topic_id = d.topic_id AND td.document_id = d.id)"
+    ))
+    print(f"Linked {result.rowcount} documents to their topics.")
+
+def merge_duplicates(conn):
+    """
+    Collapse documents sharing an arXiv id onto the row with the newest
+    version (as bulk_add_documents keeps the newest version of a paper), and
+    id-less documents sharing a title hash onto the lowest id, moving their
+    topic links over. Must run before the unique arxiv_id index is created.
+    """
+    merged = 0
+    for key in ('arxiv_id', 'title_hash'):
+        extra = "AND arxiv_id IS NULL" if key == 'title_hash' else ""
+        order = "COALESCE(arxiv_version, 0) DESC, id" if key == 'arxiv_id' else "id"
+        groups = conn.execute(text(
+            f"SELECT {key} FROM documents WHERE {key} IS NOT NULL {extra} "
+            f"GROUP BY {key} HAVING COUNT(*) > 1"
+        )).fetchall()
+        for (value,) in groups:
+            keep_id, *dup_ids = [row[0] for row in conn.execute(text(
+                f"SELECT id FROM documents WHERE {key} = :v {extra} ORDER BY {order}"
+            ), {'v': value})]
+            for dup_id in dup_ids:
+                conn.execute(text(
+                    "INSERT INTO topic_documents (topic_id, document_id) "
+                    "SELECT td.topic_id, :keep FROM topic_documents td WHERE td.document_id = :dup "
+                    "AND NOT EXISTS (SELECT 1 FROM topic_documents x WHERE x.topic_id = td.topic_id AND x.document_id = :keep)"
+                ), {'keep': keep_id, 'dup': dup_id})
+                conn.execute(text("DELETE FROM topic_documents WHERE document_id = :dup"), {'dup': dup_id})
+                conn.execute(text("DELETE FROM document_embeddings WHERE document_id = :dup"), {'dup': dup_id})
+                conn.execute(text(
+                    "DELETE FROM passage_embeddings WHERE passage_id IN (SELECT id FROM passages WHERE document_id = :dup)"
+                ), {'dup': dup_id})
+                conn.execute(text("DELETE FROM passages WHERE document_id = :dup"), {'dup': dup_id})
+                conn.execute(text("DELETE FROM documents WHERE id = :dup"), {'dup': dup_id})
+                merged += 1
+    print(f"Merged {merged} duplicate documents.")
+
+def merge_topics(conn):
+    """Collapse topics whose names normalize to the same value onto the lowest id."""
+    groups = conn.execute(text(
+        "SELECT normalized_name, MIN(id) FROM topics GROUP BY normalized_name HAVING COUNT(*) > 1"
+    )).fetchall()
+    for value, keep_id in groups:
+        dup_ids = [row[0] for row in conn.execute(text(
+            "SELECT id FROM topics WHERE normalized_name = :v AND id <> :keep"
+        ), {'v': value, 'keep': keep_id})]
+        for dup_id in dup_ids:
+            conn.execute(text(
+                "INSERT INTO topic_documents (topic_id, document_id) "
+                "SELECT :keep, td.document_id FROM topic_documents td WHERE td.topic_id = :dup "
+                "AND NOT EXISTS (SELECT 1 FROM topic_documents x WHERE x.topic_id = :keep AND x.document_id = td.document_id)"
+            ), {'keep': keep_id, 'dup': dup_id})
+            conn.execute(text("DELETE FROM topic_documents WHERE topic_id = :dup"), {'dup': dup_id})
+            conn.execute(text("UPDATE documents SET topic_id = :keep WHERE topic_id = :dup"), {'keep': keep_id, 'dup': dup_id})
+            conn.execute(text("DELETE FROM topics WHERE id = :dup"), {'dup': dup_id})
+    print(f"Merged {len(groups)} groups of duplicate topics.")
+
+def recount_topics(conn):
+    conn.execute(text(
+        "UPDATE topics SET document_count = "
+        "(SELECT COUNT(*) FROM topic_documents td WHERE td.topic_id = topics.id)"
+    ))
+
+def create_indexes(conn):
+    """Create the indexes declared on the models, then the optional trigram index."""
+    for table in (Topic.__table__, Document.__table__, topic_documents):
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+    if conn.dialect.name == 'postgresql':
+        # Trigram index so substring topic lookups (ILIKE '%...%') avoid a sequential scan.
+        # Needs the pg_trgm extension; skipped if we lack the privilege to create it.
+        try:
+            with conn.begin_nested():
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_topics_name_trgm ON topics USING gin (name gin_trgm_ops)"
+                ))
+        except Exception as e:
+            print(f"Skipping trigram index on topics.name: {e}")
+
+def migrate(bind=engine):
+    # New tables (topic_documents, embeddings and passages) are created as needed.
+    Base.metadata.create_all(bind, tables=[Topic.__table__, Document.__table__,
+                                           topic_documents, DocumentEmbedding.__table__,
+                                           Passage.__table__, PassageEmbedding.__table__])
+    with bind.begin() as conn:
+        add_missing_columns(conn)
+        backfill_topics(conn)
+        backfill_documents(conn)
+        link_topics(conn)
+        merge_duplicates(conn)
+        merge_topics(conn)
+        recount_topics(conn)
+        create_indexes(conn)
+    print("Migration complete.")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,246 @@
+# src/model_registry.py
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+from sentence_transformers import SentenceTransformer, CrossEncoder
+
+from metrics import span
+from generation import load_generator, load_tokenizer, onnx_size_bytes, BatchingGenerator, BatcherClosed
+
+# Total size of resident models before least-recently-used ones are dropped.
+MEMORY_BUDGET_MB = int(os.environ.get("MODEL_MEMORY_BUDGET_MB", "4096"))
+# Micro-batching knobs for shared generators.
+GENERATION_MAX_BATCH = int(os.environ.get("GENERATION_MAX_BATCH", "8"))
+GENERATION_MAX_WAIT_MS = float(os.environ.get("GENERATION_MAX_WAIT_MS", "20"))
+
+def module_size_bytes(module):
+    """
+    Resident size of a torch module: the bytes held by its parameters and
+    buffers, plus the packed weights of dynamically quantized layers, which
+    are neither.
+    """
+    tensors = list(module.parameters()) + list(module.buffers())
+    for submodule in module.modules():
+        # LinearPackedParams-style holders: the packed object itself is not a module.
+        packed = getattr(submodule, '_packed_params', None)
+        if packed is not None and not isinstance(packed, torch.nn.Module) and hasattr(submodule, '_weight_bias'):
+            tensors.extend(t for t in submodule._weight_bias() if t is not None)
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models keyed by (kind, model name, device, dtype, backend).
+
+    Each key is loaded at most once, even when several Streamlit sessions ask
+    for it at the same time. When the total resident size exceeds the memory
+    budget, the least recently used models are evicted. Evicted models stay
+    alive for callers that still hold a reference and are reloaded on next use;
+    eviction listeners (callback(key, model)) release whatever else was built
+    around them.
+    """
+
+    def __init__(self, memory_budget_mb=MEMORY_BUDGET_MB):
+        self.memory_budget_bytes = memory_budget_mb * 2**20
+        # Format: { key: {'model': obj, 'size_bytes': int, 'load_seconds': float, 'hits': int} }
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per key so a slow load does not block lookups of other models.
+        self._key_locks = {}
+        self._listeners = []
+        self.evictions = 0
+
+    def add_eviction_listener(self, callback):
+        """Call callback(key, model) whenever a model is dropped from the registry."""
+        self._listeners.append(callback)
+
+    def _notify(self, evicted):
+        # Called without the lock held: listeners may block or use the registry.
+        for key, model in evicted:
+            for callback in self._listeners:
+                callback(key, model)
+
+    def get(self, key, loader, size_fn):
+        """
+        Return the model cached under key, calling loader() to load it on a miss.
+        size_fn(model) gives its resident size in bytes.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry['hits'] += 1
+                return entry['model']
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have finished loading while we waited.
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    entry['hits'] += 1
+                    return entry['model']
+
+            start = time.perf_counter()
+            with span("model_load", kind=key[0]):
+                model = loader()
+            load_seconds = time.perf_counter() - start
+
+            with self._lock:
+                self._entries[key] = {
+                    'model': model,
+                    'size_bytes': size_fn(model),
+                    'load_seconds': load_seconds,
+                    'hits': 0,
+                }
+                evicted = self._evict_over_budget(keep=key)
+            self._notify(evicted)
+            return model
+
+    def _evict_over_budget(self, keep):
+        """
+        Drop least recently used entries until the budget is met (caller holds the lock).
+        Returns the evicted (key, model) pairs.
+        """
+        evicted = []
+        while self.resident_bytes() > self.memory_budget_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            evicted.append((oldest, self._entries.pop(oldest)['model']))
+            self.evictions += 1
+        return evicted
+
+    def resident_bytes(self):
+        """Total size of the models currently held by the registry."""
+        return sum(entry['size_bytes'] for entry in self._entries.values())
+
+    def evict(self, key):
+        """Remove one model from the registry. Returns True if it was loaded."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._notify([(key, entry['model'])])
+        return True
+
+    def stats(self):
+        """Per-model load time, resident size and hit count, least recently used first."""
+        with self._lock:
+            return [
+                {
+                    'kind': key[0],
+                    'model_name': key[1],
+                    'device': key[2],
+                    'dtype': key[3],
+                    'backend': key[4],
+                    'load_seconds': entry['load_seconds'],
+                    'size_mb': entry['size_bytes'] / 2**20,
+                    'hits': entry['hits'],
+                }
+                for key, entry in self._entries.items()
+            ]
+
+# The shared registry for this process.
+REGISTRY = ModelRegistry()
+
+def _apply_dtype(module, dtype):
+    if dtype is not None:
+        module.to(dtype=getattr(torch, dtype))
+    return module
+
+def get_embedding_model(model_name='all-MiniLM-L6-v2', device='cpu', dtype=None):
+    """Return the shared SentenceTransformer for (model_name, device, dtype)."""
+    def loader():
+        return _apply_dtype(SentenceTransformer(model_name, device=device), dtype)
+    return REGISTRY.get(('embedding', model_name, device, dtype, 'fp32'), loader, module_size_bytes)
+
+def get_cross_encoder(model_name='cross-encoder/ms-marco-MiniLM-L-6-v2', device='cpu'):
+    """Return the shared CrossEncoder used for re-ranking."""
+    def loader():
+        return CrossEncoder(model_name, device=device)
+    return REGISTRY.get(('cross_encoder', model_name, device, None, 'fp32'), loader,
+                        lambda model: module_size_bytes(model.model))
+
+def generator_size_bytes(pair, model_name):
+    """Resident size of a generator; ONNX Runtime models are sized by their exported files."""
+    model = pair[0]
+    return module_size_bytes(model) if isinstance(model, torch.nn.Module) else onnx_size_bytes(model_name)
+
+def get_generator(model_name='t5-small', device='cpu', dtype=None, backend='fp32'):
+    """
+    Return the shared (model, tokenizer) pair for (model_name, device, dtype, backend).
+    backend is one of generation.BACKENDS; int8 and onnx run on CPU only.
+    """
+    def loader():
+        model, tokenizer = load_generator(model_name=model_name, backend=backend)
+        if backend == 'fp32':
+            model = _apply_dtype(model.to(device), dtype)
+            model.eval()
+        return model, tokenizer
+    return REGISTRY.get(('generator', model_name, device, dtype, backend), loader,
+                        lambda pair: generator_size_bytes(pair, model_name))
+
+def get_tokenizer(model_name='t5-small'):
+    """Return the shared tokenizer for a generator, without loading the model itself."""
+    return REGISTRY.get(('tokenizer', model_name, 'cpu', None, 'fp32'), lambda: load_tokenizer(model_name), lambda t: 0)
+
+# One micro-batching worker per generator in the registry, keyed like its registry entry.
+# Format: { ('generator', model_name, device, dtype, backend): BatchingGenerator }
+_BATCHERS = {}
+_BATCHERS_LOCK = threading.Lock()
+
+def _close_batcher(key, pair):
+    """Eviction listener: stop the evicted generator's worker, so the model can be freed."""
+    with _BATCHERS_LOCK:
+        batcher = _BATCHERS.get(key)
+        if batcher is None or batcher.model is not pair[0]:
+            return
+        del _BATCHERS[key]
+    # Queued requests are still answered; new ones are sent to the next worker.
+    batcher.close(wait=False)
+
+REGISTRY.add_eviction_listener(_close_batcher)
+
+def get_batching_generator(model_name='t5-small', device='cpu', dtype=None, backend='fp32',
+                           max_batch_size=GENERATION_MAX_BATCH, max_wait_ms=GENERATION_MAX_WAIT_MS):
+    """
+    Return the shared BatchingGenerator for a model, so concurrent sessions
+    are served from one queue. The worker is closed when the registry evicts
+    the model, and a new one is started when it is loaded again.
+    """
+    model, tokenizer = get_generator(model_name, device=device, dtype=dtype, backend=backend)
+    key = ('generator', model_name, device, dtype, backend)
+    stale = None
+    with _BATCHERS_LOCK:
+        batcher = _BATCHERS.get(key)
+        if batcher is None or batcher.model is not model:
+            stale = batcher
+            batcher = BatchingGenerator(model, tokenizer, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+            _BATCHERS[key] = batcher
+    if stale is not None:
+        stale.close(wait=False)
+    return batcher
+
+def generate_batched(query, context, model_name='t5-small', device='cpu', dtype=None, backend='fp32',
+                     max_length=150, num_beams=4):
+    """
+    Answer one query through the shared batching worker. A worker closed
+    (by an eviction) between looking it up and submitting to it is replaced
+    by the current one rather than failing the request.
+    """
+    while True:
+        batcher = get_batching_generator(model_name, device=device, dtype=dtype, backend=backend)
+        try:
+            return batcher.generate(query, context, max_length=max_length, num_beams=num_beams)
+        except BatcherClosed:
+            continue
+
+def batching_stats():
+    """Throughput and queue latency of each running batching worker."""
+    with _BATCHERS_LOCK:
+        return [dict(model_name=key[1], device=key[2], dtype=key[3], backend=key[4], **batcher.stats())
+                for key, batcher in _BATCHERS.items()]
@@ -1,19 +1,36 @@
 # src/models.py
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, func
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, LargeBinary, Table, Index, func
+from sqlalchemy.orm import relationship, deferred
 
 Base = declarative_base()
 
+# Many-to-many link so a paper that belongs to several topics is stored once.
+topic_documents = Table(
+    'topic_documents',
+    Base.metadata,
+    Column('topic_id', Integer, ForeignKey('topics.id', ondelete='CASCADE'), primary_key=True),
+    Column('document_id', Integer, ForeignKey('documents.id', ondelete='CASCADE'), primary_key=True),
+    Index('ix_topic_documents_document_id', 'document_id'),
+)
+
 class Topic(Base):
     __tablename__ = 'topics'
     
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, nullable=False)
+    # Lowercased, whitespace-collapsed name used for indexed lookups
+    normalized_name = Column(String)
     document_count = Column(Integer, default=0)
     
     # Relationship: One topic can have many documents
     documents = relationship("Document", back_populates="topic")
+    # All documents linked to the topic, including ones first stored under another topic
+    linked_documents = relationship("Document", secondary=topic_documents, back_populates="topics")
+    
+    __table_args__ = (
+        Index('ix_topics_normalized_name', 'normalized_name', unique=True),
+    )
     
     def __repr__(self):
         return f"<Topic(name='{self.name}', document_count={self.document_count})>"
@@ -22,16 +39,80 @@ class Document(Base):
     __tablename__ = 'documents'
     
     id = Column(Integer, primary_key=True)
+    # Topic the document was first stored under; see topics for every topic it belongs to
     topic_id = Column(Integer, ForeignKey('topics.id'))
+    # Stable arXiv identifier without version (e.g. '1805.08355') and its version number
+    arxiv_id = Column(String)
+    arxiv_version = Column(Integer)
     title = Column(Text, nullable=False)
-    text = Column(Text, nullable=False)
+    # SHA-1 of the normalized title, for deduplicating documents without an arXiv id
+    title_hash = Column(String(40))
+    # Heavy columns are only loaded when accessed or undeferred (group 'content')
+    text = deferred(Column(Text, nullable=False), group='content')
     pdf_link = Column(Text)
-    authors = Column(Text)
+    authors = deferred(Column(Text), group='content')
     # Optional: To track when a document was inserted
     fetch_date = Column(DateTime, server_default=func.now())
     
     # Relationship: Each document belongs to one topic
     topic = relationship("Topic", back_populates="documents")
+    topics = relationship("Topic", secondary=topic_documents, back_populates="linked_documents")
+    
+    __table_args__ = (
+        Index('ix_documents_arxiv_id', 'arxiv_id', unique=True),
+        Index('ix_documents_topic_id', 'topic_id'),
+        Index('ix_documents_title_hash', 'title_hash'),
+    )
     
     def __repr__(self):
         return f"<Document(title='{self.title[:30]}...', topic_id={self.topic_id})>"
+
+class DocumentEmbedding(Base):
+    __tablename__ = 'document_embeddings'
+    
+    # One row per (document, embedding model) so switching models never mixes vectors
+    document_id = Column(Integer, ForeignKey('documents.id', ondelete='CASCADE'), primary_key=True)
+    model_name = Column(String, primary_key=True)
+    # SHA-1 of the text that was encoded; a mismatch means the document changed
+    content_hash = Column(String(40), nullable=False)
+    dim = Column(Integer, nullable=False)
+    # Raw float32 bytes of the vector
+    vector = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<DocumentEmbedding(document_id={self.document_id}, model_name='{self.model_name}', dim={self.dim})>"
+
+class Passage(Base):
+    __tablename__ = 'passages'
+    
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey('documents.id', ondelete='CASCADE'), nullable=False)
+    # Order of the passage within its document
+    position = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    # SHA-1 of the document text the passage was cut from; a mismatch means it must be re-chunked
+    document_hash = Column(String(40), nullable=False)
+    
+    document = relationship("Document", backref="passages")
+    
+    __table_args__ = (
+        Index('ix_passages_document_id', 'document_id', 'position'),
+    )
+    
+    def __repr__(self):
+        return f"<Passage(document_id={self.document_id}, position={self.position}, text='{self.text[:30]}...')>"
+
+class PassageEmbedding(Base):
+    __tablename__ = 'passage_embeddings'
+    
+    # Same layout as DocumentEmbedding, one row per (passage, embedding model)
+    passage_id = Column(Integer, ForeignKey('passages.id', ondelete='CASCADE'), primary_key=True)
+    model_name = Column(String, primary_key=True)
+    content_hash = Column(String(40), nullable=False)
+    dim = Column(Integer, nullable=False)
+    vector = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<PassageEmbedding(passage_id={self.passage_id}, model_name='{self.model_name}', dim={self.dim})>"
@@ -0,0 +1,182 @@
+# src/passages.py
+import os
+
+from sqlalchemy import and_
+from sqlalchemy.orm import undefer_group
+
+from models import Document, Passage, PassageEmbedding, topic_documents
+from data_access import get_topic_by_name, iter_documents
+from embedding_store import DEFAULT_EMBEDDING_MODEL, content_hash, encode_texts
+from model_registry import get_embedding_model
+
+# Passage size and the overlap between consecutive passages, in words.
+PASSAGE_WORDS = int(os.environ.get("PASSAGE_WORDS", "100"))
+PASSAGE_OVERLAP = int(os.environ.get("PASSAGE_OVERLAP", "30"))
+# How many passages are searched per requested document, to leave room for aggregation.
+PASSAGE_FANOUT = int(os.environ.get("PASSAGE_FANOUT", "4"))
+
+def split_passages(text, max_words=PASSAGE_WORDS, overlap=PASSAGE_OVERLAP):
+    """
+    Split text into overlapping windows of at most max_words words.
+    Each passage starts overlap words before the previous one ended.
+    """
+    words = text.split()
+    if len(words) <= max_words:
+        return [" ".join(words)] if words else []
+    step = max(1, max_words - overlap)
+    passages = []
+    for start in range(0, len(words), step):
+        passages.append(" ".join(words[start:start + max_words]))
+        if start + max_words >= len(words):
+            break
+    return passages
+
+def update_passages(session, documents):
+    """
+    Cut documents into passages, replacing the passages of documents whose
+    text has changed since they were chunked. Unchanged documents are skipped.
+
+    Returns the ids of the documents that were (re-)chunked.
+    """
+    if not documents:
+        return []
+    doc_ids = [doc.id for doc in documents]
+    stored = dict(
+        session.query(Passage.document_id, Passage.document_hash)
+        .filter(Passage.document_id.in_(doc_ids))
+        .distinct()
+        .all()
+    )
+    stale = []
+    for doc in documents:
+        digest = content_hash(doc.text)
+        if stored.get(doc.id) != digest:
+            stale.append((doc, digest))
+    if not stale:
+        return []
+
+    stale_ids = [doc.id for doc, _ in stale]
+    old_passages = session.query(Passage.id).filter(Passage.document_id.in_(stale_ids))
+    session.query(PassageEmbedding).filter(PassageEmbedding.passage_id.in_(old_passages.scalar_subquery())) \
+        .delete(synchronize_session=False)
+    session.query(Passage).filter(Passage.document_id.in_(stale_ids)).delete(synchronize_session=False)
+    session.add_all(
+        Passage(document_id=doc.id, position=position, text=text, document_hash=digest)
+        for doc, digest in stale
+        for position, text in enumerate(split_passages(doc.text))
+    )
+    session.commit()
+    return stale_ids
+
+def update_passage_embeddings(session, passages, model_name=DEFAULT_EMBEDDING_MODEL, model=None):
+    """
+    Encode and persist embeddings for the given Passage instances in batches,
+    skipping passages whose stored embedding is current.
+    Returns the list of Passage ids that were encoded.
+    """
+    if not passages:
+        return []
+    stored = dict(
+        session.query(PassageEmbedding.passage_id, PassageEmbedding.content_hash)
+        .filter(PassageEmbedding.model_name == model_name,
+                PassageEmbedding.passage_id.in_([p.id for p in passages]))
+        .all()
+    )
+    stale = [(p, content_hash(p.text)) for p in passages]
+    stale = [(p, digest) for p, digest in stale if stored.get(p.id) != digest]
+    if not stale:
+        return []
+
+    if model is None:
+        model = get_embedding_model(model_name)
+    vectors = encode_texts(model, [p.text for p, _ in stale])
+    for (p, digest), vector in zip(stale, vectors):
+        session.merge(PassageEmbedding(
+            passage_id=p.id,
+            model_name=model_name,
+            content_hash=digest,
+            dim=vector.shape[0],
+            vector=vector.tobytes()
+        ))
+    session.commit()
+    return [p.id for p, _ in stale]
+
+def update_document_passages(session, documents, model_name=DEFAULT_EMBEDDING_MODEL, model=None):
+    """
+    Chunk the given documents where needed and embed their passages.
+    Returns the list of Passage ids that were encoded.
+    """
+    update_passages(session, documents)
+    passages = session.query(Passage).filter(Passage.document_id.in_([doc.id for doc in documents])).all()
+    return update_passage_embeddings(session, passages, model_name=model_name, model=model)
+
+def passages_without_embeddings(session, topic_id, model_name=DEFAULT_EMBEDDING_MODEL):
+    """Passages of a topic's documents with no stored embedding for model_name."""
+    return session.query(Passage) \
+        .join(topic_documents, topic_documents.c.document_id == Passage.document_id) \
+        .outerjoin(PassageEmbedding, and_(PassageEmbedding.passage_id == Passage.id,
+                                          PassageEmbedding.model_name == model_name)) \
+        .filter(topic_documents.c.topic_id == topic_id, PassageEmbedding.passage_id.is_(None)).all()
+
+def update_topic_passages(session, topic_name, model_name=DEFAULT_EMBEDDING_MODEL, model=None):
+    """
+    Chunk every new or changed document of a topic and embed the passages
+    that have no embedding yet. The topic is streamed and only the changed
+    documents are kept in memory. Returns the Passage ids that were encoded.
+    """
+    topic = get_topic_by_name(session, topic_name)
+    if topic is None:
+        return []
+    stored = dict(
+        session.query(Passage.document_id, Passage.document_hash)
+        .join(topic_documents, topic_documents.c.document_id == Passage.document_id)
+        .filter(topic_documents.c.topic_id == topic.id)
+        .distinct()
+        .all()
+    )
+    stale = [doc for doc in iter_documents(session, topic_id=topic.id) if stored.get(doc.id) != content_hash(doc.text)]
+    update_passages(session, stale)
+    passages = passages_without_embeddings(session, topic.id, model_name=model_name)
+    return update_passage_embeddings(session, passages, model_name=model_name, model=model)
+
+def update_missing_passages(session, topic_id, model_name=DEFAULT_EMBEDDING_MODEL, model=None):
+    """
+    Query-time counterpart of update_topic_passages: chunk only the topic's
+    documents that have no passages and embed passages lacking an embedding,
+    both found with anti-joins. Returns the Passage ids that were encoded.
+    """
+    unchunked = session.query(Document).options(undefer_group('content')) \
+        .join(topic_documents, topic_documents.c.document_id == Document.id) \
+        .outerjoin(Passage, Passage.document_id == Document.id) \
+        .filter(topic_documents.c.topic_id == topic_id, Passage.id.is_(None)).all()
+    update_passages(session, unchunked)
+    passages = passages_without_embeddings(session, topic_id, model_name=model_name)
+    return update_passage_embeddings(session, passages, model_name=model_name, model=model)
+
+def aggregate_passages(session, passage_ids, distances, top_k=3, method='max'):
+    """
+    Turn passage search results into a document ranking.
+    Each passage's distance becomes a similarity 1 / (1 + distance); a
+    document scores the best ('max') or the total ('sum') similarity of its
+    passages.
+
+    Returns up to top_k (document_id, score, passages) tuples, best first,
+    where passages are the document's matching Passage rows, best first.
+    """
+    if method not in ('max', 'sum'):
+        raise ValueError(f"Unknown aggregation '{method}', expected 'max' or 'sum'")
+    passages = {p.id: p for p in session.query(Passage).filter(Passage.id.in_([int(i) for i in passage_ids])).all()}
+    scores, matched = {}, {}
+    # Search results are ordered best first, so each document's passages stay in that order.
+    for passage_id, distance in zip(passage_ids, distances):
+        p = passages.get(int(passage_id))
+        if p is None:
+            continue
+        similarity = 1.0 / (1.0 + float(distance))
+        if method == 'max':
+            scores[p.document_id] = max(scores.get(p.document_id, 0.0), similarity)
+        else:
+            scores[p.document_id] = scores.get(p.document_id, 0.0) + similarity
+        matched.setdefault(p.document_id, []).append(p)
+    ranked = sorted(scores, key=lambda doc_id: -scores[doc_id])[:top_k]
+    return [(doc_id, scores[doc_id], matched[doc_id]) for doc_id in ranked]
@@ -0,0 +1,73 @@
+# src/reranker.py
+import hashlib
+import os
+import time
+
+from cache_backends import make_cache
+from embedding_store import content_hash
+from metrics import incr, observe
+from model_registry import get_cross_encoder
+from result_cache import normalize_query
+
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates taken from the first-stage search, and the time allowed for scoring them.
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "20"))
+RERANK_BUDGET_MS = float(os.environ.get("RERANK_BUDGET_MS", "500"))
+RERANK_BATCH = int(os.environ.get("RERANK_BATCH", "16"))
+
+# Cross-encoder scores, keyed on (model, query, candidate id and text hash).
+SCORE_CACHE = make_cache("rerank", max_entries=50000, ttl=7 * 24 * 3600)
+
+def score_key(model_name, query, candidate_id, text):
+    raw = f"{model_name}\x00{normalize_query(query)}\x00{candidate_id}\x00{content_hash(text)}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def rerank(query, candidates, top_k=3, model_name=RERANK_MODEL, budget_ms=RERANK_BUDGET_MS,
+           batch_size=RERANK_BATCH, model=None):
+    """
+    Re-order first-stage candidates with a cross-encoder.
+
+    candidates is a list of (id, text) pairs in first-stage order. Cached
+    scores are used where available; the rest are scored in batches, in
+    first-stage order, until budget_ms is spent. Candidates left unscored
+    keep their first-stage order behind the scored ones.
+
+    Returns (ids, stats): the best top_k ids, and a dict with the number of
+    cached, scored and skipped candidates and the time spent (ms).
+    """
+    start = time.perf_counter()
+    scores, pending = {}, []
+    for candidate_id, text in candidates:
+        score = SCORE_CACHE.get(score_key(model_name, query, candidate_id, text))
+        if score is None:
+            pending.append((candidate_id, text))
+        else:
+            scores[candidate_id] = score
+    cached = len(scores)
+
+    deadline = start + budget_ms / 1000.0
+    for i in range(0, len(pending), batch_size):
+        # Always score at least one batch so re-ranking is never a no-op.
+        if i and time.perf_counter() >= deadline:
+            break
+        if model is None:
+            model = get_cross_encoder(model_name)
+        batch = pending[i:i + batch_size]
+        batch_scores = model.predict([(query, text) for _, text in batch], batch_size=batch_size)
+        for (candidate_id, text), score in zip(batch, batch_scores):
+            scores[candidate_id] = float(score)
+            SCORE_CACHE.set(score_key(model_name, query, candidate_id, text), float(score))
+
+    scored = sorted(scores, key=lambda candidate_id: -scores[candidate_id])
+    unscored = [candidate_id for candidate_id, _ in candidates if candidate_id not in scores]
+    stats = {
+        'cached': cached,
+        'scored': len(scores) - cached,
+        'skipped': len(unscored),
+        'rerank_ms': (time.perf_counter() - start) * 1000,
+    }
+    observe("stage_seconds", stats['rerank_ms'] / 1000, stage="rerank")
+    incr("rerank_candidates_total", stats['cached'], source="cache")
+    incr("rerank_candidates_total", stats['scored'], source="model")
+    incr("rerank_candidates_total", stats['skipped'], source="over_budget")
+    return (scored + unscored)[:top_k], stats
@@ -0,0 +1,122 @@
+# src/result_cache.py
+import hashlib
+import json
+import re
+
+import numpy as np
+
+from cache_backends import make_cache
+from embedding_store import encode_texts
+from index_store import open_index, search_index, index_version
+from lexical_index import open_lexical_index, lexical_index_version
+
+# Generated answers, keyed on (query, retrieved doc ids, model, generation params).
+ANSWER_CACHE = make_cache("answers", max_entries=2048, ttl=24 * 3600)
+# Retrieval results, keyed on (query, index and its version, top_k, embedding model).
+RETRIEVAL_CACHE = make_cache("retrieval", max_entries=4096, ttl=3600)
+# Query embeddings, keyed on (query, embedding model), so later stages reuse the vector even after a retrieval hit.
+QUERY_EMBEDDING_CACHE = make_cache("query_embeddings", max_entries=1024, ttl=3600)
+
+def normalize_query(query):
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivial variants share a key."""
+    return re.sub(r'[\s?!.]+$', '', " ".join(query.lower().split()))
+
+def _make_key(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def answer_key(query, doc_ids, model_name, **generation_params):
+    """Cache key for an answer: anything that changes the generated text is part of it."""
+    return _make_key('answer', normalize_query(query), [int(i) for i in doc_ids], model_name, generation_params)
+
+def ids_digest(ids):
+    """Short digest of an id filter for cache keys; None means unfiltered."""
+    if ids is None:
+        return None
+    return hashlib.sha1(np.ascontiguousarray(ids, dtype='int64').tobytes()).hexdigest()
+
+def retrieval_key(query, index_name, top_k, embedding_model, ids=None):
+    """
+    Cache key for a search. The index version is part of the key, so results
+    are recomputed as soon as the index file is rewritten.
+    """
+    return _make_key('retrieval', normalize_query(query), index_name, index_version(index_name, embedding_model),
+                     top_k, embedding_model, ids_digest(ids))
+
+def cached_query_embedding(query, embed_model, embedding_model):
+    """The query's float32 embedding; encoded once per (query, embedding model)."""
+    key = _make_key('query_embedding', " ".join(query.split()), embedding_model)
+    hit = QUERY_EMBEDDING_CACHE.get(key)
+    if hit is not None:
+        return np.asarray(hit, dtype='float32')
+    query_embedding = encode_texts(embed_model, [query])[0]
+    QUERY_EMBEDDING_CACHE.set(key, query_embedding.tolist())
+    return query_embedding
+
+def cached_search(query, index_name, top_k, embed_model, embedding_model, ids=None):
+    """
+    Return (ids, distances, from_cache) for the top_k Document ids matching the query,
+    restricted to the given ids if any (see metadata_index).
+    On a hit neither the embedding model nor the index is touched. The query
+    is encoded through cached_query_embedding, so callers can fetch the same
+    vector from there without encoding it again.
+    """
+    key = retrieval_key(query, index_name, top_k, embedding_model, ids)
+    hit = RETRIEVAL_CACHE.get(key)
+    if hit is not None:
+        return hit['ids'], hit['distances'], True
+
+    index = open_index(index_name, embedding_model)
+    if index is None:
+        return [], [], False
+    query_embedding = cached_query_embedding(query, embed_model, embedding_model)
+    distances, ids = search_index(index, query_embedding, top_k, ids=ids)
+    # -1 marks an empty result slot when the index holds fewer than top_k vectors.
+    result = [(int(i), float(d)) for i, d in zip(ids[0], distances[0]) if i != -1]
+    ids = [i for i, _ in result]
+    distances = [d for _, d in result]
+    RETRIEVAL_CACHE.set(key, {'ids': ids, 'distances': distances})
+    return ids, distances, False
+
+def cached_keyword_search(query, index_name, top_k, ids=None):
+    """
+    Return (ids, scores, from_cache) for the top_k BM25 matches in the named
+    lexical index, restricted to the given ids if any. No embedding model is involved.
+    """
+    key = _make_key('keyword', normalize_query(query), index_name, lexical_index_version(index_name), top_k,
+                    ids_digest(ids))
+    hit = RETRIEVAL_CACHE.get(key)
+    if hit is not None:
+        return hit['ids'], hit['scores'], True
+
+    index = open_lexical_index(index_name)
+    if index is None:
+        return [], [], False
+    ids, scores = index.search(query, top_k, ids=ids)
+    ids, scores = [int(i) for i in ids], [float(s) for s in scores]
+    RETRIEVAL_CACHE.set(key, {'ids': ids, 'scores': scores})
+    return ids, scores, False
+
+def lookup_answer(query, doc_ids, model_name, **generation_params):
+    """Return the cached answer for this request, or None."""
+    return ANSWER_CACHE.get(answer_key(query, doc_ids, model_name, **generation_params))
+
+def store_answer(answer, query, doc_ids, model_name, **generation_params):
+    """Cache an answer produced outside cached_answer (e.g. a streamed one)."""
+    ANSWER_CACHE.set(answer_key(query, doc_ids, model_name, **generation_params), answer)
+
+def cached_answer(query, doc_ids, model_name, generate_fn, **generation_params):
+    """
+    Return (answer, from_cache). generate_fn() is only called on a miss,
+    so the generator does not even need to be loaded for repeated questions.
+    """
+    answer = lookup_answer(query, doc_ids, model_name, **generation_params)
+    if answer is not None:
+        return answer, True
+    answer = generate_fn()
+    store_answer(answer, query, doc_ids, model_name, **generation_params)
+    return answer, False
+
+def cache_stats():
+    """Hit rates and sizes of the answer, retrieval and query embedding caches."""
+    return {'answers': ANSWER_CACHE.stats(), 'retrieval': RETRIEVAL_CACHE.stats(),
+            'query_embeddings': QUERY_EMBEDDING_CACHE.stats()}
@@ -1,12 +1,30 @@
 # src/retrieval.py
+import argparse
 import json
 import os
+import time
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
 
+from model_registry import get_embedding_model
+
+# Supported index types for make_index.
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+
+# Default construction parameters; any of them can be overridden per call.
+DEFAULT_INDEX_PARAMS = {
+    'nlist': 1024,          # IVF: number of coarse clusters
+    'pq_m': 16,             # PQ: sub-quantizers (must divide the dimension)
+    'pq_bits': 8,           # PQ: bits per sub-quantizer code
+    'hnsw_m': 32,           # HNSW: neighbours per node
+    'ef_construction': 40,  # HNSW: candidate list size while building
+}
+
 def load_documents(filename):
-    """Load documents from a JSON file."""
+    """Load documents from a JSON file, or from the documents.parquet of a snapshot."""
+    if filename.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_table(filename).to_pylist()
     with open(filename, 'r', encoding='utf-8') as f:
         return json.load(f)
 
@@ -15,21 +33,160 @@ def create_embeddings(documents, model_name='all-MiniLM-L6-v2'):
     Generate embeddings for the document abstracts.
     Returns the list of embeddings and the SentenceTransformer model.
     """
-    model = SentenceTransformer(model_name)
+    model = get_embedding_model(model_name)
     texts = [doc['text'] for doc in documents]
     embeddings = model.encode(texts, convert_to_tensor=False)
     return embeddings, model
 
-def build_faiss_index(embeddings):
+def make_index(index_type, dim, **params):
+    """
+    Create an empty (possibly untrained) FAISS index.
+    index_type is one of INDEX_TYPES; params override DEFAULT_INDEX_PARAMS.
+    """
+    p = dict(DEFAULT_INDEX_PARAMS, **params)
+    if index_type == 'flat':
+        return faiss.IndexFlatL2(dim)
+    if index_type == 'ivf_flat':
+        quantizer = faiss.IndexFlatL2(dim)
+        return faiss.IndexIVFFlat(quantizer, dim, p['nlist'])
+    if index_type == 'ivf_pq':
+        quantizer = faiss.IndexFlatL2(dim)
+        return faiss.IndexIVFPQ(quantizer, dim, p['nlist'], p['pq_m'], p['pq_bits'])
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, p['hnsw_m'])
+        index.hnsw.efConstruction = p['ef_construction']
+        return index
+    raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+def min_training_points(index_type, **params):
+    """
+    Smallest number of vectors needed to train the given index type
+    (0 for types that need no training).
+    """
+    p = dict(DEFAULT_INDEX_PARAMS, **params)
+    if index_type == 'ivf_flat':
+        return p['nlist']
+    if index_type == 'ivf_pq':
+        return max(p['nlist'], 2 ** p['pq_bits'])
+    return 0
+
+def train_index(index, embeddings, sample_size=100000, seed=0):
+    """
+    Train an index on a random sample of the embeddings.
+    Indexes that need no training are left untouched.
+    """
+    if index.is_trained:
+        return index
+    embeddings_np = np.ascontiguousarray(embeddings, dtype='float32')
+    if len(embeddings_np) > sample_size:
+        rng = np.random.default_rng(seed)
+        sample = embeddings_np[rng.choice(len(embeddings_np), sample_size, replace=False)]
+    else:
+        sample = embeddings_np
+    index.train(sample)
+    return index
+
+def _base_index(index):
+    """Unwrap id-map wrappers to reach the index that owns the search parameters."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """
+    Set the recall/latency knobs of an index: nprobe for IVF indexes,
+    efSearch for HNSW. Parameters that do not apply to the index are ignored.
+    """
+    base = _base_index(index)
+    if nprobe is not None and isinstance(base, faiss.IndexIVF):
+        base.nprobe = nprobe
+    if ef_search is not None and isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+    return index
+
+def build_faiss_index(embeddings, index_type='flat', ids=None, nprobe=None, ef_search=None, **params):
     """
     Build a FAISS index from a list of embeddings.
+    Non-flat types are trained on a sample of the embeddings first.
+    If ids are given, search results are those ids rather than row positions.
     """
-    embeddings_np = np.array(embeddings).astype('float32')
+    embeddings_np = np.ascontiguousarray(embeddings, dtype='float32')
     dim = embeddings_np.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings_np)
+    index = make_index(index_type, dim, **params)
+    train_index(index, embeddings_np)
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+        index.add_with_ids(embeddings_np, np.asarray(ids, dtype='int64'))
+    else:
+        index.add(embeddings_np)
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
     return index
 
+def index_memory_bytes(index):
+    """Approximate memory footprint of an index, measured as its serialized size."""
+    return int(faiss.serialize_index(index).nbytes)
+
+def benchmark_index(index, queries, ground_truth, top_k=10):
+    """
+    Measure recall@k of an index against exact results, plus per-query latency.
+    Returns a dict with recall, p50/p99 latency in milliseconds and memory in bytes.
+    """
+    latencies = []
+    hits = 0
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, indices = index.search(queries[i:i + 1], top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(np.intersect1d(indices[0], ground_truth[i]))
+    latencies = np.array(latencies)
+    return {
+        'recall_at_k': hits / float(len(queries) * top_k),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'memory_bytes': index_memory_bytes(index),
+    }
+
+def run_index_benchmark(embeddings, queries, top_k=10, index_types=INDEX_TYPES,
+                        nprobes=(1, 8, 32), ef_searches=(16, 64, 256), **params):
+    """
+    Compare the index types against exact flat search over the same embeddings.
+    Every (index type, search parameter) pair is one result row.
+    """
+    embeddings_np = np.ascontiguousarray(embeddings, dtype='float32')
+    queries_np = np.ascontiguousarray(queries, dtype='float32')
+
+    exact = build_faiss_index(embeddings_np, 'flat')
+    _, ground_truth = exact.search(queries_np, top_k)
+
+    results = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_faiss_index(embeddings_np, index_type, **params)
+        build_seconds = time.perf_counter() - start
+
+        if index_type in ('ivf_flat', 'ivf_pq'):
+            settings = [{'nprobe': n} for n in nprobes]
+        elif index_type == 'hnsw':
+            settings = [{'ef_search': ef} for ef in ef_searches]
+        else:
+            settings = [{}]
+
+        for setting in settings:
+            set_search_params(index, **setting)
+            row = {'index_type': index_type, 'build_s': build_seconds, **setting}
+            row.update(benchmark_index(index, queries_np, ground_truth, top_k=top_k))
+            results.append(row)
+    return results
+
+def synthetic_embeddings(n, dim, n_clusters=256, seed=0):
+    """Generate clustered, normalized random vectors that stand in for a large corpus."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype('float32')
+    labels = rng.integers(0, n_clusters, n)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((n, dim)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
 def retrieve_documents(query, model, index, documents, top_k=3):
     """
     Retrieve the top_k documents relevant to the query.
@@ -40,9 +197,8 @@ def retrieve_documents(query, model, index, documents, top_k=3):
     results = [documents[i] for i in indices[0]]
     return results
 
-if __name__ == '__main__':
-    # Load the dataset (adjust filename as needed)
-    data_path = os.path.join('..','data', 'raw', 'arxiv_combined_documents.json')
+def demo(data_path):
+    """Build an index over a JSON corpus and run a sample query."""
     documents = load_documents(data_path)
     print(f"Loaded {len(documents)} documents.")
     
@@ -60,4 +216,70 @@ if __name__ == '__main__':
         print(f"\nResult {i+1}:")
         print("Title:", doc['title'])
         print("Abstract:", doc['text'][:300] + "...")
-        print("PDF Link:", doc['pdf_link'])
\ No newline at end of file
+        print("PDF Link:", doc['pdf_link'])
+
+def benchmark(args):
+    """Print recall@k, latency and memory for each index configuration."""
+    if args.synthetic:
+        corpus = synthetic_embeddings(args.synthetic + args.queries, args.dim)
+    else:
+        documents = load_documents(args.data)
+        embeddings, _ = create_embeddings(documents)
+        corpus = np.ascontiguousarray(embeddings, dtype='float32')
+    # Hold out the last rows as queries so they are not exact matches in the corpus;
+    # at most a fifth of a small corpus, so most of it is still indexed.
+    n_queries = min(args.queries, max(1, len(corpus) // 5))
+    if n_queries < args.queries:
+        print(f"Only {len(corpus)} vectors: holding out {n_queries} queries instead of {args.queries}.")
+    embeddings, queries = corpus[:-n_queries], corpus[-n_queries:]
+    print(f"Benchmarking {len(embeddings)} vectors, {len(queries)} queries, k={args.top_k}")
+
+    # About 39 training points per IVF cluster, as faiss recommends.
+    nlist = min(args.nlist, max(1, len(embeddings) // 39))
+    if nlist < args.nlist:
+        print(f"Using nlist={nlist} instead of {args.nlist} for {len(embeddings)} vectors.")
+    params = {'nlist': nlist, 'pq_m': args.pq_m, 'hnsw_m': args.hnsw_m}
+    index_types = []
+    for index_type in args.types:
+        needed = min_training_points(index_type, **params)
+        if len(embeddings) < needed:
+            print(f"Skipping {index_type}: it needs at least {needed} vectors to train, got {len(embeddings)}.")
+        else:
+            index_types.append(index_type)
+    results = run_index_benchmark(embeddings, queries, top_k=args.top_k, index_types=index_types,
+                                  nprobes=args.nprobe, ef_searches=args.ef_search, **params)
+
+    print(f"{'index':<10}{'param':<16}{'recall':>8}{'p50 ms':>10}{'p99 ms':>10}{'MB':>10}{'build s':>10}")
+    for row in results:
+        param = ", ".join(f"{key}={row[key]}" for key in ('nprobe', 'ef_search') if key in row)
+        print(f"{row['index_type']:<10}{param:<16}{row['recall_at_k']:>8.3f}{row['p50_ms']:>10.3f}"
+              f"{row['p99_ms']:>10.3f}{row['memory_bytes'] / 2**20:>10.1f}{row['build_s']:>10.2f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    default_data = os.path.join('..', 'data', 'raw', 'arxiv_combined_documents.json')
+    parser = argparse.ArgumentParser(description="Document retrieval demo and index benchmark.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    bench = subparsers.add_parser('benchmark', help="Compare ANN index types against exact search.")
+    bench.add_argument('--data', default=default_data, help="JSON corpus to embed (ignored with --synthetic).")
+    bench.add_argument('--synthetic', type=int, default=0, help="Use N synthetic vectors instead of the corpus.")
+    bench.add_argument('--dim', type=int, default=384, help="Dimension of synthetic vectors.")
+    bench.add_argument('--queries', type=int, default=200)
+    bench.add_argument('--top-k', type=int, default=10)
+    bench.add_argument('--types', nargs='+', default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    bench.add_argument('--nlist', type=int, default=DEFAULT_INDEX_PARAMS['nlist'])
+    bench.add_argument('--pq-m', type=int, default=DEFAULT_INDEX_PARAMS['pq_m'])
+    bench.add_argument('--hnsw-m', type=int, default=DEFAULT_INDEX_PARAMS['hnsw_m'])
+    bench.add_argument('--nprobe', type=int, nargs='+', default=[1, 8, 32])
+    bench.add_argument('--ef-search', type=int, nargs='+', default=[16, 64, 256])
+    bench.add_argument('--output', help="Optional JSON file for the results.")
+
+    args = parser.parse_args()
+    if args.command == 'benchmark':
+        benchmark(args)
+    else:
+        # Load the dataset (adjust filename as needed)
+        demo(default_data)
@@ -0,0 +1,386 @@
+# src/snapshot.py
+"""
+Portable snapshots of the corpus and its embeddings.
+
+A snapshot is a directory holding the rows as Parquet and every embedding
+matrix as a float32 .npy file (memory-mapped on load) next to a Parquet file
+of the matching ids and content hashes:
+    manifest.json                                model, dim, counts, base snapshot
+    topics.parquet, topic_documents.parquet      always complete (they are small)
+    documents.parquet, passages.parquet
+    document_embeddings.npy / .parquet           row i of the .npy is the vector of row i
+    passage_embeddings.npy / .parquet
+    deletions.parquet                            (kind, id) removed since the base (deltas only)
+
+A delta snapshot names its base and holds only documents and passages that
+are new or re-encoded since the base chain was written. Restoring a chain
+loads the rows into the node's own database (e.g. the SQLite fallback of a
+fresh node), builds the FAISS indexes straight from the .npy files and
+rebuilds the BM25 and metadata indexes, without reading the source database
+or encoding anything:
+    python snapshot.py write ../data/snapshots/base
+    python snapshot.py write ../data/snapshots/delta-1 --base ../data/snapshots/base
+    python snapshot.py restore ../data/snapshots/delta-1
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import insert, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import undefer_group
+
+from models import Base, Document, DocumentEmbedding, Passage, PassageEmbedding, Topic, topic_documents
+from db import session_scope
+from embedding_store import DEFAULT_EMBEDDING_MODEL
+from index_store import GLOBAL_INDEX, GLOBAL_PASSAGE_INDEX, index_path, new_index, save_index, topic_index_name
+from lexical_index import update_lexical_index
+from metadata_index import update_metadata
+
+SNAPSHOT_FORMAT = 1
+# Rows per Parquet record batch and per insert statement.
+BATCH_SIZE = 2000
+
+SCHEMAS = {
+    'topics': pa.schema([('id', pa.int64()), ('name', pa.string()), ('normalized_name', pa.string()),
+                         ('document_count', pa.int64())]),
+    'topic_documents': pa.schema([('topic_id', pa.int64()), ('document_id', pa.int64())]),
+    'documents': pa.schema([('id', pa.int64()), ('topic_id', pa.int64()), ('arxiv_id', pa.string()),
+                            ('arxiv_version', pa.int64()), ('title', pa.string()), ('title_hash', pa.string()),
+                            ('text', pa.string()), ('pdf_link', pa.string()), ('authors', pa.string()),
+                            ('fetch_date', pa.timestamp('us'))]),
+    'passages': pa.schema([('id', pa.int64()), ('document_id', pa.int64()), ('position', pa.int64()),
+                           ('text', pa.string()), ('document_hash', pa.string())]),
+    'embeddings': pa.schema([('id', pa.int64()), ('content_hash', pa.string())]),
+    'deletions': pa.schema([('kind', pa.string()), ('id', pa.int64())]),
+}
+
+# Snapshot contents per level: row table and its columns, embedding table and its id column.
+LEVELS = {
+    'document': ('documents', Document, DocumentEmbedding, DocumentEmbedding.document_id),
+    'passage': ('passages', Passage, PassageEmbedding, PassageEmbedding.passage_id),
+}
+
+def _write_rows(path, schema, rows):
+    """Stream dict rows into a Parquet file in record batches. Returns the row count."""
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+            count += len(batch)
+    return count
+
+def _read_rows(path):
+    """Yield the rows of a Parquet file as lists of dicts, one list per record batch."""
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=BATCH_SIZE):
+        yield batch.to_pylist()
+
+def read_manifest(path):
+    with open(os.path.join(path, 'manifest.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def snapshot_chain(path):
+    """The snapshot directories of a chain, base first, ending with path."""
+    chain = [os.path.abspath(path)]
+    while True:
+        base = read_manifest(chain[0]).get('base')
+        if base is None:
+            return chain
+        chain.insert(0, os.path.abspath(os.path.join(os.path.dirname(chain[0]), base)))
+
+def chain_state(path, level):
+    """
+    { id: content_hash or None } of the documents (or passages) a chain
+    holds after its deletions, for working out what a delta must contain.
+    """
+    table = LEVELS[level][0]
+    state = {}
+    for snapshot in snapshot_chain(path):
+        ids = pq.read_table(os.path.join(snapshot, f"{table}.parquet"), columns=['id']).column('id').to_pylist()
+        state.update(dict.fromkeys(ids))
+        embeddings = pq.read_table(os.path.join(snapshot, f"{level}_embeddings.parquet"))
+        state.update(zip(embeddings.column('id').to_pylist(), embeddings.column('content_hash').to_pylist()))
+        deletions_path = os.path.join(snapshot, 'deletions.parquet')
+        if os.path.exists(deletions_path):
+            for row in pq.read_table(deletions_path).to_pylist():
+                if row['kind'] == table:
+                    state.pop(row['id'], None)
+    return state
+
+def _write_level(session, path, level, model_name, base_state):
+    """Write one level's rows and embeddings; with base_state only new or changed ones. Returns the counts."""
+    table, model, embedding_model, id_column = LEVELS[level]
+    current = dict(session.query(model.id, embedding_model.content_hash)
+                   .outerjoin(embedding_model, (id_column == model.id) & (embedding_model.model_name == model_name))
+                   .all())
+    if base_state is None:
+        selected, deleted = sorted(current), []
+    else:
+        selected = sorted(i for i, digest in current.items() if i not in base_state or base_state[i] != digest)
+        deleted = sorted(set(base_state) - set(current))
+
+    columns = [column.name for column in model.__table__.columns]
+    def rows():
+        for start in range(0, len(selected), BATCH_SIZE):
+            query = session.query(model).filter(model.id.in_(selected[start:start + BATCH_SIZE])).order_by(model.id)
+            if model is Document:
+                query = query.options(undefer_group('content'))
+            for obj in query:
+                yield {name: getattr(obj, name) for name in columns}
+    n_rows = _write_rows(os.path.join(path, f"{table}.parquet"), SCHEMAS[table], rows())
+
+    # Vectors go straight into a memory-mapped .npy, row-aligned with the ids file.
+    embedded = [i for i in selected if current[i] is not None]
+    dim = session.query(embedding_model.dim).filter(embedding_model.model_name == model_name).limit(1).scalar() or 0
+    matrix = np.lib.format.open_memmap(os.path.join(path, f"{level}_embeddings.npy"), mode='w+',
+                                       dtype='float32', shape=(len(embedded), dim))
+    def embedding_rows():
+        row = 0
+        for start in range(0, len(embedded), BATCH_SIZE):
+            batch = session.query(id_column, embedding_model.content_hash, embedding_model.vector) \
+                .filter(embedding_model.model_name == model_name, id_column.in_(embedded[start:start + BATCH_SIZE])) \
+                .order_by(id_column).all()
+            for item_id, digest, vector in batch:
+                matrix[row] = np.frombuffer(vector, dtype='float32')
+                row += 1
+                yield {'id': item_id, 'content_hash': digest}
+    n_embeddings = _write_rows(os.path.join(path, f"{level}_embeddings.parquet"), SCHEMAS['embeddings'],
+                               embedding_rows())
+    matrix.flush()
+    del matrix
+    return {'rows': n_rows, 'embeddings': n_embeddings, 'deleted': deleted, 'dim': dim}
+
+def write_snapshot(session, path, base=None, model_name=DEFAULT_EMBEDDING_MODEL):
+    """
+    Write a snapshot of the database to the directory path. With base (the
+    path of an earlier snapshot) only what changed since that chain is written.
+    The directory is written under a temporary name and renamed when complete.
+    Returns the manifest.
+    """
+    if base is not None and read_manifest(base)['model_name'] != model_name:
+        raise ValueError(f"Base snapshot {base} holds embeddings of another model")
+    tmp_path = path.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    counts = {}
+    deletions = []
+    dim = 0
+    for level, (table, _, _, _) in LEVELS.items():
+        written = _write_level(session, tmp_path, level, model_name,
+                               chain_state(base, level) if base is not None else None)
+        counts[table] = written['rows']
+        counts[f"{level}_embeddings"] = written['embeddings']
+        deletions.extend({'kind': table, 'id': i} for i in written['deleted'])
+        dim = dim or written['dim']
+    counts['topics'] = _write_rows(os.path.join(tmp_path, 'topics.parquet'), SCHEMAS['topics'], (
+        {'id': t.id, 'name': t.name, 'normalized_name': t.normalized_name, 'document_count': t.document_count}
+        for t in session.query(Topic).order_by(Topic.id)))
+    counts['topic_documents'] = _write_rows(os.path.join(tmp_path, 'topic_documents.parquet'),
+                                            SCHEMAS['topic_documents'],
+                                            ({'topic_id': t, 'document_id': d}
+                                             for t, d in session.query(topic_documents).yield_per(BATCH_SIZE)))
+    if base is not None:
+        counts['deletions'] = _write_rows(os.path.join(tmp_path, 'deletions.parquet'), SCHEMAS['deletions'],
+                                          deletions)
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'model_name': model_name,
+        'dim': dim,
+        # Relative to the snapshot's parent directory, so a chain can be copied as a whole.
+        'base': os.path.relpath(os.path.abspath(base), os.path.dirname(os.path.abspath(path))) if base else None,
+        'counts': counts,
+    }
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return manifest
+
+def _upsert(session, table, rows, keys=('id',)):
+    """Insert rows, overwriting existing rows with the same primary key (given as keys)."""
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+        updates = {name: stmt.excluded[name] for name in rows[0] if name not in keys}
+        stmt = stmt.on_conflict_do_update(index_elements=list(keys), set_=updates) if updates \
+            else stmt.on_conflict_do_nothing(index_elements=list(keys))
+        session.execute(stmt, rows)
+    else:
+        for row in rows:
+            session.execute(table.delete().where(*(table.c[key] == row[key] for key in keys)))
+        session.execute(insert(table), rows)
+
+def _restore_rows(session, snapshot, model_name):
+    """Apply one snapshot of a chain to the database."""
+    deletions_path = os.path.join(snapshot, 'deletions.parquet')
+    if os.path.exists(deletions_path):
+        deletions = pq.read_table(deletions_path).to_pylist()
+        # Dependent rows are deleted explicitly rather than relying on ON DELETE CASCADE.
+        passage_ids = [row['id'] for row in deletions if row['kind'] == 'passages']
+        document_ids = [row['id'] for row in deletions if row['kind'] == 'documents']
+        for start in range(0, len(document_ids), BATCH_SIZE):
+            batch = document_ids[start:start + BATCH_SIZE]
+            passage_ids.extend(i for (i,) in session.query(Passage.id).filter(Passage.document_id.in_(batch)))
+        for start in range(0, len(passage_ids), BATCH_SIZE):
+            batch = passage_ids[start:start + BATCH_SIZE]
+            session.query(PassageEmbedding).filter(PassageEmbedding.passage_id.in_(batch)) \
+                .delete(synchronize_session=False)
+            session.query(Passage).filter(Passage.id.in_(batch)).delete(synchronize_session=False)
+        for start in range(0, len(document_ids), BATCH_SIZE):
+            batch = document_ids[start:start + BATCH_SIZE]
+            session.query(DocumentEmbedding).filter(DocumentEmbedding.document_id.in_(batch)) \
+                .delete(synchronize_session=False)
+            session.execute(topic_documents.delete().where(topic_documents.c.document_id.in_(batch)))
+            session.query(Document).filter(Document.id.in_(batch)).delete(synchronize_session=False)
+
+    for rows in _read_rows(os.path.join(snapshot, 'topics.parquet')):
+        _upsert(session, Topic.__table__, rows)
+    for rows in _read_rows(os.path.join(snapshot, 'documents.parquet')):
+        _upsert(session, Document.__table__, rows)
+    for rows in _read_rows(os.path.join(snapshot, 'topic_documents.parquet')):
+        _upsert(session, topic_documents, rows, keys=('topic_id', 'document_id'))
+    for rows in _read_rows(os.path.join(snapshot, 'passages.parquet')):
+        _upsert(session, Passage.__table__, rows)
+
+    for level, (_, _, embedding_model, id_column) in LEVELS.items():
+        vectors = np.load(os.path.join(snapshot, f"{level}_embeddings.npy"), mmap_mode='r')
+        row = 0
+        for rows in _read_rows(os.path.join(snapshot, f"{level}_embeddings.parquet")):
+            batch = vectors[row:row + len(rows)]
+            row += len(rows)
+            _upsert(session, embedding_model.__table__, [
+                {id_column.name: item['id'], 'model_name': model_name, 'content_hash': item['content_hash'],
+                 'dim': vectors.shape[1], 'vector': np.ascontiguousarray(vector).tobytes()}
+                for item, vector in zip(rows, batch)
+            ], keys=(id_column.name, 'model_name'))
+
+def _reset_sequences(session):
+    """Move PostgreSQL id sequences past the restored ids so new inserts do not collide."""
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+    for table in ('topics', 'documents', 'passages'):
+        session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 1))"
+        ))
+
+def snapshot_embeddings(chain, level):
+    """
+    The embeddings a chain holds after its deletions, read from the
+    memory-mapped .npy files; later snapshots override earlier ones.
+    Returns (ids, matrix).
+    """
+    table = LEVELS[level][0]
+    ids, matrices, deleted = [], [], []
+    for snapshot in chain:
+        ids.append(pq.read_table(os.path.join(snapshot, f"{level}_embeddings.parquet"),
+                                 columns=['id']).column('id').to_numpy())
+        matrices.append(np.load(os.path.join(snapshot, f"{level}_embeddings.npy"), mmap_mode='r'))
+        deletions_path = os.path.join(snapshot, 'deletions.parquet')
+        if os.path.exists(deletions_path):
+            deletions = pq.read_table(deletions_path)
+            kinds = deletions.column('kind').to_pylist()
+            deleted.extend(i for kind, i in zip(kinds, deletions.column('id').to_pylist()) if kind == table)
+    all_ids = np.concatenate(ids) if ids else np.empty(0, dtype='int64')
+    if len(all_ids) == 0:
+        return all_ids, np.empty((0, 0), dtype='float32')
+    # Keep the last occurrence of every id: unique over the reversed order.
+    _, last = np.unique(all_ids[::-1], return_index=True)
+    keep = np.sort(len(all_ids) - 1 - last)
+    keep = keep[~np.isin(all_ids[keep], deleted)]
+    offsets = np.cumsum([0] + [len(m) for m in matrices])
+    matrix = np.empty((len(keep), matrices[-1].shape[1] or matrices[0].shape[1]), dtype='float32')
+    for n, m in enumerate(matrices):
+        rows = keep[(keep >= offsets[n]) & (keep < offsets[n + 1])]
+        if len(rows):
+            matrix[np.searchsorted(keep, rows)] = m[rows - offsets[n]]
+    return all_ids[keep].astype('int64'), matrix
+
+def _build_index(name, ids, matrix, model_name):
+    if len(ids) == 0:
+        return
+    index = new_index(matrix)
+    index.add_with_ids(matrix, ids)
+    save_index(index, index_path(name, model_name))
+
+def restore_snapshot(path, session):
+    """
+    Bring a node up from a snapshot chain: load the rows and embeddings into
+    the session's database and build every FAISS, BM25 and metadata index.
+    Meant for an empty database or one restored from the same chain.
+    Returns the manifest of the last snapshot.
+    """
+    chain = snapshot_chain(path)
+    manifest = read_manifest(chain[-1])
+    model_name = manifest['model_name']
+    try:
+        for snapshot in chain:
+            _restore_rows(session, snapshot, model_name)
+        _reset_sequences(session)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    # Topic membership decides which vectors go into which topic index.
+    links = pq.read_table(os.path.join(chain[-1], 'topic_documents.parquet'))
+    link_topics = links.column('topic_id').to_numpy()
+    link_documents = links.column('document_id').to_numpy()
+    passage_documents = {}
+    for snapshot in chain:
+        passages = pq.read_table(os.path.join(snapshot, 'passages.parquet'), columns=['id', 'document_id'])
+        passage_documents.update(zip(passages.column('id').to_pylist(), passages.column('document_id').to_pylist()))
+
+    doc_ids, doc_matrix = snapshot_embeddings(chain, 'document')
+    passage_ids, passage_matrix = snapshot_embeddings(chain, 'passage')
+    passage_owner = np.array([passage_documents.get(int(i), -1) for i in passage_ids], dtype='int64')
+    _build_index(GLOBAL_INDEX, doc_ids, doc_matrix, model_name)
+    _build_index(GLOBAL_PASSAGE_INDEX, passage_ids, passage_matrix, model_name)
+    for topic_id in np.unique(link_topics):
+        members = link_documents[link_topics == topic_id]
+        rows = np.isin(doc_ids, members)
+        _build_index(topic_index_name(int(topic_id)), doc_ids[rows], doc_matrix[rows], model_name)
+        rows = np.isin(passage_owner, members)
+        _build_index(topic_index_name(int(topic_id), level='passage'), passage_ids[rows], passage_matrix[rows],
+                     model_name)
+        update_lexical_index(session, topic_index_name(int(topic_id)), topic_id=int(topic_id))
+    update_lexical_index(session, GLOBAL_INDEX)
+    update_metadata(session)
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write or restore Parquet/.npy snapshots.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    write = subparsers.add_parser('write', help="Snapshot the configured database.")
+    write.add_argument('path')
+    write.add_argument('--base', help="Earlier snapshot to write a delta against.")
+    write.add_argument('--model', default=DEFAULT_EMBEDDING_MODEL)
+    restore = subparsers.add_parser('restore', help="Load a snapshot chain into the configured database.")
+    restore.add_argument('path')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with session_scope() as session:
+        if args.command == 'write':
+            manifest = write_snapshot(session, args.path, base=args.base, model_name=args.model)
+        else:
+            # A fresh node starts without tables.
+            Base.metadata.create_all(session.get_bind())
+            manifest = restore_snapshot(args.path, session)
+    print(f"{args.command} {args.path}: {manifest['counts']} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,57 @@
+# tests/test_arxiv_fetcher.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from arxiv_fetcher import ArxivFetcher, checkpoint_path
+from arxiv_stub_server import load_corpora, start_stub_server
+
+TOPIC = "deep learning"
+
+@pytest.fixture
+def stub_url():
+    server, base_url = start_stub_server(port=0)
+    yield base_url
+    server.shutdown()
+
+def make_fetcher(base_url, checkpoint_dir):
+    return ArxivFetcher(base_url=base_url, page_size=10, max_workers=4, min_interval=0,
+                        backoff=0.01, checkpoint_dir=str(checkpoint_dir))
+
+def expected_ids(n):
+    docs = load_corpora()[TOPIC][:n]
+    return [doc['pdf_link'].replace("/pdf/", "/abs/").removesuffix(".pdf") for doc in docs]
+
+def test_iter_pages_yields_pages_in_offset_order(stub_url, tmp_path):
+    fetcher = make_fetcher(stub_url, tmp_path)
+    pages = list(fetcher.iter_pages([TOPIC], total_results=45, checkpoint=False))
+
+    assert [offset for _, offset, _ in pages] == [0, 10, 20, 30, 40]
+    assert [entry.id for _, _, entries in pages for entry in entries] == expected_ids(45)
+
+def test_iter_pages_resumes_from_checkpoint_with_stored_ids(stub_url, tmp_path):
+    fetcher = make_fetcher(stub_url, tmp_path)
+    stored = {}
+    pages = fetcher.iter_pages([TOPIC], total_results=45, stored=stored)
+    for n, (topic, _, entries) in enumerate(pages):
+        stored[topic].extend(entry.id for entry in entries)
+        if n == 1:
+            # Interrupted while the second page is being processed.
+            break
+    pages.close()
+
+    resumed = {}
+    offsets = []
+    for topic, offset, entries in fetcher.iter_pages([TOPIC], total_results=45, stored=resumed):
+        if not offsets:
+            # Filled from the checkpoint: only the first page was fully processed.
+            assert resumed[topic] == expected_ids(10)
+        offsets.append(offset)
+        resumed[topic].extend(entry.id for entry in entries)
+
+    assert offsets == [10, 20, 30, 40]
+    assert resumed[TOPIC] == expected_ids(45)
+    assert not os.path.exists(checkpoint_path(TOPIC, str(tmp_path)))
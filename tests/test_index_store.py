@@ -0,0 +1,31 @@
+# tests/test_index_store.py
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+# index_store imports the database module; no database is used here.
+os.environ.setdefault("DB_SQLITE_FALLBACK", "1")
+
+from index_store import id_selector, new_index, search_index
+
+def test_filtered_search_returns_only_allowed_ids():
+    rng = np.random.default_rng(0)
+    embeddings = rng.random((200, 16), dtype='float32')
+    # Indexed ids run well past max(allowed), so a bitmap sized in bits instead
+    # of bytes would read past its end and admit them.
+    ids = np.arange(200, dtype='int64') * 50
+    index = new_index(embeddings, index_type='flat')
+    index.add_with_ids(embeddings, ids)
+
+    allowed = [0, 50, 1000]
+    _, found = search_index(index, embeddings[150], top_k=10, ids=allowed)
+    found = [i for i in found[0] if i != -1]
+    assert found and set(found) <= set(allowed)
+
+def test_id_selector_excludes_ids_past_the_bitmap():
+    selector = id_selector([1000])
+    assert selector.is_member(1000)
+    assert not selector.is_member(999)
+    assert not selector.is_member(5000)